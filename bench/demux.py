@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Compare extracting a track from an mkv all at once with --parallel-demux.
+
+usage: bench/demux.py [options] <mkvfile>
+
+options:
+ --parts=<parts>:
+  Extract in up to this many parts at once. The default is the CPU count.
+ --track=<track>:
+  The mkvextract track ID to extract. The default is 0.
+ --sizes=<size>,...:
+  Cut copies of the first <size> of <mkvfile> (e.g., 256M,1G,4G) into
+  --work-dir and time those, to find the size at which parallel wins.
+ --work-dir=<dir>:
+  Where to write cut copies and extracted streams. Run once with this on
+  each kind of storage to compare them. The default is <mkvfile>'s directory.
+ --drop-caches:
+  Drop the page cache before each run (needs root), to time cold reads.
+ --mkvextract=<mkvextract>:
+  Use <mkvextract> as the mkvextract command.
+
+For each file, prints its size, the storage it's on, how long each way took,
+and whether both gave the same bytes; then the smallest size at which
+parallel was faster.
+"""
+
+import os
+import sys
+import time
+import getopt
+import hashlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import simplemkv.ebml  # noqa: E402
+import simplemkv.demux  # noqa: E402
+import simplemkv.sched  # noqa: E402
+import simplemkv.tomp4  # noqa: E402
+
+
+def storage_type(path):
+    """'nvme', 'ssd', 'hdd' or 'unknown', for the device *path* is on."""
+    dev = simplemkv.sched.path_device(path)
+    if dev is None:
+        return 'unknown'
+    sysdir = '/sys/dev/block/%d:%d' % (os.major(dev), os.minor(dev))
+    try:
+        real = os.path.realpath(sysdir)
+    except OSError:
+        return 'unknown'
+    name = os.path.basename(real)
+    for d in (real, os.path.dirname(real)):
+        rot = os.path.join(d, 'queue', 'rotational')
+        if os.path.exists(rot):
+            f = open(rot)
+            try:
+                rotational = f.read().strip() == '1'
+            finally:
+                f.close()
+            if rotational:
+                return 'hdd'
+            if (name.startswith('nvme') or
+                    os.path.basename(d).startswith('nvme')):
+                return 'nvme'
+            return 'ssd'
+    return 'unknown'
+
+
+def drop_caches():
+    os.system('sync')
+    try:
+        f = open('/proc/sys/vm/drop_caches', 'w')
+        try:
+            f.write('3\n')
+        finally:
+            f.close()
+    except (IOError, OSError):
+        sys.stderr.write('warning: can\'t drop caches, timing warm reads\n')
+
+
+def sha1(path):
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def cut(mkv, out, size):
+    """Write to *out* the clusters in about the first *size* bytes of *mkv*."""
+    src = open(mkv, 'rb')
+    try:
+        layout = simplemkv.ebml.read_layout(src)
+        points = simplemkv.ebml.cue_points(src, layout)
+        first = layout.first_cluster or points[0][1]
+        last = layout.segment_end
+        for t, pos in points:
+            if pos >= first + size:
+                last = pos
+                break
+        dst = open(out, 'wb')
+        try:
+            simplemkv.ebml.write_range(src, dst, layout, first, last)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def bench(mkv, workdir, parts, track, mkvextract, cold):
+    def extract(m, outs):
+        simplemkv.tomp4.command(simplemkv.tomp4.mkv_extract_track_cmd(
+            m, outs[0], track, mkvextract=mkvextract))
+    base = os.path.join(workdir, os.path.basename(mkv))
+    seqout, parout = base + '.seq.raw', base + '.par.raw'
+    try:
+        if cold:
+            drop_caches()
+        start = time.time()
+        extract(mkv, [seqout])
+        seq = time.time() - start
+        if cold:
+            drop_caches()
+        start = time.time()
+        used = simplemkv.demux.parallel_extract(
+            mkv, [parout], parts, extract, track + 1,
+            errorfunc=simplemkv.tomp4.eprint,
+        )
+        par = time.time() - start
+        same = sha1(seqout) == sha1(parout)
+    finally:
+        for p in (seqout, parout):
+            if os.path.exists(p):
+                os.remove(p)
+    return seq, par, used, same
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        options, args = getopt.gnu_getopt(argv[1:], 'h', [
+            'help', 'parts=', 'track=', 'sizes=', 'work-dir=', 'drop-caches',
+            'mkvextract=',
+        ])
+    except getopt.GetoptError:
+        et, ev, tb = sys.exc_info()
+        simplemkv.tomp4.die(str(ev))
+    parts = simplemkv.sched.cpu_count()
+    track, sizes, workdir, cold, mkvextract = 0, [], None, False, None
+    for opt, optarg in options:
+        if opt in ('-h', '--help'):
+            sys.stdout.write(__doc__)
+            return
+        elif opt == '--parts':
+            parts = int(optarg)
+        elif opt == '--track':
+            track = int(optarg)
+        elif opt == '--sizes':
+            sizes = sorted(simplemkv.tomp4.parse_size(s)
+                           for s in optarg.split(','))
+        elif opt == '--work-dir':
+            workdir = optarg
+        elif opt == '--drop-caches':
+            cold = True
+        elif opt == '--mkvextract':
+            mkvextract = optarg
+    if len(args) != 1:
+        simplemkv.tomp4.die('usage: bench/demux.py [options] <mkvfile>')
+    mkv = args[0]
+    if workdir is None:
+        workdir = os.path.dirname(os.path.abspath(mkv))
+    files = []
+    for size in sizes:
+        out = os.path.join(workdir,
+                           '%s.%d.mkv' % (os.path.basename(mkv), size))
+        cut(mkv, out, size)
+        files.append((out, True))
+    if not sizes:
+        files.append((mkv, False))
+    storage = storage_type(workdir)
+    print('%12s %8s %10s %10s %6s %8s %s' % (
+        'size', 'storage', 'sequential', 'parallel', 'parts', 'speedup',
+        'same'))
+    crossover = None
+    try:
+        for path, temp in files:
+            size = os.path.getsize(path)
+            seq, par, used, same = bench(path, workdir, parts, track,
+                                         mkvextract, cold)
+            print('%12d %8s %9.2fs %9.2fs %6d %7.2fx %s' % (
+                size, storage, seq, par, used, seq / max(par, 1e-9), same))
+            if par < seq and crossover is None:
+                crossover = size
+            elif par >= seq:
+                crossover = None
+    finally:
+        for path, temp in files:
+            if temp and os.path.exists(path):
+                os.remove(path)
+    if crossover is None:
+        print('parallel was not faster at the largest size')
+    else:
+        print('parallel was faster from %d bytes on %s storage' % (
+            crossover, storage))
+        print('(e.g., --parallel-demux=%d --parallel-demux-min-size=%dM)' % (
+            parts, crossover // (1 << 20) or 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""A stand-in for mkvinfo, mkvextract, MP4Box or ffmpeg, for load-testing
+mkvtomp4 without media or the real tools.
+
+usage: bench/fake_tool.py <tool> <arguments>...
+
+<tool> is mkvinfo, mkvextract, MP4Box or ffmpeg, and <arguments> are those
+mkvtomp4 would pass the real one. It writes outputs of the right kind
+(raw streams, or an mp4 that passes --verify) but of a set size, after a
+set time. bench/load.py makes wrappers running this as each tool, for
+--mkvinfo, --mkvextract, --mp4box and --ffmpeg.
+
+It is set up with environment variables, each of which may also be given
+for one tool, e.g., FAKE_MKVEXTRACT_LATENCY overrides FAKE_TOOL_LATENCY:
+
+ FAKE_TOOL_LATENCY=<seconds>[:<max-seconds>]:
+  Take this long, or a random time in the range. The default is 0.
+ FAKE_TOOL_SIZE=<bytes>:
+  Write outputs of about this size. The default is 65536.
+ FAKE_TOOL_FAIL_RATE=<fraction>:
+  Fail this fraction of the time, at random. The default is 0.
+ FAKE_TOOL_HANG_RATE=<fraction>:
+  Hang, writing nothing, this fraction of the time. The default is 0.
+ FAKE_TOOL_PROGRESS=<lines>:
+  Write this many progress lines while running. The default is 0.
+ FAKE_TOOL_DURATION=<seconds>:
+  The duration mkvinfo reports, and outputs have. The default is 100.
+ FAKE_TOOL_AUDIO=<codec>,...:
+  The audio codec mkvinfo reports, e.g., AC3 or AAC, picked for each file
+  from the list by a hash of its name. The default is AC3.
+ FAKE_TOOL_SUBTITLES=<none|text|pgs>,...:
+  The subtitles mkvinfo reports, picked like the audio. The default is text.
+ FAKE_TOOL_LOG=<file>:
+  Append "<tool> <start> <end> <status>" to <file> for each run.
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+import struct
+
+# Enough of a raw H.264 stream for the level at byte 7 (5.1) to be read.
+h264_header = b'\0\0\0\1gM\0\x33'
+fill_chunk = 1 << 16
+
+mkvinfo_tracks = """\
++ EBML head
+|+ EBML version: 1
++ Segment: size %(size)d
+|+ Segment information
+| + Timestamp scale: 1000000
+| + Duration: %(duration)s
+|+ Segment tracks
+| + Track
+|  + Track number: 1 (track ID for mkvmerge & mkvextract: 0)
+|  + Track type: video
+|  + Codec ID: V_MPEG4/ISO/AVC
+|  + Default duration: 00:00:00.041708333\
+ (23.976 frames/fields per second for a video track)
+|  + Language: und
+|  + Video track
+|   + Pixel width: 1920
+|   + Pixel height: 1080
+|  + Codec's private data: size 48 (H.264 profile: High @L5.1)
+| + Track
+|  + Track number: 2 (track ID for mkvmerge & mkvextract: 1)
+|  + Track type: audio
+|  + Codec ID: A_%(audio)s
+|  + Language: eng
+|  + Audio track
+|   + Sampling frequency: 48000
+|   + Channels: 6
+"""
+mkvinfo_subtitles = """\
+| + Track
+|  + Track number: 3 (track ID for mkvmerge & mkvextract: 2)
+|  + Track type: subtitles
+|  + Codec ID: S_%(subtitles)s
+|  + Language: eng
+"""
+
+
+def setting(tool, name, default):
+    value = os.environ.get('FAKE_%s_%s' % (tool.upper(), name))
+    if value is None:
+        value = os.environ.get('FAKE_TOOL_' + name)
+    if value is None or value == '':
+        return default
+    return value
+
+
+def pick(tool, name, default, path):
+    """One of the comma-separated choices of setting *name*, the same for
+    every run on *path*."""
+    choices = setting(tool, name, default).split(',')
+    crc = zlib.crc32(os.path.basename(path).encode('utf_8'))
+    return choices[crc % len(choices)]
+
+
+def format_duration(secs):
+    return '%02d:%02d:%012.9f' % (secs // 3600, secs // 60 % 60, secs % 60)
+
+
+def write_filled(path, size, head=b''):
+    f = open(path, 'wb')
+    try:
+        f.write(head)
+        left = max(size - len(head), 0)
+        chunk = b'\0' * fill_chunk
+        while left > 0:
+            f.write(chunk[:left])
+            left -= len(chunk)
+    finally:
+        f.close()
+
+
+def box(typ, payload):
+    return struct.pack('>I4s', 8 + len(payload), typ) + payload
+
+
+def full_box(typ, payload):
+    return box(typ, struct.pack('>I', 0) + payload)
+
+
+def packed_language(lang):
+    return ((ord(lang[0]) - 0x60) << 10 | (ord(lang[1]) - 0x60) << 5 |
+            (ord(lang[2]) - 0x60))
+
+
+def trak(handler, codec, timescale, delta, samples, lang, offset):
+    mdhd = full_box(b'mdhd', struct.pack(
+        '>IIIIHH', 0, 0, timescale, delta * samples, packed_language(lang), 0))
+    hdlr = full_box(b'hdlr', struct.pack('>I4s12x', 0, handler) + b'\0')
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + box(codec, b'\0' * 8))
+    stts = full_box(b'stts', struct.pack('>III', 1, samples, delta))
+    stsz = full_box(b'stsz', struct.pack('>II', 1, samples))
+    stco = full_box(b'stco', struct.pack('>II', 1, offset))
+    stbl = box(b'stbl', stsd + stts + stsz + stco)
+    return box(b'trak', box(b'mdia', mdhd + hdlr + box(b'minf', stbl)))
+
+
+def write_mp4(path, size, duration, subtitles):
+    """Write an mp4 of about *size* bytes, with the tracks mkvtomp4 expects
+    of *duration* seconds: H.264 video, AAC audio and, if *subtitles*, text."""
+    ftyp = box(b'ftyp', b'isom\0\0\0\0')
+    mdat_size = max(size - 1024, 64)
+    offset = len(ftyp) + 8
+    traks = trak(b'vide', b'avc1', 24000, 1001,
+                 int(round(duration * 24000 / 1001)), 'und', offset)
+    traks += trak(b'soun', b'mp4a', 48000, 1024,
+                  int(round(duration * 48000 / 1024)), 'eng', offset)
+    if subtitles:
+        traks += trak(b'sbtl', b'tx3g', 1000, 1000, 10, 'eng', offset)
+    f = open(path, 'wb')
+    try:
+        f.write(ftyp + struct.pack('>I4s', 8 + mdat_size, b'mdat'))
+        chunk = b'\0' * fill_chunk
+        left = mdat_size
+        while left > 0:
+            f.write(chunk[:left])
+            left -= len(chunk)
+        f.write(box(b'moov', traks))
+    finally:
+        f.close()
+
+
+def has_subtitles(mp4):
+    """Whether the mp4 *mp4* (one we wrote, with moov last) has subtitles."""
+    try:
+        f = open(mp4, 'rb')
+    except (IOError, OSError):
+        return False
+    try:
+        f.seek(max(os.path.getsize(mp4) - 4096, 0))
+        return b'sbtl' in f.read()
+    finally:
+        f.close()
+
+
+def mkvinfo(args, size, duration):
+    mkv = args[-1]
+    audio = pick('mkvinfo', 'AUDIO', 'AC3', mkv)
+    subtitles = {'text': 'TEXT/UTF8', 'pgs': 'HDMV/PGS'}.get(
+        pick('mkvinfo', 'SUBTITLES', 'text', mkv))
+    out = mkvinfo_tracks % {
+        'size': size, 'duration': format_duration(duration), 'audio': audio,
+    }
+    if subtitles is not None:
+        out += mkvinfo_subtitles % {'subtitles': subtitles}
+    sys.stdout.write(out + '|+ Cluster\n')
+
+
+def mkvextract(args, size, duration):
+    for spec in args[2:]:
+        track, sep, out = spec.partition(':')
+        if not sep or not track.isdigit():
+            continue
+        if out.endswith('.srt'):
+            write_filled(out, 0, b'1\n00:00:01,000 --> 00:00:02,000\nfake\n')
+        elif track == '0':
+            write_filled(out, size, h264_header)
+        else:
+            write_filled(out, size)
+
+
+def mp4box(args, size, duration):
+    if '-new' in args:
+        out = args[args.index('-new') + 1]
+        write_mp4(out, size, duration, any('.srt' in a for a in args))
+    elif '-out' in args:
+        write_filled(args[args.index('-out') + 1], size)
+
+
+def ffmpeg(args, size, duration):
+    out = args[-1]
+    if out.startswith('pipe:'):
+        # --stream: write the fragmented mp4's bytes to the fd given.
+        fd = int(out[len('pipe:'):] or 1)
+        left = size
+        chunk = b'\0' * fill_chunk
+        while left > 0:
+            left -= os.write(fd, chunk[:left])
+    elif out.endswith('.mp4'):
+        inputs = [args[i + 1] for i, a in enumerate(args) if a == '-i']
+        subtitles = 'mov_text' in args or any(has_subtitles(i) for i in inputs)
+        write_mp4(out, size, duration, subtitles)
+    else:
+        write_filled(out, size)
+
+
+tools = {
+    'mkvinfo': mkvinfo,
+    'mkvextract': mkvextract,
+    'MP4Box': mp4box,
+    'ffmpeg': ffmpeg,
+}
+
+
+def log(tool, start, status):
+    path = os.environ.get('FAKE_TOOL_LOG')
+    if not path:
+        return
+    line = '%s %.6f %.6f %s\n' % (tool, start, time.time(), status)
+    # One write to an O_APPEND file, so lines from tools running at once
+    # don't mix.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('ascii'))
+    finally:
+        os.close(fd)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    start = time.time()
+    if len(argv) < 2 or argv[1] not in tools:
+        sys.stderr.write('usage: %s <%s> <arguments>...\n'
+                         % (argv[0], '|'.join(sorted(tools))))
+        sys.exit(2)
+    tool, args = argv[1], argv[2:]
+    latency = setting(tool, 'LATENCY', '0').split(':')
+    latency = random.uniform(float(latency[0]), float(latency[-1]))
+    size = int(setting(tool, 'SIZE', '65536'))
+    duration = float(setting(tool, 'DURATION', '100'))
+    progress = int(setting(tool, 'PROGRESS', '0'))
+    if random.random() < float(setting(tool, 'HANG_RATE', '0')):
+        log(tool, start, 'hang')
+        while True:
+            time.sleep(3600)
+    # ffmpeg reports progress on stderr, the others on stdout.
+    progressf = sys.stderr if tool == 'ffmpeg' else sys.stdout
+    for i in range(progress):
+        time.sleep(latency / progress)
+        progressf.write('Progress: %d%%\n' % ((i + 1) * 100 // progress))
+        progressf.flush()
+    if not progress:
+        time.sleep(latency)
+    if random.random() < float(setting(tool, 'FAIL_RATE', '0')):
+        log(tool, start, 'fail')
+        sys.stderr.write('Error: simulated failure\n')
+        sys.exit(2)
+    tools[tool](args, size, duration)
+    log(tool, start, 'ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""Load-test mkvtomp4 itself: convert a large batch of synthetic mkv files
+with stand-ins for the tools (bench/fake_tool.py), and measure how fast the
+jobs go through and what mkvtomp4 uses doing it. Needs Linux (/proc).
+
+usage: bench/load.py [options] [-- <mkvtomp4 options>...]
+
+options:
+ --files=<count>:
+  Convert this many files. The default is 1000.
+ --jobs=<jobs>:
+  Run mkvtomp4 with --jobs=<jobs>. The default is the CPU count.
+ --workers=<workers>:
+  Instead, submit the files to a --queue-dir and run this many --worker
+  processes at once.
+ --latency=<seconds>[:<max-seconds>]:
+  How long each tool takes to run. The default is 0.01.
+ --size=<size>:
+  How big each tool's outputs are, e.g., 64K. The default is 64K.
+ --mkv-size=<size>:
+  How big each (sparse) mkv file is, e.g., 4G. The default is 1G.
+ --fail-rate=<fraction>:
+  How often each tool fails. The default is 0.
+ --progress=<lines>:
+  How many progress lines each tool writes. The default is 10.
+ --audio=<codec>,...:
+  The audio codecs of the files. The default is AC3 (converted to AAC).
+ --subtitles=<none|text|pgs>,...:
+  The subtitles of the files. The default is text.
+ --work-dir=<dir>:
+  Where to make the files. The default is a temporary directory, removed
+  afterwards.
+ --mkvtomp4=<mkvtomp4>:
+  The mkvtomp4 to test. The default is the one in this source tree.
+
+Reports jobs per second; how long the tools ran, and how much of the rest
+of the time (including starting each stand-in) job slots spent between
+them; the peak memory (RSS) and open file descriptors of mkvtomp4; the most
+tools running at once; and any temporary files left behind by jobs that
+succeeded.
+"""
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import threading
+import subprocess as sp
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import simplemkv.sched  # noqa: E402
+import simplemkv.tomp4  # noqa: E402
+
+tool_options = (
+    ('mkvinfo', '--mkvinfo'),
+    ('mkvextract', '--mkvextract'),
+    ('MP4Box', '--mp4box'),
+    ('ffmpeg', '--ffmpeg'),
+)
+sample_seconds = 0.1
+
+
+def make_tools(d):
+    """Write wrappers running bench/fake_tool.py as each tool into *d*, and
+    return the mkvtomp4 options using them."""
+    os.makedirs(d)
+    fake = os.path.join(here, 'fake_tool.py')
+    opts = []
+    for tool, opt in tool_options:
+        path = os.path.join(d, tool)
+        f = open(path, 'w')
+        try:
+            f.write('#!/bin/sh\nexec %s %s %s "$@"\n' % (
+                simplemkv.tomp4.sq([sys.executable]),
+                simplemkv.tomp4.sq([fake]), tool))
+        finally:
+            f.close()
+        os.chmod(path, 0o755)
+        opts.append('%s=%s' % (opt, path))
+    return opts
+
+
+def make_mkvs(d, count, size):
+    os.makedirs(d)
+    mkvs = []
+    for i in range(count):
+        path = os.path.join(d, 'f%06d.mkv' % i)
+        f = open(path, 'wb')
+        try:
+            f.truncate(size)
+        finally:
+            f.close()
+        mkvs.append(path)
+    return mkvs
+
+
+def proc_status(pid):
+    """``(rss, peak rss)`` in bytes and the number of open fds of *pid*, or
+    ``None`` if it's gone."""
+    try:
+        f = open('/proc/%d/status' % pid)
+        try:
+            status = f.read()
+        finally:
+            f.close()
+        fds = len(os.listdir('/proc/%d/fd' % pid))
+    except (IOError, OSError):
+        return None
+    mem = {}
+    for line in status.split('\n'):
+        key, sep, value = line.partition(':')
+        if key in ('VmRSS', 'VmHWM'):
+            mem[key] = int(value.split()[0]) * 1024
+    return mem.get('VmRSS', 0), mem.get('VmHWM', 0), fds
+
+
+class Monitor(object):
+    """Samples the memory and fds of running processes."""
+
+    def __init__(self):
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self.peak_total_rss = 0
+
+    def sample(self, procs):
+        total = 0
+        for proc in procs:
+            st = proc_status(proc.pid)
+            if st is None:
+                continue
+            rss, hwm, fds = st
+            self.peak_rss = max(self.peak_rss, hwm)
+            self.peak_fds = max(self.peak_fds, fds)
+            total += rss
+        self.peak_total_rss = max(self.peak_total_rss, total)
+
+    def wait(self, procs):
+        while [p for p in procs if p.poll() is None]:
+            self.sample([p for p in procs if p.returncode is None])
+            time.sleep(sample_seconds)
+        return [p.returncode for p in procs]
+
+
+def read_log(path):
+    runs = []
+    try:
+        f = open(path)
+    except (IOError, OSError):
+        return runs
+    try:
+        for line in f:
+            tool, start, end, status = line.split()
+            runs.append((tool, float(start), float(end), status))
+    finally:
+        f.close()
+    return runs
+
+
+def most_at_once(runs):
+    events = []
+    for tool, start, end, status in runs:
+        events.append((start, 1))
+        events.append((end, -1))
+    most = now = 0
+    for t, change in sorted(events):
+        now += change
+        most = max(most, now)
+    return most
+
+
+def leftovers(mkvdir, failed):
+    """Files other than the mkvs and what mkvtomp4 makes of them (the mp4,
+    and the subtitles, which it keeps) left by jobs that didn't fail,
+    counted by what follows the mkv's name."""
+    counts = {}
+    for name in os.listdir(mkvdir):
+        stem = name[:len('f000000')]
+        if (stem in failed or
+                name[len(stem):] in ('.mkv', '.mp4', '.srt', '.sup')):
+            continue
+        kind = name[len(stem):]
+        counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        options, extra = getopt.gnu_getopt(argv[1:], 'h', [
+            'help', 'files=', 'jobs=', 'workers=', 'latency=', 'size=',
+            'mkv-size=', 'fail-rate=', 'progress=', 'audio=', 'subtitles=',
+            'work-dir=', 'mkvtomp4=',
+        ])
+    except getopt.GetoptError:
+        et, ev, tb = sys.exc_info()
+        simplemkv.tomp4.die(str(ev))
+    files, jobs, workers = 1000, simplemkv.sched.cpu_count(), None
+    mkvsize, workdir = 1 << 30, None
+    mkvtomp4 = os.path.join(here, '..', 'mkvtomp4.py')
+    env = dict(os.environ)
+    env.update({
+        'FAKE_TOOL_LATENCY': '0.01', 'FAKE_TOOL_SIZE': '65536',
+        'FAKE_TOOL_FAIL_RATE': '0', 'FAKE_TOOL_PROGRESS': '10',
+        'FAKE_TOOL_AUDIO': 'AC3', 'FAKE_TOOL_SUBTITLES': 'text',
+    })
+    for opt, optarg in options:
+        if opt in ('-h', '--help'):
+            sys.stdout.write(__doc__)
+            return
+        elif opt == '--files':
+            files = int(optarg)
+        elif opt == '--jobs':
+            jobs = int(optarg)
+        elif opt == '--workers':
+            workers = int(optarg)
+        elif opt == '--latency':
+            env['FAKE_TOOL_LATENCY'] = optarg
+        elif opt == '--size':
+            env['FAKE_TOOL_SIZE'] = str(simplemkv.tomp4.parse_size(optarg))
+        elif opt == '--mkv-size':
+            mkvsize = simplemkv.tomp4.parse_size(optarg)
+        elif opt == '--fail-rate':
+            env['FAKE_TOOL_FAIL_RATE'] = optarg
+        elif opt == '--progress':
+            env['FAKE_TOOL_PROGRESS'] = optarg
+        elif opt == '--audio':
+            env['FAKE_TOOL_AUDIO'] = optarg
+        elif opt == '--subtitles':
+            env['FAKE_TOOL_SUBTITLES'] = optarg
+        elif opt == '--work-dir':
+            workdir = optarg
+        elif opt == '--mkvtomp4':
+            mkvtomp4 = optarg
+    temp = workdir is None
+    if temp:
+        workdir = tempfile.mkdtemp(prefix='mkvtomp4-load.')
+    try:
+        mkvdir = os.path.join(workdir, 'mkv')
+        logpath = os.path.join(workdir, 'tools.log')
+        env['FAKE_TOOL_LOG'] = logpath
+        cmd = [sys.executable, mkvtomp4, '--no-summary',
+               '--throughput-file=' + os.path.join(workdir, 'throughput.json')]
+        cmd += make_tools(os.path.join(workdir, 'tools')) + extra
+        mkvs = make_mkvs(mkvdir, files, mkvsize)
+        monitor = Monitor()
+        submit = 0.0
+        start = time.time()
+        if workers is None:
+            parallel = jobs
+            proc = sp.Popen(cmd + ['--jobs=%d' % jobs] + mkvs, env=env,
+                            stderr=sp.PIPE, universal_newlines=True)
+            err = []
+            # Read stderr as it comes, so a long batch can't fill the pipe.
+            reader = threading.Thread(target=lambda: err.extend(proc.stderr))
+            reader.daemon = True
+            reader.start()
+            monitor.wait([proc])
+            reader.join()
+            failed = set(os.path.basename(line.split()[-1])[:len('f000000')]
+                         for line in err
+                         if line.startswith('error: failed to convert:'))
+        else:
+            parallel = workers
+            queuedir = os.path.join(workdir, 'queue')
+            sp.check_call(cmd + ['--queue-dir=' + queuedir, '--submit'] + mkvs,
+                          env=env, stdout=open(os.devnull, 'w'))
+            submit = time.time() - start
+            procs = [
+                sp.Popen(cmd + ['--queue-dir=' + queuedir, '--worker'],
+                         env=env, stdout=open(os.devnull, 'w'),
+                         stderr=open(os.devnull, 'w'))
+                for i in range(workers)
+            ]
+            monitor.wait(procs)
+            faileddir = os.path.join(queuedir, 'failed')
+            failed = set(name[:len('f000000')]
+                         for name in os.listdir(faileddir))
+        wall = time.time() - start
+        runs = read_log(logpath)
+        busy = sum(end - begin for tool, begin, end, status in runs)
+        done = files - len(failed)
+        print('files:               %d (%d converted, %d failed)' % (
+            files, done, len(failed)))
+        if workers is None:
+            print('parallel:            --jobs=%d' % jobs)
+        else:
+            print('parallel:            %d queue workers'
+                  ' (submitting took %.2fs)' % (workers, submit))
+        print('wall time:           %.2fs' % wall)
+        print('jobs/sec:            %.2f' % (files / max(wall, 1e-9)))
+        print('tool runs:           %d (%.2fs in all, %.1fms each)' % (
+            len(runs), busy, 1000 * busy / max(len(runs), 1)))
+        print('overhead per job:    %.1fms of a job slot outside the tools' % (
+            1000 * max(wall * parallel - busy, 0) / max(files, 1)))
+        print('most tools at once:  %d' % most_at_once(runs))
+        print('peak RSS:            %.1fMiB (%.1fMiB for all processes)' % (
+            monitor.peak_rss / 1048576.0, monitor.peak_total_rss / 1048576.0))
+        print('peak open fds:       %d' % monitor.peak_fds)
+        left = leftovers(mkvdir, failed)
+        if left:
+            print('left behind:         %s' % ', '.join(
+                '%d *%s' % (n, kind) for kind, n in sorted(left.items())))
+        else:
+            print('left behind:         nothing')
+    finally:
+        if temp:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -103,7 +103,14 @@ codeopts = {
     'url': 'https://github.com/gavinbeatty/mkvtomp4/',
     'version': __version__,
     'scripts': ['mkvtomp4.py'],
-    'py_modules': ['simplemkv.version', 'simplemkv.info', 'simplemkv.tomp4'],
+    'py_modules': [
+        'simplemkv.version', 'simplemkv.info', 'simplemkv.mp4',
+        'simplemkv.checkpoint', 'simplemkv.jobqueue', 'simplemkv.sched',
+        'simplemkv.graph', 'simplemkv.throughput', 'simplemkv.ebml',
+        'simplemkv.demux', 'simplemkv.executor', 'simplemkv.audit',
+        'simplemkv.profiling', 'simplemkv.governor',
+        'simplemkv.tomp4',
+    ],
 }
 fullopts = codeopts.copy()
 fullopts['data_files'] = [
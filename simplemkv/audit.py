@@ -0,0 +1,182 @@
+"""Find out what converting each mkv in a library would take, without
+converting anything: probe every file, and report which need their audio
+converted, a level patch, and so on, with estimates of how long each stage
+would take.
+
+Probes are cached, keyed by each file's size and modification time, so that
+auditing a library again only runs mkvinfo on files that have changed."""
+
+import os
+import sys
+import csv
+import json
+import threading
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+# The columns of a report, in order.
+fields = (
+    'path', 'size', 'duration',
+    'video_codec', 'video_profile', 'video_level', 'hevc', 'level_patch',
+    'audio_codec', 'audio_channels', 'audio_transcode',
+    'subtitles', 'usable', 'problem',
+    'extract_seconds', 'convert_audio_seconds', 'mux_seconds', 'total_seconds',
+)
+
+
+def default_cache_path():
+    cache = os.environ.get('XDG_CACHE_HOME')
+    if not cache:
+        cache = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'mkvtomp4', 'probes.json')
+
+
+def find_mkvs(paths):
+    """The .mkv files in *paths*, searching directories recursively, in
+    order."""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for d, subdirs, files in os.walk(path):
+            subdirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.mkv'):
+                    found.append(os.path.join(d, name))
+    return found
+
+
+class ProbeCache(object):
+    """Probes of mkv files, kept in the JSON file *path*."""
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self._lock = threading.Lock()
+        self.entries = self._load()
+        self.changed = False
+
+    def _load(self):
+        try:
+            f = open(self.path, 'r')
+        except (IOError, OSError):
+            return {}
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+        finally:
+            f.close()
+
+    def _key(self, mkv):
+        st = os.stat(mkv)
+        return os.path.abspath(mkv), st.st_size, st.st_mtime
+
+    def get(self, mkv):
+        """The cached probe of *mkv*, or ``None`` if it has changed since."""
+        try:
+            path, size, mtime = self._key(mkv)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+            return None
+        return entry['info']
+
+    def put(self, mkv, info):
+        try:
+            path, size, mtime = self._key(mkv)
+        except OSError:
+            return
+        info = dict((k, v) for k, v in info.items() if k != 'lines')
+        self._lock.acquire()
+        try:
+            self.entries[path] = {'size': size, 'mtime': mtime, 'info': info}
+            self.changed = True
+        finally:
+            self._lock.release()
+
+    def save(self):
+        if not self.changed:
+            return
+        d = os.path.dirname(self.path)
+        if d and not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError:
+                return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        self._lock.acquire()
+        try:
+            f = open(tmp, 'w')
+            try:
+                json.dump(self.entries, f, sort_keys=True)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+            self.changed = False
+        except (IOError, OSError):
+            pass
+        finally:
+            self._lock.release()
+
+
+def summarize(rows, jobs=1):
+    """Count the files of a report needing each kind of work, and add up the
+    estimated time, also as it would be when converting *jobs* at once."""
+    usable = [r for r in rows if r['usable']]
+    total = sum(r['total_seconds'] or 0.0 for r in usable)
+    return {
+        'files': len(rows),
+        'usable': len(usable),
+        'unusable': len(rows) - len(usable),
+        'audio_transcode': len([r for r in usable if r['audio_transcode']]),
+        'level_patch': len([r for r in usable if r['level_patch']]),
+        'hevc': len([r for r in usable if r['hevc']]),
+        'text_subtitles': len([r for r in usable if r['subtitles'] == 'text']),
+        'pgs_subtitles': len([r for r in usable if r['subtitles'] == 'pgs']),
+        'bytes': sum(r['size'] or 0 for r in usable),
+        'total_seconds': total,
+        'jobs': jobs,
+        'wall_seconds': total / max(min(jobs, len(usable)), 1),
+    }
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return value and 'yes' or 'no'
+    if isinstance(value, float):
+        return '%.3f' % value
+    return value
+
+
+def write_report(out, rows, summary):
+    """Write *rows* to *out* ('-' for stdout): as JSON, with *summary*, if it
+    ends in .json, otherwise as CSV."""
+    if out == '-':
+        f = sys.stdout
+    elif out.lower().endswith('.json') or sys.version_info[0] < 3:
+        f = open(out, out.lower().endswith('.json') and 'w' or 'wb')
+    else:
+        f = open(out, 'w', newline='')
+    try:
+        if out.lower().endswith('.json'):
+            json.dump({'files': rows, 'summary': summary}, f,
+                      indent=1, sort_keys=True)
+            f.write('\n')
+        else:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([_csv_value(row.get(k)) for k in fields])
+    finally:
+        if f is not sys.stdout:
+            f.close()
@@ -0,0 +1,174 @@
+"""Record which stages of a conversion have completed, so that an interrupted
+conversion can pick up where it left off."""
+
+import os
+import json
+import hashlib
+import threading
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+# How much of the start and end of a file goes into its fingerprint.
+fingerprint_bytes = 65536
+
+
+def fingerprint(path):
+    """A cheap fingerprint of the file at *path*: its size, modification time,
+    and a hash of its first and last *fingerprint_bytes*.
+
+    Returns ``None`` if *path* doesn't exist."""
+    try:
+        st = os.stat(path)
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        h = hashlib.sha1()
+        h.update(f.read(fingerprint_bytes))
+        if st.st_size > fingerprint_bytes:
+            f.seek(max(fingerprint_bytes, st.st_size - fingerprint_bytes))
+            h.update(f.read(fingerprint_bytes))
+    finally:
+        f.close()
+    return [st.st_size, int(st.st_mtime), h.hexdigest()]
+
+
+def state_path(mkv):
+    return mkv + '.mkvtomp4.json'
+
+
+class Checkpoint(object):
+    """The persisted state of the conversion of *source*.
+
+    Stages must be asked about with *done* in the order they run. Once one
+    stage is found incomplete, every later stage is considered incomplete too,
+    since it may depend on what that stage produces."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self._resuming = True
+        self._lock = threading.RLock()
+        self._state = {
+            'source': fingerprint(source), 'stages': [], 'files': {},
+        }
+        try:
+            f = open(path, 'r')
+        except (IOError, OSError):
+            return
+        try:
+            try:
+                state = json.load(f)
+            except ValueError:
+                return
+        finally:
+            f.close()
+        if (isinstance(state, dict) and
+                state.get('source') == self._state['source'] and
+                isinstance(state.get('stages'), list) and
+                isinstance(state.get('files'), dict)):
+            self._state = state
+
+    def _stages(self):
+        return self._state['stages']
+
+    def _set_stages(self, stages):
+        self._state['stages'] = stages
+
+    def done(self, name, cmd, outputs, inputs=()):
+        """Whether stage *name* already ran *cmd*, and all its *outputs*, and
+        the *inputs* it ran on, are still as it left them."""
+        self._lock.acquire()
+        try:
+            if not self._resuming:
+                return False
+            files = self._state['files']
+            for stage in self._stages():
+                if stage['name'] == name and stage['cmd'] == list(cmd):
+                    was = stage.get('inputs', {})
+                    if (all(files.get(o) is not None and
+                            files[o] == fingerprint(o) for o in outputs) and
+                            all(i not in was or was[i] == fingerprint(i)
+                                for i in inputs)):
+                        return True
+                    break
+            self._resuming = False
+            return False
+        finally:
+            self._lock.release()
+
+    def complete(self, name, cmd, outputs, inputs=()):
+        """Record that stage *name* ran *cmd* on *inputs*, producing
+        *outputs*."""
+        self._lock.acquire()
+        try:
+            self._resuming = False
+            stages = self._stages()
+            names = [s['name'] for s in stages]
+            if name in names:
+                # Anything recorded after this stage was based on its old
+                # outputs.
+                stages = stages[:names.index(name)]
+            stages.append({
+                'name': name, 'cmd': list(cmd), 'outputs': list(outputs),
+                'inputs': dict((i, fingerprint(i)) for i in inputs),
+            })
+            self._set_stages(stages)
+            for o in outputs:
+                self._state['files'][o] = fingerprint(o)
+            self.save()
+        finally:
+            self._lock.release()
+
+    def branch(self, key):
+        """A checkpoint, kept in the same file, for a sequence of stages that
+        runs alongside other branches (e.g., one for each output of the
+        conversion). Since it doesn't run in order with the stages here, a
+        branch's stages are only done if their inputs are unchanged, too."""
+        return Branch(self, key)
+
+    def save(self):
+        self._lock.acquire()
+        try:
+            tmp = self.path + '.tmp'
+            f = open(tmp, 'w')
+            try:
+                json.dump(self._state, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                # Windows won't rename over an existing file.
+                os.remove(self.path)
+                os.rename(tmp, self.path)
+        finally:
+            self._lock.release()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Branch(Checkpoint):
+    """A sequence of stages of *parent*'s conversion; see
+    *Checkpoint.branch*."""
+
+    def __init__(self, parent, key):
+        self.path = parent.path
+        self.source = parent.source
+        self.key = key
+        self._resuming = True
+        self._lock = parent._lock
+        self._state = parent._state
+
+    def _stages(self):
+        return self._state.get('branches', {}).get(self.key, [])
+
+    def _set_stages(self, stages):
+        self._state.setdefault('branches', {})[self.key] = stages
@@ -0,0 +1,235 @@
+"""Extract tracks from a large mkv in parts at once: split its clusters once
+into keyframe-aligned byte ranges, extract the tracks from each range, and
+join the pieces.
+
+This gives the same bytes as extracting the whole file only for codecs whose
+raw stream is a header (written from the codec private data, the same for
+every part) followed by frames that don't depend on anything written before
+them, which is what *splittable* checks for, and *joinable* checks at each
+join."""
+
+import os
+import re
+
+import simplemkv.ebml
+import simplemkv.sched
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+# Codecs mkvextract writes as a header and then each frame on its own.
+# Subtitles (numbered) and Vorbis or FLAC (in their own containers) aren't.
+splittable_re = re.compile(
+    r'^(V_|A_)?(MPEG4/ISO/AVC|MPEGH/ISO/HEVC|AAC.*|E?AC3|DTS.*|MPEG/L[23])$'
+)
+
+copy_chunk = 1 << 20
+
+
+def splittable(codec):
+    return bool(splittable_re.match(codec or ''))
+
+
+def cue_starts(mkv, track=None):
+    """The layout of *mkv* and the sorted offsets of the clusters cued for
+    *track* (so, usually, starting with a keyframe)."""
+    f = open(mkv, 'rb')
+    try:
+        layout = simplemkv.ebml.read_layout(f)
+        points = simplemkv.ebml.cue_points(f, layout, track)
+    finally:
+        f.close()
+    return layout, sorted(set(pos for t, pos in points))
+
+
+def split_ranges(starts, layout, parts):
+    """Split the clusters of *layout* into at most *parts* byte ranges
+    ``(first, last)`` of about the same size, each beginning at one of the
+    cluster offsets *starts*."""
+    if not starts:
+        return []
+    begin = layout.first_cluster
+    if begin is None:
+        begin = starts[0]
+    base, total = begin, layout.segment_end - begin
+    ranges = []
+    for i in range(1, parts):
+        target = base + total * i // parts
+        later = [s for s in starts if s >= target and s > begin]
+        if not later:
+            break
+        ranges.append((begin, later[0]))
+        begin = later[0]
+    ranges.append((begin, layout.segment_end))
+    return ranges
+
+
+def cluster_ranges(mkv, parts, track=None):
+    """Split the clusters of *mkv* into at most *parts* byte ranges of about
+    the same size, each starting at a cue for *track* (so, usually, a
+    keyframe). Returns ``(layout, [(first, last), ...])``."""
+    layout, starts = cue_starts(mkv, track)
+    return layout, split_ranges(starts, layout, parts)
+
+
+def seam_ranges(starts, ranges, end):
+    """For each join between *ranges*, ``(before, join, after)``: the offsets
+    of the last cued cluster before the join, the join, and the next cued
+    cluster after it (or *end*)."""
+    seams = []
+    for first, join in ranges[:-1]:
+        before = max([s for s in starts if first <= s < join] or [first])
+        after = min([s for s in starts if s > join] or [end])
+        seams.append((before, join, after))
+    return seams
+
+
+def write_part(mkv, out, layout, first, last, reader=None):
+    src = open(mkv, 'rb')
+    try:
+        dst = open(out, 'wb')
+        try:
+            simplemkv.ebml.write_range(src, dst, layout, first, last,
+                                       reader=reader)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _remove(paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+def _read(path, n=None, offset=0):
+    f = open(path, 'rb')
+    try:
+        if offset < 0:
+            f.seek(0, 2)
+            f.seek(max(f.tell() + offset, 0))
+        else:
+            f.seek(offset)
+        if n is None:
+            return f.read()
+        return f.read(n)
+    finally:
+        f.close()
+
+
+def joinable(header, pieces, seams):
+    """Whether *pieces*, the raw streams of consecutive ranges, each starting
+    with *header*, join into what extracting them all at once would give.
+
+    *seams* are, for each join, ``(before, across)``: the raw streams of the
+    clusters just before the join, and of those and the clusters just after
+    it. Each piece must end with what *before* has after the header, and the
+    next must go on with the rest of *across*, so that nothing at a join
+    depends on what was extracted before it."""
+    for p in pieces:
+        if not os.path.exists(p) or _read(p, len(header)) != header:
+            return False
+    for i, (before, across) in enumerate(seams):
+        before, across = _read(before), _read(across)
+        if not (before.startswith(header) and across.startswith(before)):
+            return False
+        tail, rest = before[len(header):], across[len(before):]
+        if tail and _read(pieces[i], offset=-len(tail)) != tail:
+            return False
+        if _read(pieces[i + 1], len(rest), len(header)) != rest:
+            return False
+    return True
+
+
+def parallel_extract(mkv, outs, parts, extract, track=None, errorfunc=None,
+                     reader=None):
+    """Extract tracks of *mkv* to *outs*, splitting it once into up to
+    *parts* parts for all of them, and extracting the parts at once.
+
+    ``extract(mkvfile, outfiles)`` extracts the tracks from an mkv, to
+    *outfiles* in the order of *outs*, raising an exception or
+    ``SystemExit`` on failure. *track* is the Matroska track number whose
+    cues to split at. *reader*, if given, is called with the size of each
+    read of the mkv or the pieces (e.g., to limit bandwidth).
+
+    Returns the number of parts used. If the pieces can't be joined into what
+    extracting the whole file would give, the whole file is extracted
+    instead, and 1 is returned."""
+    layout, starts = cue_starts(mkv, track)
+    ranges = split_ranges(starts, layout, parts)
+    if len(ranges) < 2:
+        extract(mkv, outs)
+        return 1
+    seams = seam_ranges(starts, ranges, layout.segment_end)
+    # Each piece is a suffix and the range of clusters it's extracted from.
+    pieces = [('.part%d' % i, first, last)
+              for i, (first, last) in enumerate(ranges)]
+    for i, (before, join, after) in enumerate(seams):
+        pieces.append(('.seam%d.before' % i, before, join))
+        pieces.append(('.seam%d' % i, before, after))
+    temps = [outs[0] + '.head.mkv'] + [o + '.head' for o in outs]
+    for suffix, first, last in pieces:
+        temps.append(outs[0] + suffix + '.mkv')
+        temps.extend(o + suffix for o in outs)
+
+    def run(piece):
+        suffix, first, last = piece
+        partmkv = outs[0] + suffix + '.mkv'
+        write_part(mkv, partmkv, layout, first, last, reader)
+        try:
+            extract(partmkv, [o + suffix for o in outs])
+        finally:
+            _remove([partmkv])
+    try:
+        # The raw stream of an mkv with no clusters is just the header each
+        # part will start with.
+        try:
+            run(('.head', 0, 0))
+            headers = [_read(o + '.head') for o in outs]
+        except (SystemExit, Exception):
+            headers = None
+        failed = simplemkv.sched.run_batch(pieces, run, len(ranges), errorfunc)
+        ok = headers is not None and not failed
+        for out, header in zip(outs, headers or []):
+            if not ok:
+                break
+            ok = joinable(
+                header, [out + '.part%d' % i for i in range(len(ranges))],
+                [(out + '.seam%d.before' % i, out + '.seam%d' % i)
+                 for i in range(len(seams))],
+            )
+        if not ok:
+            if errorfunc is not None:
+                errorfunc('parallel demux:', mkv + ':',
+                          'parts can\'t be joined, extracting the whole file')
+            extract(mkv, outs)
+            return 1
+        for out, header in zip(outs, headers):
+            dst = open(out, 'wb')
+            try:
+                for i in range(len(ranges)):
+                    p = out + '.part%d' % i
+                    src = open(p, 'rb')
+                    try:
+                        if i > 0:
+                            src.seek(len(header))
+                        while True:
+                            chunk = src.read(copy_chunk)
+                            if not chunk:
+                                break
+                            if reader is not None:
+                                reader(len(chunk))
+                            dst.write(chunk)
+                    finally:
+                        src.close()
+                    _remove([p])
+            finally:
+                dst.close()
+        return len(ranges)
+    finally:
+        _remove(temps)
@@ -0,0 +1,408 @@
+"""Read just enough of the Matroska (EBML) structure of an mkv to find its
+clusters by time, and copy ranges of clusters into new, smaller mkv files.
+
+Only element headers and the small top-level elements (SeekHead, Info,
+Tracks, Cues) are read; the media in the clusters is copied without being
+looked at."""
+
+import struct
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEKHEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEKID = 0x53AB
+SEEKPOSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMPSCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+CUES = 0x1C53BB6B
+CUEPOINT = 0xBB
+CUETIME = 0xB3
+CUETRACKPOSITIONS = 0xB7
+CUETRACK = 0xF7
+CUECLUSTERPOSITION = 0xF1
+CLUSTER = 0x1F43B675
+TIMESTAMP = 0xE7
+
+# Written as the size of the Segment of an mkv we write, meaning "unknown".
+unknown_size = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+copy_chunk = 1 << 20
+
+
+class EBMLError(Exception):
+    pass
+
+
+def _vint_length(first):
+    for length in range(1, 9):
+        if first & (0x80 >> (length - 1)):
+            return length
+    raise EBMLError('invalid EBML variable length integer')
+
+
+def read_element_header(f):
+    """Read the element header at the current position of *f*.
+
+    Returns ``(id, size, header_size)``, where *size* is ``None`` if unknown,
+    or ``None`` at the end of the file."""
+    b = f.read(1)
+    if not b:
+        return None
+    first = ord(b)
+    idlen = _vint_length(first)
+    if idlen > 4:
+        raise EBMLError('invalid EBML element id')
+    rest = f.read(idlen - 1)
+    eid = first
+    for c in bytearray(rest):
+        eid = (eid << 8) | c
+    b = f.read(1)
+    if not b:
+        return None
+    first = ord(b)
+    sizelen = _vint_length(first)
+    size = first & (0xff >> sizelen)
+    allones = size == (0xff >> sizelen)
+    for c in bytearray(f.read(sizelen - 1)):
+        size = (size << 8) | c
+        allones = allones and c == 0xff
+    if allones:
+        size = None
+    return eid, size, idlen + sizelen
+
+
+def read_uint(data):
+    n = 0
+    for c in bytearray(data):
+        n = (n << 8) | c
+    return n
+
+
+def read_float(data):
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    return 0.0
+
+
+def children(data):
+    """Yield ``(id, offset, header_size, payload)`` for each element in the
+    bytes *data*."""
+    pos = 0
+    while pos < len(data):
+        first = bytearray(data[pos:pos + 1])[0]
+        idlen = _vint_length(first)
+        eid = read_uint(data[pos:pos + idlen])
+        first = bytearray(data[pos + idlen:pos + idlen + 1])[0]
+        sizelen = _vint_length(first)
+        size = first & (0xff >> sizelen)
+        size = (size << (8 * (sizelen - 1))) | read_uint(
+            data[pos + idlen + 1:pos + idlen + sizelen])
+        hdr = idlen + sizelen
+        yield eid, pos, hdr, data[pos + hdr:pos + hdr + size]
+        pos += hdr + size
+
+
+class Layout(object):
+    """Where things are in an mkv: byte offsets are absolute, and times are in
+    units of *timescale* nanoseconds, as in the file."""
+
+    def __init__(self):
+        self.ebml_header = None
+        self.segment_start = None
+        self.segment_end = None
+        self.info = None
+        self.tracks = None
+        self.cues = None
+        self.first_cluster = None
+        self.timescale = 1000000
+        self.duration = None
+
+    def seconds(self, ticks):
+        return ticks * self.timescale / 1e9
+
+    def ticks(self, seconds):
+        return seconds * 1e9 / self.timescale
+
+
+def read_layout(f):
+    """Read the layout of the mkv open as *f*, stopping at the first
+    Cluster rather than reading through them."""
+    layout = Layout()
+    f.seek(0, 2)
+    filesize = f.tell()
+    f.seek(0)
+    hdr = read_element_header(f)
+    if hdr is None or hdr[0] != EBML or hdr[1] is None:
+        raise EBMLError('not an EBML file')
+    layout.ebml_header = (0, hdr[2] + hdr[1])
+    f.seek(layout.ebml_header[1])
+    hdr = read_element_header(f)
+    if hdr is None or hdr[0] != SEGMENT:
+        raise EBMLError('no Segment')
+    layout.segment_start = f.tell()
+    if hdr[1] is None:
+        layout.segment_end = filesize
+    else:
+        layout.segment_end = min(layout.segment_start + hdr[1], filesize)
+    seeks = {}
+    pos = layout.segment_start
+    while pos < layout.segment_end:
+        f.seek(pos)
+        hdr = read_element_header(f)
+        if hdr is None:
+            break
+        eid, size, hdrsize = hdr
+        if eid == CLUSTER:
+            layout.first_cluster = pos
+            break
+        if size is None:
+            break
+        if eid == SEEKHEAD:
+            for sid, o, h, seek in children(f.read(size)):
+                if sid != SEEK:
+                    continue
+                target = position = None
+                for cid, o2, h2, payload in children(seek):
+                    if cid == SEEKID:
+                        target = read_uint(payload)
+                    elif cid == SEEKPOSITION:
+                        position = read_uint(payload)
+                if target is not None and position is not None:
+                    seeks[target] = layout.segment_start + position
+        elif eid == INFO:
+            layout.info = (pos, hdrsize + size)
+            for cid, o, h, payload in children(f.read(size)):
+                if cid == TIMESTAMPSCALE:
+                    layout.timescale = read_uint(payload)
+                elif cid == DURATION:
+                    layout.duration = read_float(payload)
+        elif eid == TRACKS:
+            layout.tracks = (pos, hdrsize + size)
+        elif eid == CUES:
+            layout.cues = (pos, hdrsize + size)
+        pos += hdrsize + size
+    if layout.cues is None and CUES in seeks:
+        f.seek(seeks[CUES])
+        hdr = read_element_header(f)
+        if hdr is not None and hdr[0] == CUES and hdr[1] is not None:
+            layout.cues = (seeks[CUES], hdr[2] + hdr[1])
+    if layout.first_cluster is None and CLUSTER in seeks:
+        layout.first_cluster = seeks[CLUSTER]
+    return layout
+
+
+def cue_points(f, layout, track=None):
+    """Return a sorted list of ``(time, cluster offset)`` from the Cues, or,
+    if the mkv has no Cues, by reading the header of each cluster.
+
+    If *track* (a Matroska track number) is given, only its cues are used,
+    unless it has none."""
+    points, others = set(), set()
+    if layout.cues is not None:
+        pos, size = layout.cues
+        f.seek(pos)
+        hdr = read_element_header(f)
+        for cid, o, h, cuepoint in children(f.read(hdr[1])):
+            if cid != CUEPOINT:
+                continue
+            time = None
+            clusters = []
+            for eid, o2, h2, payload in children(cuepoint):
+                if eid == CUETIME:
+                    time = read_uint(payload)
+                elif eid == CUETRACKPOSITIONS:
+                    cuetrack, cluster = None, None
+                    for pid, o3, h3, p in children(payload):
+                        if pid == CUETRACK:
+                            cuetrack = read_uint(p)
+                        elif pid == CUECLUSTERPOSITION:
+                            cluster = read_uint(p)
+                    if cluster is not None:
+                        clusters.append((cuetrack, cluster))
+            if time is None:
+                continue
+            for cuetrack, c in clusters:
+                point = (time, layout.segment_start + c)
+                if track is None or cuetrack == track:
+                    points.add(point)
+                else:
+                    others.add(point)
+    if not points:
+        points = others
+    if points:
+        return sorted(points)
+    return scan_clusters(f, layout)
+
+
+def scan_clusters(f, layout):
+    """Return ``(time, offset)`` for each cluster, reading only their headers
+    and timestamps."""
+    points = []
+    pos = layout.first_cluster
+    while pos is not None and pos < layout.segment_end:
+        f.seek(pos)
+        hdr = read_element_header(f)
+        if hdr is None:
+            break
+        eid, size, hdrsize = hdr
+        if eid == CLUSTER:
+            t = read_element_header(f)
+            if t is not None and t[0] == TIMESTAMP and t[1] is not None:
+                points.append((read_uint(f.read(t[1])), pos))
+        if size is None:
+            break
+        pos += hdrsize + size
+    return points
+
+
+def cluster_range(points, layout, start, end=None):
+    """The byte range ``(first, last)`` of clusters covering the times *start*
+    to *end*, and the time of the first cluster. The range starts at the last
+    cue at or before *start*, so it starts with a keyframe."""
+    first, first_time = None, 0
+    for t, pos in points:
+        if t <= start or first is None:
+            first, first_time = pos, t
+        if t > start:
+            break
+    last = layout.segment_end
+    if end is not None:
+        for t, pos in points:
+            if t >= end and pos > first:
+                last = pos
+                break
+    return first, last, first_time
+
+
+def _rewrite_duration(info, duration):
+    """Return the Info element *info* with its Duration set to *duration*."""
+    out = bytearray(info)
+    first = bytearray(info[0:1])[0]
+    idlen = _vint_length(first)
+    sizelen = _vint_length(bytearray(info[idlen:idlen + 1])[0])
+    base = idlen + sizelen
+    for cid, o, h, payload in children(bytes(info[base:])):
+        if cid == DURATION:
+            fmt = '>f' if len(payload) == 4 else '>d'
+            start = base + o + h
+            out[start:start + len(payload)] = struct.pack(fmt, duration)
+    return bytes(out)
+
+
+def _copy(src, dst, n, reader=None):
+    while n > 0:
+        chunk = src.read(min(n, copy_chunk))
+        if not chunk:
+            break
+        if reader is not None:
+            reader(len(chunk))
+        dst.write(chunk)
+        n -= len(chunk)
+
+
+def write_range(src, dst, layout, first, last, shift=0, duration=None,
+                reader=None):
+    """Write an mkv to *dst* with the header, Info and Tracks of *src*, and
+    its clusters from byte *first* up to *last*; other elements in that range
+    are left out.
+
+    Cluster timestamps are moved back by *shift*, and Info's Duration is set
+    to *duration*, if given. *reader*, if given, is called with the number of
+    bytes of each read of cluster data."""
+    src.seek(layout.ebml_header[0])
+    dst.write(src.read(layout.ebml_header[1]))
+    dst.write(struct.pack('>I', SEGMENT) + unknown_size)
+    if layout.info is not None:
+        src.seek(layout.info[0])
+        info = src.read(layout.info[1])
+        if duration is not None:
+            info = _rewrite_duration(info, duration)
+        dst.write(info)
+    if layout.tracks is not None:
+        src.seek(layout.tracks[0])
+        dst.write(src.read(layout.tracks[1]))
+    pos = first
+    while pos < last:
+        src.seek(pos)
+        hdr = read_element_header(src)
+        if hdr is None:
+            break
+        eid, size, hdrsize = hdr
+        if size is not None and eid != CLUSTER:
+            # Cues, Tags, etc. would describe the original, not this copy.
+            pos += hdrsize + size
+            continue
+        if size is None or not shift:
+            # Copy anything we can't (or needn't) look inside as it is.
+            n = last - pos if size is None else min(hdrsize + size, last - pos)
+            src.seek(pos)
+            _copy(src, dst, n, reader)
+            pos += n
+            continue
+        src.seek(pos)
+        head = src.read(hdrsize)
+        t = read_element_header(src)
+        if t is None or t[0] != TIMESTAMP or t[1] is None:
+            src.seek(pos)
+            _copy(src, dst, hdrsize + size, reader)
+            pos += hdrsize + size
+            continue
+        # Keep the Timestamp's own header and width, so the cluster's size
+        # doesn't change; only its value is rewritten.
+        src.seek(pos + hdrsize)
+        thead = src.read(t[2])
+        tsize = t[1]
+        ts = max(read_uint(src.read(tsize)) - shift, 0)
+        dst.write(head + thead)
+        dst.write(bytes(bytearray((ts >> (8 * (tsize - 1 - i))) & 0xff
+                                  for i in range(tsize))))
+        _copy(src, dst, size - t[2] - tsize, reader)
+        pos += hdrsize + size
+
+
+def write_sample(mkv, out, start, duration, track=None, reader=None):
+    """Write to *out* an mkv of *duration* seconds of *mkv*, from the last
+    cluster cued for *track* at or before *start* seconds. Only the index and
+    the clusters needed are read. If *out* is ``None``, nothing is written.
+
+    Returns ``(first, last)``, the byte range of *mkv* that was copied."""
+    src = open(mkv, 'rb')
+    try:
+        layout = read_layout(src)
+        points = cue_points(src, layout, track)
+        if not points:
+            raise EBMLError('no clusters found: ' + mkv)
+        first, last, first_time = cluster_range(
+            points, layout, layout.ticks(start), layout.ticks(start + duration)
+        )
+        end_time = None
+        for t, pos in points:
+            if pos == last:
+                end_time = t
+                break
+        if end_time is None:
+            end_time = layout.duration
+        length = None
+        if end_time is not None:
+            length = end_time - first_time
+        if out is None:
+            return first, last
+        dst = open(out, 'wb')
+        try:
+            write_range(src, dst, layout, first, last, shift=first_time,
+                        duration=length, reader=reader)
+        finally:
+            dst.close()
+        return first, last
+    finally:
+        src.close()
@@ -0,0 +1,250 @@
+"""Run the commands of conversion stages, each in its own process group, and
+kill them if they hang, take too long, or are cancelled.
+
+A command has hung (stalled) if for *stall_timeout* seconds it has written
+nothing to its stdout or stderr (where the tools we run write progress) and
+none of the stage's output files have grown."""
+
+import os
+import time
+import signal
+import threading
+import subprocess as sp
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+# How often to look at a running command, in seconds.
+poll_seconds = 0.5
+# How long to wait for a command to exit on SIGTERM before SIGKILL.
+kill_grace_seconds = 5.0
+
+
+class ExecutorError(Exception):
+    pass
+
+
+class Stalled(ExecutorError):
+    pass
+
+
+class TimedOut(ExecutorError):
+    pass
+
+
+class Cancelled(ExecutorError):
+    pass
+
+
+_local = threading.local()
+_running = set()
+_lock = threading.Lock()
+_cancelled = threading.Event()
+
+
+class Stage(object):
+    """Say which output files the commands run in this thread, while in the
+    ``with`` block, write. They are watched for growth, and removed if the
+    command is killed::
+
+        with Stage([rawvideo]):
+            run(cmd)
+
+    If *policy* (a *simplemkv.governor.Policy*) is given, the commands run
+    with its priorities."""
+
+    def __init__(self, outputs, policy=None):
+        self.outputs = list(outputs)
+        self.policy = policy
+
+    def __enter__(self):
+        self.saved = (getattr(_local, 'outputs', []),
+                      getattr(_local, 'policy', None))
+        _local.outputs = self.outputs
+        _local.policy = self.policy
+        return self
+
+    def __exit__(self, et, ev, tb):
+        _local.outputs, _local.policy = self.saved
+        return False
+
+
+def current_outputs():
+    return list(getattr(_local, 'outputs', []))
+
+
+def current_policy():
+    return getattr(_local, 'policy', None)
+
+
+def remove_outputs(outputs):
+    for o in outputs:
+        try:
+            os.remove(o)
+        except OSError:
+            pass
+
+
+class Child(object):
+    def __init__(self, proc, outputs):
+        self.proc = proc
+        self.outputs = outputs
+        self.activity = time.time()
+        self.killed = False
+
+    def kill(self):
+        """Kill the command and everything it started, politely at first."""
+        self.killed = True
+        proc = self.proc
+        if proc.poll() is not None:
+            return
+        if os.name == 'posix':
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            deadline = time.time() + kill_grace_seconds
+            while proc.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        else:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        proc.wait()
+
+
+def _reader(f, chunks, child):
+    fd = f.fileno()
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            break
+        if not data:
+            break
+        chunks.append(data)
+        child.activity = time.time()
+    f.close()
+
+
+def _wait(proc, seconds):
+    """Wait up to *seconds* for *proc* to exit, returning as soon as it
+    does where ``Popen.wait`` takes a timeout (Python 3)."""
+    try:
+        proc.wait(timeout=seconds)
+    except TypeError:
+        time.sleep(seconds)
+    except sp.TimeoutExpired:
+        pass
+
+
+def _sizes(paths):
+    sizes = {}
+    for p in paths:
+        try:
+            sizes[p] = os.path.getsize(p)
+        except OSError:
+            sizes[p] = None
+    return sizes
+
+
+def run(cmd, stall_timeout=None, timeout=None, **spopts):
+    """Run *cmd* and return ``(returncode, stdout, stderr)``.
+
+    Raises *Stalled* or *TimedOut* (after killing it and removing the current
+    stage's outputs) if it stalls for *stall_timeout* seconds or runs for
+    more than *timeout* seconds, and *Cancelled* if *cancel_all* is called.
+    *spopts* are passed on to ``subprocess.Popen``."""
+    if _cancelled.is_set():
+        raise Cancelled('cancelled')
+    outputs = current_outputs()
+    policy = current_policy()
+    popts = {'close_fds': True}
+    if policy is not None and not policy.empty():
+        cmd = policy.command(cmd)
+    if os.name == 'posix' and policy is not None and not policy.empty():
+        def preexec():
+            os.setsid()
+            policy.preexec()
+        popts['preexec_fn'] = preexec
+    elif os.name == 'posix':
+        popts['preexec_fn'] = os.setsid
+    elif hasattr(sp, 'CREATE_NEW_PROCESS_GROUP'):
+        popts['creationflags'] = sp.CREATE_NEW_PROCESS_GROUP
+    popts.update(spopts)
+    devnull = open(os.devnull, 'rb')
+    try:
+        # A child in its own process group that reads the terminal would be
+        # stopped, so it gets no stdin.
+        proc = sp.Popen(cmd, stdin=devnull, stdout=sp.PIPE, stderr=sp.PIPE,
+                        **popts)
+    finally:
+        devnull.close()
+    child = Child(proc, outputs)
+    out, err = [], []
+    readers = [
+        threading.Thread(target=_reader, args=(proc.stdout, out, child)),
+        threading.Thread(target=_reader, args=(proc.stderr, err, child)),
+    ]
+    for t in readers:
+        t.daemon = True
+        t.start()
+    _lock.acquire()
+    try:
+        _running.add(child)
+    finally:
+        _lock.release()
+    start = time.time()
+    sizes = _sizes(outputs)
+    wait = 0.01
+    try:
+        while proc.poll() is None:
+            # Look often at first, so short commands aren't slowed down.
+            _wait(proc, wait)
+            wait = min(wait * 2, poll_seconds)
+            now = time.time()
+            newsizes = _sizes(outputs)
+            if newsizes != sizes:
+                sizes = newsizes
+                child.activity = now
+            if _cancelled.is_set():
+                raise Cancelled('cancelled')
+            if timeout and now - start > timeout:
+                raise TimedOut('still running after %d seconds' % timeout)
+            if stall_timeout and now - child.activity > stall_timeout:
+                raise Stalled('no progress for %d seconds' % stall_timeout)
+    except (KeyboardInterrupt, ExecutorError):
+        child.kill()
+        remove_outputs(outputs)
+        raise
+    finally:
+        _lock.acquire()
+        try:
+            _running.discard(child)
+        finally:
+            _lock.release()
+    for t in readers:
+        # Anything the command left running may still hold the pipes open.
+        t.join(kill_grace_seconds)
+    return proc.returncode, b''.join(out), b''.join(err)
+
+
+def cancel_all():
+    """Kill every command running, remove their stages' outputs, and make
+    any later *run* raise *Cancelled*."""
+    _cancelled.set()
+    _lock.acquire()
+    try:
+        children = list(_running)
+    finally:
+        _lock.release()
+    for child in children:
+        child.kill()
+        remove_outputs(child.outputs)
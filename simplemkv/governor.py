@@ -0,0 +1,228 @@
+"""Keep conversions from getting in the way of other work on a shared host:
+run their commands at a lower CPU priority (niceness) and I/O priority
+(Linux I/O scheduling class), and limit how fast mkvtomp4 itself reads.
+
+I/O priority is set with the ioprio_set system call, through ctypes, or, if
+that isn't possible here, by running commands under ``ionice``. Priorities
+are only ever lowered, which needs no privileges (except for the realtime
+I/O class)."""
+
+import os
+import sys
+import time
+import platform
+import threading
+import subprocess as sp
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+ioprio_classes = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+ioprio_class_aliases = {'rt': 'realtime', 'be': 'best-effort',
+                        '1': 'realtime', '2': 'best-effort', '3': 'idle'}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# ioprio_set's number on the Linux architectures we know it for.
+ioprio_set_numbers = {
+    'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289,
+    'aarch64': 30, 'arm64': 30, 'riscv64': 30,
+    'armv6l': 314, 'armv7l': 314,
+    'ppc64': 273, 'ppc64le': 273, 's390x': 282,
+}
+copy_chunk = 1 << 20
+
+
+class GovernorError(Exception):
+    pass
+
+
+def parse_ionice(spec):
+    """Parse an I/O priority ``<class>[:<level>]`` (e.g., ``idle`` or
+    ``best-effort:7``) into ``(class number, level)``."""
+    name, sep, level = spec.partition(':')
+    name = ioprio_class_aliases.get(name, name)
+    if name not in ioprio_classes:
+        raise GovernorError('I/O class is one of %s: %s'
+                            % (', '.join(sorted(ioprio_classes)), spec))
+    if name == 'idle':
+        return ioprio_classes[name], 0
+    try:
+        level = int(level or 4)
+    except ValueError:
+        raise GovernorError('I/O priority level is 0 to 7: ' + spec)
+    if level < 0 or level > 7:
+        raise GovernorError('I/O priority level is 0 to 7: ' + spec)
+    return ioprio_classes[name], level
+
+
+_libc = None
+
+
+def _ioprio_syscall():
+    """``(libc, number)`` to call ioprio_set with, or ``None``."""
+    global _libc
+    if not sys.platform.startswith('linux'):
+        return None
+    number = ioprio_set_numbers.get(platform.machine())
+    if number is None:
+        return None
+    if _libc is None:
+        try:
+            import ctypes
+            _libc = ctypes.CDLL(None, use_errno=True)
+            _libc.syscall
+        except (ImportError, OSError, AttributeError):
+            _libc = False
+    if not _libc:
+        return None
+    return _libc, number
+
+
+def _which(name):
+    for d in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(d, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _ioprio_set(call, ioprio, pid=0):
+    """Make the ioprio_set system call *call* from *_ioprio_syscall*, without
+    importing or loading anything."""
+    libc, number = call
+    cls, level = ioprio
+    return libc.syscall(number, IOPRIO_WHO_PROCESS, pid,
+                        cls << IOPRIO_CLASS_SHIFT | level)
+
+
+def set_ioprio(ioprio, pid=0):
+    """Set the I/O priority ``(class, level)`` of *pid* (0 for this thread,
+    or this process if it has no others). Raises *GovernorError* if it
+    can't be."""
+    call = _ioprio_syscall()
+    if call is not None:
+        import ctypes
+        if _ioprio_set(call, ioprio, pid) == 0:
+            return
+        raise GovernorError('ioprio_set: ' + os.strerror(ctypes.get_errno()))
+    ionice = _which('ionice')
+    if ionice is None:
+        raise GovernorError('no ioprio_set or ionice to set I/O priority with')
+    pid = str(pid or os.getpid())
+    if sp.call(ionice_cmd(ioprio, ionice) + ['-p', pid]) != 0:
+        raise GovernorError('ionice failed')
+
+
+def ionice_cmd(ioprio, ionice='ionice'):
+    cls, level = ioprio
+    if cls == ioprio_classes['idle']:
+        return [ionice, '-c', str(cls)]
+    return [ionice, '-c', str(cls), '-n', str(level)]
+
+
+def lower_nice(nice):
+    """Make this process's niceness at least *nice*."""
+    current = os.nice(0)
+    if nice > current:
+        os.nice(nice - current)
+
+
+class Policy(object):
+    """The priorities to run something at: a niceness and an I/O priority
+    ``(class, level)``, either of which may be ``None`` to leave it be."""
+
+    def __init__(self, nice=None, ioprio=None):
+        self.nice = nice
+        self.ioprio = ioprio
+        # Found now, since a child forked from a process with threads can
+        # deadlock importing modules or loading libraries.
+        self.syscall = None
+        if ioprio is not None:
+            self.syscall = _ioprio_syscall()
+
+    def __repr__(self):
+        return 'Policy(nice=%r, ioprio=%r)' % (self.nice, self.ioprio)
+
+    def empty(self):
+        return self.nice is None and self.ioprio is None
+
+    def command(self, cmd):
+        """*cmd*, run under ionice if the I/O priority can only be set that
+        way."""
+        if self.ioprio is None or self.syscall is not None:
+            return cmd
+        ionice = _which('ionice')
+        if ionice is None:
+            return cmd
+        return ionice_cmd(self.ioprio, ionice) + list(cmd)
+
+    def preexec(self):
+        """Apply the policy in a child process before it runs its command,
+        making only system calls. Errors are ignored, since there's nobody to
+        tell."""
+        if self.nice is not None:
+            try:
+                lower_nice(self.nice)
+            except OSError:
+                pass
+        if self.ioprio is not None and self.syscall is not None:
+            _ioprio_set(self.syscall, self.ioprio)
+
+    def apply(self):
+        """Apply the policy to this process (and so to everything it
+        starts), before it starts any threads. Raises *GovernorError* or
+        *OSError* if it can't be."""
+        if self.nice is not None:
+            lower_nice(self.nice)
+        if self.ioprio is not None:
+            set_ioprio(self.ioprio)
+
+
+class Budget(object):
+    """A token bucket letting about *rate* bytes a second through, however
+    many threads share it. Call it with the number of bytes just read, and
+    it sleeps as long as needed to keep to the rate. Up to *burst* bytes (a
+    second's worth by default) may go through at once after a pause."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.last = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self, n):
+        self._lock.acquire()
+        try:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            debt = -self.tokens
+        finally:
+            self._lock.release()
+        if debt > 0:
+            time.sleep(debt / self.rate)
+
+
+def copyfile(src, dst, reader=None):
+    """Copy the file *src* to *dst*, calling *reader* (e.g., a *Budget*)
+    with the size of each chunk read."""
+    fsrc = open(src, 'rb')
+    try:
+        fdst = open(dst, 'wb')
+        try:
+            while True:
+                chunk = fsrc.read(copy_chunk)
+                if not chunk:
+                    break
+                if reader is not None:
+                    reader(len(chunk))
+                fdst.write(chunk)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
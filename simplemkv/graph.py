@@ -0,0 +1,121 @@
+"""Collect the stages of conversions as a graph of commands and the files they
+read and write, and write it out as a Makefile or ninja build file."""
+
+import re
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+
+def shell_quote(args):
+    return ' '.join([quote(str(a)) if a != '' else "''" for a in args])
+
+
+def make_path(path):
+    return re.sub(r'([ :#\\])', r'\\\1', path.replace('$', '$$'))
+
+
+def ninja_path(path):
+    return re.sub(r'([ :$])', r'$\1', path)
+
+
+class Edge(object):
+    def __init__(self, name, cmd, inputs, outputs):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+class BuildGraph(object):
+    """The stages of one or more conversions.
+
+    A stage that rewrites one of its inputs in place (e.g., correcting the
+    H.264 profile) can't be a rule for that file, so it gets a stamp file as
+    its output instead, and later stages depend on the stamp. A stage with
+    several outputs is written for make as a rule with grouped targets, which
+    needs GNU make 4.3 or later."""
+
+    def __init__(self, keep_temp_files=False):
+        self.keep_temp_files = keep_temp_files
+        self.edges = []
+        self.defaults = []
+        self.temps = []
+        # The file to depend on to get each path in its latest state.
+        self._target = {}
+
+    def add(self, name, cmd, inputs, outputs):
+        deps = []
+        for i in inputs:
+            dep = self._target.get(i, i)
+            if dep not in deps:
+                deps.append(dep)
+        cmd = shell_quote(cmd)
+        outs = []
+        for o in outputs:
+            if o in inputs:
+                stamp = o + '.' + name + '.stamp'
+                cmd = cmd + ' && touch ' + quote(stamp)
+                self.temps.append(stamp)
+                self._target[o] = stamp
+                outs.append(stamp)
+            else:
+                self._target[o] = o
+                outs.append(o)
+        self.edges.append(Edge(name, cmd, deps, outs))
+
+    def add_default(self, output):
+        self.defaults.append(self._target.get(output, output))
+
+    def add_temps(self, tempfiles):
+        for t in tempfiles:
+            if t not in self.temps:
+                self.temps.append(t)
+
+    def clean_cmd(self):
+        return shell_quote(['rm', '-f'] + self.temps)
+
+    def write_make(self, f):
+        w = f.write
+        w('# Generated by mkvtomp4 --export-make. Run with make -j<jobs>.\n\n')
+        w('all: ' + ' '.join(make_path(d) for d in self.defaults) + '\n')
+        w('.PHONY: all\n')
+        for e in self.edges:
+            # Grouped targets (GNU make 4.3 and later) are made by one run of
+            # the recipe, rather than each by its own.
+            sep = ' &: ' if len(e.outputs) > 1 else ': '
+            w('\n' + ' '.join(make_path(o) for o in e.outputs) + sep)
+            w(' '.join(make_path(i) for i in e.inputs) + '\n')
+            w('\t' + e.cmd.replace('$', '$$') + '\n')
+        if self.temps:
+            # make removes intermediate files once everything that needs them
+            # is built, and won't remake them just because they're missing.
+            special = '.SECONDARY' if self.keep_temp_files else '.INTERMEDIATE'
+            w('\n' + special + ': ')
+            w(' '.join(make_path(t) for t in self.temps) + '\n')
+        w('\nclean-temp:\n\t' + self.clean_cmd().replace('$', '$$') + '\n')
+        w('.PHONY: clean-temp\n')
+
+    def write_ninja(self, f):
+        w = f.write
+        w('# Generated by mkvtomp4 --export-ninja. Run with ninja -j<jobs>,\n')
+        w('# then ninja clean-temp to remove temporary files.\n\n')
+        w('rule run\n  command = $cmd\n  description = $desc\n')
+        for e in self.edges:
+            w('\nbuild ' + ' '.join(ninja_path(o) for o in e.outputs))
+            w(': run ' + ' '.join(ninja_path(i) for i in e.inputs) + '\n')
+            w('  cmd = ' + e.cmd.replace('$', '$$') + '\n')
+            w('  desc = ' + e.name + ' ' +
+              e.outputs[-1].replace('$', '$$') + '\n')
+        w('\nbuild all: phony ' +
+          ' '.join(ninja_path(d) for d in self.defaults))
+        w('\ndefault all\n')
+        w('\nbuild clean-temp: run\n')
+        w('  cmd = ' + self.clean_cmd().replace('$', '$$') + '\n')
+        w('  desc = clean-temp\n')
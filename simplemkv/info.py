@@ -25,8 +25,15 @@ class TrackLineHandler:
     _codec = '|  + Codec ID: '
     _lang = '|  + Language: '
     _duration = '|  + Default duration: '
+    _channels = '|   + Channels: '
+    _sampling = '|   + Sampling frequency: '
+    _private = "|  + Codec's private data: "
     fps = r'\((.*?) frames/fields per second for a video track\)'
     _fps_re = re.compile(fps)
+    # e.g., "size 48 (H.264 profile: High @L4.1)" or
+    # "(HEVC profile: Main 10 @L5.1)"
+    _level_re = re.compile(
+        r'\((?:H\.264|HEVC) profile: (.*?) @L(\d+(?:\.\d+)?)\)')
 
     def __init__(self, infodict):
         self._info = infodict
@@ -74,17 +81,55 @@ class TrackLineHandler:
                 if match:
                     self._track['fps'] = float(match.group(1))
                     return True
+            private = self._findvalue(cls._private, l)
+            if private:
+                match = cls._level_re.search(private)
+                if match:
+                    self._track['profile'] = match.group(1)
+                    self._track['level'] = float(match.group(2))
+                return True
+        if self._track.get('type', '') == 'audio':
+            channels = self._findvalue(cls._channels, l)
+            if channels:
+                self._track['channels'] = int(channels)
+                return True
+            sampling = self._findvalue(cls._sampling, l)
+            if sampling:
+                self._track['sampling_frequency'] = float(sampling)
+                return True
         return True
 
 
+def parse_duration(s):
+    """Parse an mkvinfo duration, either ``01:23:45.678000000`` or (older
+    mkvinfo) ``5025.678s (01:23:45.678)``, into seconds.
+
+    Returns ``None`` if *s* is neither."""
+    m = re.match(r'^(\d+):(\d+):(\d+(?:\.\d*)?)', s)
+    if m:
+        h, mins, secs = m.groups()
+        return int(h) * 3600 + int(mins) * 60 + float(secs)
+    m = re.match(r'^(\d+(?:\.\d*)?)s', s)
+    if m:
+        return float(m.group(1))
+    return None
+
+
 class MainLineHandler:
     "Parse a line of (locale='en_US') mkvinfo output."
+    _duration = '| + Duration: '
+
     def __init__(self, infodict):
         self._info = infodict
         self._track = TrackLineHandler(infodict)
 
     def line(self, handlers, l):
-        if l.startswith('|+ Segment tracks'):
+        if l.startswith(MainLineHandler._duration):
+            duration = parse_duration(l[len(MainLineHandler._duration):])
+            if duration is not None:
+                self._info['duration'] = duration
+            return True
+        elif l.startswith('|+ Segment tracks'):
             self._info.setdefault('tracks', [])
             return True
         elif l.startswith('| + Track'):
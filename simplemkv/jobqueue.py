@@ -0,0 +1,270 @@
+"""A queue of conversion jobs kept in a directory shared between machines
+(e.g., over NFS), needing no service other than the filesystem.
+
+Jobs move between subdirectories of the queue directory by atomic rename::
+
+    pending/<job>.json             waiting for a worker
+    running/<job>@<worker>.json    claimed by <worker>
+    running/<job>@<worker>.lease   touched by <worker> while it's alive
+    done/<job>.json, failed/<job>.json
+    reports/<job>.json             what happened, written by the worker
+
+A job whose lease hasn't been touched for *lease_seconds* belongs to a dead
+worker, and any other worker moves it back to pending.
+
+A worker can't be told from a dead one by its lease alone: one that is alive
+but doesn't touch its lease in time (e.g., its machine is suspended, or the
+shared filesystem stops answering it) loses its job to another worker, and
+both convert the file. The first to finish moves the job to done or failed;
+the other reports it as ``lost``. So *lease_seconds* should be well beyond
+any pause a worker is expected to survive."""
+
+import os
+import re
+import sys
+import json
+import time
+import errno
+import socket
+import hashlib
+import threading
+import traceback
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+subdirs = ('pending', 'running', 'done', 'failed', 'reports')
+
+
+def make_queue(queuedir):
+    for d in subdirs:
+        try:
+            os.makedirs(os.path.join(queuedir, d))
+        except OSError:
+            et, ev, tb = sys.exc_info()
+            if ev.errno != errno.EEXIST:
+                raise
+
+
+def job_id(mkv):
+    """A name for the job converting *mkv* that is unique within the queue."""
+    path = os.path.abspath(mkv)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stem = re.sub(r'[^A-Za-z0-9_-]', '_', stem)
+    return stem + '-' + hashlib.sha1(path.encode('utf_8')).hexdigest()[:8]
+
+
+def write_json(path, obj):
+    """Write *obj* to *path* so that no reader ever sees it half-written."""
+    d, base = os.path.split(path)
+    tmp = os.path.join(d, '.' + base + '.tmp')
+    f = open(tmp, 'w')
+    try:
+        json.dump(obj, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def read_json(path):
+    f = open(path, 'r')
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def submit(queuedir, mkvfiles, opts, paths=()):
+    """Queue a job converting each of *mkvfiles* with the options *opts*.
+    The options named in *paths* are files, made absolute like *mkvfiles*
+    so that workers running elsewhere find them.
+
+    Returns the list of job ids."""
+    make_queue(queuedir)
+    opts = dict(opts)
+    for key in paths:
+        if opts.get(key) is not None:
+            opts[key] = os.path.abspath(opts[key])
+    ids = []
+    for mkv in mkvfiles:
+        jid = job_id(mkv)
+        job = {
+            'id': jid,
+            'mkvfile': os.path.abspath(mkv),
+            'opts': opts,
+            'submitted': time.time(),
+        }
+        write_json(os.path.join(queuedir, 'pending', jid + '.json'), job)
+        ids.append(jid)
+    return ids
+
+
+def default_worker_name():
+    host = re.sub(r'[^A-Za-z0-9_-]', '_', socket.gethostname())
+    return '%s_%d' % (host, os.getpid())
+
+
+class Worker(object):
+    """Claims jobs from *queuedir* and runs them with ``run(mkvfile, **opts)``
+    until there's nothing left pending or running.
+
+    *run* reports failure by raising an exception, or ``SystemExit`` with a
+    non-zero code."""
+
+    def __init__(self, queuedir, run, lease_seconds=120, poll_seconds=5,
+                 name=None, printer=None):
+        self.queuedir = queuedir
+        self.run = run
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.name = name or default_worker_name()
+        self.printer = printer
+        make_queue(queuedir)
+
+    def _path(self, *parts):
+        return os.path.join(self.queuedir, *parts)
+
+    def _say(self, *args):
+        if self.printer is not None:
+            self.printer('worker ' + self.name + ':', *args)
+
+    def now(self):
+        """The shared filesystem's idea of the time, which is what lease
+        modification times are measured in."""
+        clock = self._path('.clock@' + self.name)
+        f = open(clock, 'w')
+        f.close()
+        try:
+            return os.stat(clock).st_mtime
+        finally:
+            os.remove(clock)
+
+    def reclaim_expired(self):
+        """Move jobs of workers whose leases expired back to pending."""
+        now = self.now()
+        for name in os.listdir(self._path('running')):
+            if not name.endswith('.json') or '@' not in name:
+                continue
+            claimed = self._path('running', name)
+            lease = claimed[:-len('.json')] + '.lease'
+            try:
+                touched = os.stat(lease).st_mtime
+            except OSError:
+                # Leases are written before claims, so go by the claim's
+                # own time if its lease has gone.
+                try:
+                    touched = os.stat(claimed).st_mtime
+                except OSError:
+                    continue
+            if now - touched <= self.lease_seconds:
+                continue
+            jid = name.split('@', 1)[0]
+            try:
+                os.rename(claimed, self._path('pending', jid + '.json'))
+            except OSError:
+                continue
+            self._say('reclaimed expired job:', name)
+            try:
+                os.remove(lease)
+            except OSError:
+                pass
+
+    def claim(self):
+        """Claim a pending job. Returns ``(job id, claimed path)`` or
+        ``None`` if there's nothing pending."""
+        for name in sorted(os.listdir(self._path('pending'))):
+            if name.startswith('.') or not name.endswith('.json'):
+                continue
+            jid = name[:-len('.json')]
+            claimed = self._path('running', jid + '@' + self.name + '.json')
+            # Lease first, so that no other worker ever sees the claim
+            # without a fresh lease and takes it back.
+            lease = claimed[:-len('.json')] + '.lease'
+            self._write_lease(lease)
+            try:
+                os.rename(self._path('pending', name), claimed)
+            except OSError:
+                # Another worker got there first.
+                try:
+                    os.remove(lease)
+                except OSError:
+                    pass
+                continue
+            # Renaming keeps the submission time, so mark the claim time.
+            os.utime(claimed, None)
+            return jid, claimed
+        return None
+
+    def _write_lease(self, lease):
+        f = open(lease, 'w')
+        try:
+            f.write(self.name + '\n')
+        finally:
+            f.close()
+
+    def _heartbeat(self, lease, stop):
+        interval = max(self.lease_seconds / 4.0, 0.1)
+        while not stop.wait(interval):
+            try:
+                os.utime(lease, None)
+            except OSError:
+                return
+
+    def run_job(self, jid, claimed):
+        lease = claimed[:-len('.json')] + '.lease'
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(lease, stop))
+        beat.daemon = True
+        beat.start()
+        report = {'id': jid, 'worker': self.name, 'started': time.time()}
+        status, error = 'done', None
+        try:
+            job = read_json(claimed)
+            report['mkvfile'] = job['mkvfile']
+            self._say('converting:', job['mkvfile'])
+            self.run(job['mkvfile'], **job['opts'])
+        except SystemExit:
+            et, ev, tb = sys.exc_info()
+            if ev.code:
+                status, error = 'failed', 'exit status: ' + str(ev.code)
+        except Exception:
+            et, ev, tb = sys.exc_info()
+            status = 'failed'
+            error = ''.join(traceback.format_exception_only(et, ev)).rstrip()
+        finally:
+            stop.set()
+            beat.join()
+        report['finished'] = time.time()
+        report['elapsed'] = report['finished'] - report['started']
+        try:
+            os.rename(claimed, self._path(status, jid + '.json'))
+        except OSError:
+            # Our lease expired and someone else has the job now.
+            status = 'lost'
+        try:
+            os.remove(lease)
+        except OSError:
+            pass
+        report['status'] = status
+        if error is not None:
+            report['error'] = error
+        write_json(self._path('reports', jid + '.json'), report)
+        self._say(status + ':', jid)
+        return status
+
+    def loop(self):
+        """Run jobs until none are pending or running. Returns the number of
+        jobs this worker failed."""
+        failed = 0
+        while True:
+            self.reclaim_expired()
+            claimed = self.claim()
+            if claimed is not None:
+                if self.run_job(*claimed) != 'done':
+                    failed += 1
+                continue
+            if not os.listdir(self._path('running')):
+                return failed
+            time.sleep(self.poll_seconds)
@@ -0,0 +1,242 @@
+"""Read the ISO base media (mp4) box structure, without touching any of the
+media data itself."""
+
+import struct
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+
+def read_box_header(f, end=None):
+    """Read the box header at the current position of *f*.
+
+    Returns ``(type, size, header_size)`` or ``None`` if there is no complete
+    header before *end*. A *size* of ``None`` means the box extends to the end
+    of the file."""
+    pos = f.tell()
+    if end is not None and pos + 8 > end:
+        return None
+    hdr = f.read(8)
+    if len(hdr) < 8:
+        return None
+    size, typ = struct.unpack('>I4s', hdr)
+    typ = typ.decode('latin_1')
+    header_size = 8
+    if size == 1:
+        large = f.read(8)
+        if len(large) < 8:
+            return None
+        size = struct.unpack('>Q', large)[0]
+        header_size = 16
+    elif size == 0:
+        size = None
+    return typ, size, header_size
+
+
+def iter_boxes(f, start=0, end=None):
+    """Yield ``(type, offset, size, header_size)`` for each box between
+    *start* and *end* in *f*, without descending into them."""
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    pos = start
+    while pos < end:
+        f.seek(pos)
+        hdr = read_box_header(f, end)
+        if hdr is None:
+            return
+        typ, size, header_size = hdr
+        if size is None:
+            size = end - pos
+        if size < header_size:
+            return
+        yield typ, pos, size, header_size
+        pos += size
+
+
+def find_box(f, path, start=0, end=None):
+    """Find the first box at *path* (e.g., ``['moov', 'trak', 'mdia']``).
+
+    Returns ``(type, offset, size, header_size)`` or ``None``."""
+    for box in iter_boxes(f, start, end):
+        if box[0] != path[0]:
+            continue
+        if len(path) == 1:
+            return box
+        typ, offset, size, header_size = box
+        return find_box(f, path[1:], offset + header_size, offset + size)
+    return None
+
+
+def top_level_boxes(mp4):
+    f = open(mp4, 'rb')
+    try:
+        return list(iter_boxes(f))
+    finally:
+        f.close()
+
+
+def moov_size(mp4):
+    """Return the size of the ``moov`` box in *mp4*, or ``None``."""
+    for typ, offset, size, header_size in top_level_boxes(mp4):
+        if typ == 'moov':
+            return size
+    return None
+
+
+def is_faststart(mp4):
+    """Whether ``moov`` comes before ``mdat`` in *mp4*."""
+    for typ, offset, size, header_size in top_level_boxes(mp4):
+        if typ == 'moov':
+            return True
+        if typ == 'mdat':
+            return False
+    return False
+
+
+# Text subtitles, per second: ffmpeg writes an empty sample between cues,
+# and each sample has a size, a duration and a share of the chunk offsets.
+subtitle_second_bytes = 16
+
+
+def moov_reserve(moov, duration=None, subtitles=False, extra=0):
+    """How much room to reserve at the start of a remux of an mp4 whose
+    ``moov`` is *moov* bytes, so that it can be written first in a single
+    pass (see ffmpeg's ``-moov_size``).
+
+    Room is added for text subtitles over *duration* seconds if
+    *subtitles*, and for *extra* bytes of metadata."""
+    size = moov + int(extra)
+    if subtitles and duration:
+        size += int(duration * subtitle_second_bytes)
+    # Leave room for what the remux writes differently (e.g., co64 rather
+    # than stco).
+    return size + size // 8 + 16384
+
+
+def _read_full_box(f, box, n):
+    """Read *n* bytes of the body of *box*, after its version and flags.
+    Returns ``(version, body)``."""
+    typ, offset, size, header_size = box
+    f.seek(offset + header_size)
+    data = f.read(4 + n)
+    return ord(data[0:1]), data[4:]
+
+
+def _language(packed):
+    if packed == 0 or packed == 0x7fff:
+        return 'und'
+    return ''.join(chr(((packed >> s) & 0x1f) + 0x60) for s in (10, 5, 0))
+
+
+def _last_chunk_offset(f, stbl):
+    """The offset of the last chunk in the chunk offset table, or ``None``."""
+    typ, offset, size, header_size = stbl
+    for name, width, fmt in (('stco', 4, '>I'), ('co64', 8, '>Q')):
+        box = find_box(f, [name], offset + header_size, offset + size)
+        if box is None:
+            continue
+        version, body = _read_full_box(f, box, 4)
+        count = struct.unpack('>I', body)[0]
+        if count == 0:
+            return None
+        f.seek(box[1] + box[3] + 8 + (count - 1) * width)
+        return struct.unpack(fmt, f.read(width))[0]
+    return None
+
+
+def read_track(f, trak):
+    """Read what *trak* says about its track, without reading any samples."""
+    typ, offset, size, header_size = trak
+    track = {}
+    mdia = find_box(f, ['mdia'], offset + header_size, offset + size)
+    if mdia is None:
+        return track
+    start, end = mdia[1] + mdia[3], mdia[1] + mdia[2]
+    mdhd = find_box(f, ['mdhd'], start, end)
+    if mdhd is not None:
+        version, body = _read_full_box(f, mdhd, 34)
+        if version == 1:
+            timescale, duration, lang = struct.unpack('>16xIQH', body[:30])
+        else:
+            timescale, duration, lang = struct.unpack('>8xIIH', body[:18])
+        track['timescale'] = timescale
+        if timescale:
+            track['duration'] = duration / float(timescale)
+        track['language'] = _language(lang)
+    hdlr = find_box(f, ['hdlr'], start, end)
+    if hdlr is not None:
+        version, body = _read_full_box(f, hdlr, 8)
+        track['handler'] = body[4:8].decode('latin_1')
+    stbl = find_box(f, ['minf', 'stbl'], start, end)
+    if stbl is None:
+        return track
+    start, end = stbl[1] + stbl[3], stbl[1] + stbl[2]
+    stsd = find_box(f, ['stsd'], start, end)
+    if stsd is not None:
+        version, body = _read_full_box(f, stsd, 12)
+        if len(body) == 12:
+            track['codec'] = body[8:12].decode('latin_1')
+    stts = find_box(f, ['stts'], start, end)
+    if stts is not None:
+        version, body = _read_full_box(f, stts, 4)
+        count = struct.unpack('>I', body)[0]
+        entries = f.read(count * 8)
+        samples, ticks = 0, 0
+        for i in range(0, len(entries) - 7, 8):
+            n, delta = struct.unpack('>II', entries[i:i + 8])
+            samples += n
+            ticks += n * delta
+        track['stts_samples'] = samples
+        if ticks and track.get('timescale'):
+            track['fps'] = samples * float(track['timescale']) / ticks
+    stsz = find_box(f, ['stsz'], start, end)
+    if stsz is not None:
+        version, body = _read_full_box(f, stsz, 8)
+        track['samples'] = struct.unpack('>II', body)[1]
+    track['last_chunk_offset'] = _last_chunk_offset(f, stbl)
+    return track
+
+
+def read_tracks(mp4):
+    """Read the track tables of *mp4* into a dictionary::
+
+        {'size': ..., 'mdat_truncated': ..., 'tracks': [{'handler': 'vide',
+        'codec': 'avc1', 'language': 'eng', 'duration': ..., 'samples': ...,
+        'fps': ...}, ...]}
+
+    Only the box headers and the ``moov`` box are read."""
+    f = open(mp4, 'rb')
+    try:
+        f.seek(0, 2)
+        filesize = f.tell()
+        info = {'size': filesize, 'tracks': [], 'mdat_truncated': False}
+        moov = None
+        pos = 0
+        while pos < filesize:
+            f.seek(pos)
+            hdr = read_box_header(f)
+            if hdr is None:
+                break
+            typ, size, header_size = hdr
+            if size is None:
+                size = filesize - pos
+            if size < header_size:
+                break
+            if pos + size > filesize:
+                if typ == 'mdat':
+                    info['mdat_truncated'] = True
+                break
+            if typ == 'moov':
+                moov = (typ, pos, size, header_size)
+            pos += size
+        if moov is None:
+            return info
+        for box in iter_boxes(f, moov[1] + moov[3], moov[1] + moov[2]):
+            if box[0] == 'trak':
+                info['tracks'].append(read_track(f, box))
+        return info
+    finally:
+        f.close()
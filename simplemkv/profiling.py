@@ -0,0 +1,173 @@
+"""Profile the Python side of a conversion (e.g., parsing mkvinfo output, or
+scanning raw streams) with cProfile and tracemalloc, leaving the results in
+a directory to look at later.
+
+For a job named *name*, the files written are::
+
+    <name>.pstats       cProfile statistics, for pstats or snakeviz
+    <name>.txt          the 40 functions with the most cumulative time
+    <name>.tracemalloc  a tracemalloc snapshot, for Snapshot.load
+    <name>.top.txt      the 25 lines that allocated the most during the job
+
+Only the thread that runs the job is profiled, but tracemalloc sees the
+allocations of every thread, so when jobs run at once each snapshot includes
+those of the others. The peak is only reset when a job starts while no other
+is traced, so that no job's peak is lost; the peak written for a job that
+overlapped others is the highest since the first of them started."""
+
+import os
+import sys
+import errno
+import threading
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+top_functions = 40
+top_lines = 25
+
+# The Profilers tracing memory now, and the job whose start last reset the
+# peak.
+_tracing = []
+_peak_since = None
+_tracing_lock = threading.Lock()
+
+
+def _makedirs(d):
+    try:
+        os.makedirs(d)
+    except OSError:
+        et, ev, tb = sys.exc_info()
+        if ev.errno != errno.EEXIST:
+            raise
+
+
+class Profiler(object):
+    """A context manager profiling the job *name* run in its ``with``
+    block with cProfile if *profile_dir* is given, and tracemalloc if
+    *trace_dir* is. It does nothing if neither is.
+
+    Problems writing the results are reported with *errorfunc*."""
+
+    def __init__(self, name, profile_dir=None, trace_dir=None, errorfunc=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.trace_dir = trace_dir
+        self.errorfunc = errorfunc
+        self.profile = None
+        self.start = None
+        self.overlapped = False
+
+    def _error(self, *args):
+        if self.errorfunc is not None:
+            self.errorfunc(*args)
+
+    def __enter__(self):
+        global _peak_since
+        if self.trace_dir is not None and tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _tracing_lock.acquire()
+            try:
+                if _tracing:
+                    for p in _tracing + [self]:
+                        p.overlapped = True
+                elif hasattr(tracemalloc, 'reset_peak'):
+                    # So the peak is this job's, not the highest of any job
+                    # before.
+                    tracemalloc.reset_peak()
+                    _peak_since = self.name
+                _tracing.append(self)
+            finally:
+                _tracing_lock.release()
+            self.start = tracemalloc.take_snapshot()
+        if self.profile_dir is not None:
+            import cProfile
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Python 3.12 and later can only profile one job at a time.
+                et, ev, tb = sys.exc_info()
+                self._error('not profiling', self.name + ':', str(ev))
+                self.profile = None
+        return self
+
+    def __exit__(self, et, ev, tb):
+        if self.profile is not None:
+            self.profile.disable()
+        # Snapshot first, so that writing the profile isn't in it.
+        if self.start is not None:
+            try:
+                self._write_trace()
+            except (IOError, OSError):
+                e = sys.exc_info()[1]
+                self._error('failed to write memory trace:',
+                            self.name + ':', str(e))
+            finally:
+                _tracing_lock.acquire()
+                try:
+                    _tracing.remove(self)
+                finally:
+                    _tracing_lock.release()
+        if self.profile is not None:
+            try:
+                self._write_profile()
+            except (IOError, OSError):
+                e = sys.exc_info()[1]
+                self._error('failed to write profile:', self.name + ':',
+                            str(e))
+        return False
+
+    def _write_profile(self):
+        import pstats
+        _makedirs(self.profile_dir)
+        base = os.path.join(self.profile_dir, self.name)
+        self.profile.dump_stats(base + '.pstats')
+        f = open(base + '.txt', 'w')
+        try:
+            stats = pstats.Stats(self.profile, stream=f)
+            stats.sort_stats('cumulative').print_stats(top_functions)
+        finally:
+            f.close()
+
+    def _write_trace(self):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        _makedirs(self.trace_dir)
+        base = os.path.join(self.trace_dir, self.name)
+        snapshot.dump(base + '.tracemalloc')
+        import cProfile
+        import pstats
+        # Leave out the profilers themselves, and imports.
+        ignore = [tracemalloc.Filter(False, m.__file__)
+                  for m in (tracemalloc, cProfile, pstats)]
+        ignore.append(tracemalloc.Filter(False,
+                                         '<frozen importlib._bootstrap*>'))
+        diff = snapshot.filter_traces(ignore).compare_to(
+            self.start.filter_traces(ignore), 'lineno')
+        f = open(base + '.top.txt', 'w')
+        try:
+            if not hasattr(tracemalloc, 'reset_peak'):
+                # Before Python 3.9, the peak can't be reset.
+                since = 'since tracing started'
+            elif self.overlapped:
+                since = ('since %s started, with other jobs running'
+                         % _peak_since)
+            else:
+                since = 'during %s' % self.name
+            f.write('traced memory: %d bytes now, %d at the peak %s\n'
+                    % (current, peak, since))
+            f.write('top %d lines allocating during %s:\n'
+                    % (top_lines, self.name))
+            for stat in diff[:top_lines]:
+                f.write('%s\n' % stat)
+        finally:
+            f.close()
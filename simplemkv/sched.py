@@ -0,0 +1,161 @@
+"""Run the stages of many conversions at once, without letting them fight
+over the same disk.
+
+Each stage is either ``'io'``, for stages that stream from one file to
+another (extracting, muxing), or ``'cpu'``, for stages that mostly compute
+(encoding audio). Only so many ``'io'`` stages may use any one device (as
+told by ``st_dev``) at once, and only so many ``'cpu'`` stages may run at
+once in total."""
+
+import os
+import sys
+import threading
+import traceback
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def path_device(path):
+    """The ``st_dev`` of *path*, or of the directory it would be created in
+    if it doesn't exist yet."""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+class Slot(object):
+    def __init__(self, scheduler, resource, devices):
+        self.scheduler = scheduler
+        self.resource = resource
+        self.devices = devices
+
+    def __enter__(self):
+        self.scheduler.acquire(self.resource, self.devices)
+        return self
+
+    def __exit__(self, et, ev, tb):
+        self.scheduler.release(self.resource, self.devices)
+        return False
+
+
+class StageScheduler(object):
+    """Hands out slots to stages of conversions running in several threads.
+
+    Use as::
+
+        with scheduler.slot('io', [mkvfile, rawvideo]):
+            extract()
+    """
+
+    def __init__(self, cpu_slots=None, io_per_device=1):
+        if cpu_slots is None:
+            cpu_slots = cpu_count()
+        self.cpu_slots = cpu_slots
+        self.io_per_device = io_per_device
+        self._cpu_busy = 0
+        self._io_busy = {}
+        self._cond = threading.Condition()
+
+    def slot(self, resource, paths):
+        """A context manager holding a slot for a stage of class *resource*
+        that reads or writes *paths*."""
+        devices = []
+        if resource == 'io':
+            devices = sorted(set(path_device(p) for p in paths))
+        return Slot(self, resource, devices)
+
+    def _free(self, resource, devices):
+        if resource == 'cpu':
+            return self._cpu_busy < self.cpu_slots
+        for d in devices:
+            if self._io_busy.get(d, 0) >= self.io_per_device:
+                return False
+        return True
+
+    def acquire(self, resource, devices):
+        self._cond.acquire()
+        try:
+            while not self._free(resource, devices):
+                self._cond.wait()
+            if resource == 'cpu':
+                self._cpu_busy += 1
+            for d in devices:
+                self._io_busy[d] = self._io_busy.get(d, 0) + 1
+        finally:
+            self._cond.release()
+
+    def release(self, resource, devices):
+        self._cond.acquire()
+        try:
+            if resource == 'cpu':
+                self._cpu_busy -= 1
+            for d in devices:
+                self._io_busy[d] -= 1
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+
+def run_batch(items, run, jobs, errorfunc=None):
+    """Call ``run(item)`` for each of *items*, from *jobs* threads.
+
+    *run* reports failure by raising an exception, or ``SystemExit`` with a
+    non-zero code. Returns the list of items that failed."""
+    todo = list(reversed(items))
+    failed = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not todo:
+                    return
+                item = todo.pop()
+            finally:
+                lock.release()
+            try:
+                run(item)
+                ok = True
+            except SystemExit:
+                et, ev, tb = sys.exc_info()
+                ok = not ev.code
+            except Exception:
+                et, ev, tb = sys.exc_info()
+                ok = False
+                if errorfunc is not None:
+                    estr = ''.join(traceback.format_exception_only(et, ev))
+                    errorfunc(str(item) + ':', estr.rstrip('\n'))
+            if not ok:
+                lock.acquire()
+                try:
+                    failed.append(item)
+                finally:
+                    lock.release()
+
+    threads = [threading.Thread(target=worker) for i in range(max(jobs, 1))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        # Join with a timeout so the main thread still sees KeyboardInterrupt.
+        while t.is_alive():
+            t.join(1.0)
+    return [i for i in items if i in failed]
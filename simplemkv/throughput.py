@@ -0,0 +1,143 @@
+"""Remember how fast each stage of past conversions ran, and use that to
+predict how long new conversions will take.
+
+Extracting and muxing are measured in bytes read per second, and audio
+conversion in seconds of audio per second, separately for each source codec
+and channel count."""
+
+import os
+import json
+import threading
+
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = 'unknown'
+
+# Rates to assume until we've measured some.
+default_rates = {
+    'extract': 100e6,
+    'mux': 100e6,
+    'convert-audio': 50.0,
+}
+# How much each new measurement moves the remembered rate.
+smoothing = 0.3
+
+
+def default_path():
+    cache = os.environ.get('XDG_CACHE_HOME')
+    if not cache:
+        cache = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'mkvtomp4', 'throughput.json')
+
+
+def stage_kind(name):
+    """The kind of rate stage *name* is measured by, or ``None``."""
+    if name.startswith('extract'):
+        return 'extract'
+    if name in ('mp4', 'add-sub', 'add-metadata'):
+        return 'mux'
+    if name == 'convert-audio':
+        return 'convert-audio'
+    return None
+
+
+def audio_key(codec, channels):
+    return 'convert-audio:%s:%s' % (str(codec).lower(), channels)
+
+
+def format_seconds(secs):
+    secs = int(round(secs))
+    if secs >= 3600:
+        return '%dh%02dm%02ds' % (secs // 3600, secs // 60 % 60, secs % 60)
+    if secs >= 60:
+        return '%dm%02ds' % (secs // 60, secs % 60)
+    return '%ds' % secs
+
+
+class ThroughputModel(object):
+    """Throughput history, kept in the JSON file *path*."""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self._lock = threading.Lock()
+        self.rates = self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'r')
+        except (IOError, OSError):
+            return {}
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+        finally:
+            f.close()
+
+    def rate(self, key):
+        if key in self.rates:
+            return self.rates[key]['rate']
+        return default_rates[key.split(':', 1)[0]]
+
+    def record(self, key, amount, seconds):
+        """Record that *amount* (bytes, or seconds of audio) took *seconds*."""
+        if amount <= 0 or seconds <= 0:
+            return
+        rate = amount / float(seconds)
+        self._lock.acquire()
+        try:
+            old = self.rates.get(key)
+            if old is None:
+                self.rates[key] = {'rate': rate, 'samples': 1}
+            else:
+                old['rate'] += smoothing * (rate - old['rate'])
+                old['samples'] += 1
+            self.save()
+        finally:
+            self._lock.release()
+
+    def save(self):
+        d = os.path.dirname(self.path)
+        if d and not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError:
+                return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            f = open(tmp, 'w')
+            try:
+                json.dump(self.rates, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+    def estimate(self, size, info, audiotrack=None, extracts=2, remuxes=0):
+        """Estimate how many seconds each kind of stage of converting an mkv
+        of *size* bytes, which mkvinfo described with *info*, will take.
+        Returns a dictionary with the keys of *default_rates*.
+
+        Each of *extracts* extractions reads the whole mkv, and the mux and
+        any of *remuxes* later passes each read about that much again. Audio
+        conversion is estimated from *audiotrack* if it isn't AAC already."""
+        secs = dict((kind, 0.0) for kind in default_rates)
+        secs['extract'] = extracts * size / self.rate('extract')
+        secs['mux'] = (1 + remuxes) * size / self.rate('mux')
+        if audiotrack is not None and info.get('duration'):
+            codec = audiotrack.get('codec', '')
+            if codec.upper() not in ('AAC', 'A_AAC'):
+                key = audio_key(codec, audiotrack.get('channels'))
+                secs['convert-audio'] = info['duration'] / self.rate(key)
+        return secs
+
+    def predict(self, size, info, audiotrack=None, extracts=2, remuxes=0):
+        """Predict how many seconds converting an mkv of *size* bytes, which
+        mkvinfo described with *info*, will take, in all. See *estimate*."""
+        return sum(self.estimate(size, info, audiotrack, extracts,
+                                 remuxes).values())
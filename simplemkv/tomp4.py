@@ -8,18 +8,31 @@ except ImportError:
 
 import sys
 import os
+import time
 import errno
 import re
 import getopt
-import subprocess as sp
 import struct
 import traceback
+import threading
 try:
     from shlex import quote
 except:
     from pipes import quote
 
 import simplemkv.info
+import simplemkv.mp4
+import simplemkv.checkpoint
+import simplemkv.jobqueue
+import simplemkv.sched
+import simplemkv.graph
+import simplemkv.throughput
+import simplemkv.audit
+import simplemkv.ebml
+import simplemkv.demux
+import simplemkv.executor
+import simplemkv.profiling
+import simplemkv.governor
 
 simple_usage = 'usage: mkvtomp4 [options] [--] <file>'
 
@@ -94,7 +107,9 @@ def sq(args):
     return " ".join([__sq(x) for x in args])
 
 
-def command(cmd, **kwargs):
+def run_command(cmd, **kwargs):
+    """Run *cmd* as *command* does, but return ``(returncode, stdout,
+    stderr)`` rather than dying if it fails."""
     verbose_kwargs = {}
     verbosity = kwargs.get('verbosity')
     if verbosity is not None:
@@ -104,8 +119,9 @@ def command(cmd, **kwargs):
     if spopts:
         vprint(1, 'command: options: %s' % str(spopts), **verbose_kwargs)
     try:
-        proc = sp.Popen(
-            cmd, stdout=sp.PIPE, stderr=sp.PIPE, close_fds=True, **spopts
+        returncode, chout, cherr = simplemkv.executor.run(
+            cmd, stall_timeout=kwargs.get('stall_timeout'),
+            timeout=kwargs.get('stage_timeout'), **spopts
         )
     except OSError:
         et, ev, tb = sys.exc_info()
@@ -113,14 +129,28 @@ def command(cmd, **kwargs):
         if ev.errno == errno.ENOENT:
             die('command not found:', cmd[0] + ':', estr.rstrip('\n'))
         die('command failed:', estr.rstrip('\n') + ':', sq(cmd))
-    chout, cherr = proc.communicate()
-    if chout is not str:
-        chout = chout.decode('utf_8')
-    if cherr is not str:
-        cherr = cherr.decode('utf_8')
+    except (simplemkv.executor.Stalled, simplemkv.executor.TimedOut):
+        et, ev, tb = sys.exc_info()
+        die('killed:', str(ev) + ':', sq(cmd))
+    chout = chout.decode('utf_8', 'replace')
+    cherr = cherr.decode('utf_8', 'replace')
     vprint(1, 'command: stdout:', chout, '\ncommand: stderr:', cherr, **verbose_kwargs)
-    if proc.returncode != 0:
-        die('failure: %s' % cherr, end='')
+    return returncode, chout, cherr
+
+
+def command_failed(cmd, returncode, cherr):
+    if not cherr.strip():
+        die('failure: exit status %d:' % returncode, sq(cmd))
+    die(('failure: %s' % cherr).rstrip('\n'))
+
+
+def command(cmd, **kwargs):
+    """Run *cmd* with *simplemkv.executor.run*, dying if it fails, stalls
+    for ``kwargs['stall_timeout']`` seconds, or runs for longer than
+    ``kwargs['stage_timeout']`` seconds."""
+    returncode, chout, cherr = run_command(cmd, **kwargs)
+    if returncode != 0:
+        command_failed(cmd, returncode, cherr)
     return chout
 
 
@@ -131,12 +161,34 @@ def dry_command(cmd, **opts):
         command(cmd, **opts)
 
 
-def dry_system(cmd, **opts):
-    quoted = sq(cmd)
+def remux_command(cmd, reserve=None, **opts):
+    """Run the ffmpeg remux *cmd* as *dry_command* does.
+
+    If *cmd* has ``-movflags +faststart``, with which ffmpeg writes the file
+    and then moves moov to its start in a second pass, and ``reserve()``
+    returns a size, reserve that much room for moov up front with
+    ``-moov_size`` instead, so that the file is written once. If that isn't
+    enough room, or moov doesn't end up first, run *cmd* as it is."""
+    if '+faststart' not in cmd or reserve is None:
+        dry_command(cmd, **opts)
+        return
     if opts['dry_run']:
-        prin(quoted)
-    else:
-        os.system(quoted)
+        prin(sq(cmd), '# with -moov_size if the first pass\'s moov is known')
+        return
+    size = reserve()
+    if size is None:
+        command(cmd, **opts)
+        return
+    i = cmd.index('+faststart')
+    once = cmd[:i - 1] + ['-moov_size', str(size)] + cmd[i + 1:]
+    returncode, chout, cherr = run_command(once, **opts)
+    if returncode == 0 and simplemkv.mp4.is_faststart(once[-1]):
+        return
+    if returncode != 0 and 'reserved_moov_size' not in cherr:
+        command_failed(once, returncode, cherr)
+    vprint(1, 'moov needed more room than reserved; moving it afterwards',
+           **opts)
+    command(cmd, **opts)
 
 
 def default_options(argv0):
@@ -168,6 +220,7 @@ def default_options(argv0):
         'force_profile_level': False,
         'correct_prof_only': False,
         'print_prof_only': False,
+        'cut_sample_only': False,
         'fps': None,
         'stop_v_ex': False,
         'stop_correct': False,
@@ -179,10 +232,57 @@ def default_options(argv0):
         'mp4box': 'MP4Box',
         'ffmpeg': 'ffmpeg',
         'summary': True,
+        'faststart': False,
+        'resume': True,
+        'queue_dir': None,
+        'queue_submit': False,
+        'queue_worker': False,
+        'lease_seconds': 120,
+        'jobs': 1,
+        'io_per_device': 1,
+        'export_make': None,
+        'export_ninja': None,
+        'verify': True,
+        'throughput_file': None,
+        'sample': None,
+        'parallel_demux': 0,
+        'parallel_demux_min_size': 1 << 30,
+        'stall_timeout': 600,
+        'stage_timeout': None,
+        'variants': [],
+        'audit': None,
+        'probe_cache': None,
+        'profile_python': None,
+        'trace_memory': None,
+        'nice': None,
+        'ionice': None,
+        'stage_policies': {},
+        'read_limit': None,
+        'stream': None,
     }
 
 
-def mp4_add_cmd(mp4file, rawvideo, rawaudio, **opts):
+# Options that say how to run mkvtomp4, rather than how to convert a file.
+queue_only_keys = (
+    'argv0', 'verbosity', 'dry_run', 'summary',
+    'correct_prof_only', 'print_prof_only', 'cut_sample_only',
+    'queue_dir', 'queue_submit', 'queue_worker', 'lease_seconds',
+    'jobs', 'io_per_device', 'export_make', 'export_ninja',
+    'throughput_file', 'throughput', 'audit', 'probe_cache',
+    'profile_python', 'trace_memory',
+    'nice', 'ionice', 'stage_policies', 'read_limit', 'read_budget',
+    'stream', 'stream_fd',
+)
+# Options naming files, that a job needs absolute.
+path_keys = ('output', 'subtitles_file')
+# Options naming local commands, that a worker's own values override.
+tool_keys = ('mkvinfo', 'mkvextract', 'mp4box', 'ffmpeg')
+# Options sharing out the host a worker runs on, that it applies to every job.
+governor_keys = ('nice', 'ionice', 'stage_policies', 'read_budget')
+
+
+def mp4_add_cmd(mp4file, rawvideo, rawaudio, rawsub=None, sublang=None,
+                **opts):
     a_delay = opts.get('a_delay')
     if a_delay is not None:
         a_delay = ':delay=' + a_delay
@@ -193,11 +293,47 @@ def mp4_add_cmd(mp4file, rawvideo, rawaudio, **opts):
         a_lang = ':lang=' + a_lang
     else:
         a_lang = ''
+    # MP4Box converts SRT text subtitles to tx3g itself.
+    sub = []
+    if rawsub is not None:
+        s_opts = ':hdlr=sbtl'
+        if sublang is not None:
+            s_opts += ':lang=' + sublang
+        if not opts.get('s_default', False):
+            s_opts += ':disable'
+        sub = ['-add', rawsub + s_opts]
+    # MP4Box already lays out moov before mdat as it writes (it interleaves
+    # every 0.5s by default), so --faststart needs nothing more here.
     return [
         opts.get('mp4box', 'MP4Box'),
         '-add', rawvideo + '#video:fps=' + str(opts['fps']),
         '-add', rawaudio + '#audio:default' + a_delay + a_lang] + \
-        ['-new', mp4file]
+        sub + ['-new', mp4file]
+
+
+def ffmpeg_faststart_args(**opts):
+    """ffmpeg arguments to put moov before mdat when remuxing, with
+    --faststart. *remux_command* runs them with room reserved for moov
+    instead, if it knows how much."""
+    if not opts.get('faststart'):
+        return []
+    return ['-movflags', '+faststart']
+
+
+def faststart_reserve(mp4file, info, subtitles=False, extra=0):
+    """How much room to reserve for moov when remuxing *mp4file*, the mp4 of
+    the mkv described by *info*, to add text subtitles if *subtitles* and
+    *extra* bytes of metadata; or ``None`` if *mp4file* has no moov to go
+    by. MP4Box wrote *mp4file* from the same samples, so its moov is about
+    as big as the remux's."""
+    try:
+        moov = simplemkv.mp4.moov_size(mp4file)
+    except (IOError, OSError):
+        return None
+    if moov is None:
+        return None
+    return simplemkv.mp4.moov_reserve(moov, info.get('duration'), subtitles,
+                                      extra)
 
 
 def ffmpeg_convert_audio_cmd(old, new, **opts):
@@ -218,12 +354,27 @@ def ffmpeg_convert_audio_cmd(old, new, **opts):
     ]
 
 
-def pretend_correct_rawh264_profile(rawh264, **opts):
+def correct_rawh264_profile_cmd(rawh264, **opts):
     cmd = [opts['argv0'], '--correct-profile-only', '--profile-level']
     cmd.extend([opts.get('profile_level', '4.1')])
     if opts.get('force_profile_level', False):
         cmd.extend(['--force-profile-level'])
-    prin(sq(cmd + [rawh264]))
+    return cmd + [rawh264]
+
+
+def copy_cmd(src, dst):
+    return ['cp', src, dst]
+
+
+def dry_copy(src, dst, **opts):
+    if opts['dry_run']:
+        prin(sq(copy_cmd(src, dst)))
+    else:
+        simplemkv.governor.copyfile(src, dst, opts.get('read_budget'))
+
+
+def pretend_correct_rawh264_profile(rawh264, **opts):
+    prin(sq(correct_rawh264_profile_cmd(rawh264, **opts)))
 
 
 def read_rawh264_profile(rawh264, **opts):
@@ -267,11 +418,18 @@ def dry_correct_rawh264_profile(rawh264, **opts):
         correct_rawh264_profile(rawh264, **opts)
 
 
-def mkv_extract_track_cmd(mkv, out, track, verbosely=False, mkvextract=None):
+def mkv_extract_tracks_cmd(mkv, tracks, verbosely=False, mkvextract=None):
+    """Extract *tracks*, a list of ``(track, out)``, from *mkv* at once."""
     v = ['-v'] if verbosely else []
     if not mkvextract:
         mkvextract = 'mkvextract'
-    return [mkvextract, 'tracks', mkv] + v + [str(track) + ':' + out]
+    return [mkvextract, 'tracks', mkv] + v + [
+        str(track) + ':' + out for track, out in tracks
+    ]
+
+
+def mkv_extract_track_cmd(mkv, out, track, verbosely=False, mkvextract=None):
+    return mkv_extract_tracks_cmd(mkv, [(track, out)], verbosely, mkvextract)
 
 
 def mp4_extract_track_cmd(mp4, out, track, verbosely=False, mp4box=None):
@@ -281,7 +439,275 @@ def mp4_extract_track_cmd(mp4, out, track, verbosely=False, mp4box=None):
     return [mp4box, '-raw', str(track), mp4, '-out', out]
 
 
-def real_main(mkvfile, **opts):
+def parallel_demux_tracks(mkvfile, tracks, **opts):
+    """Those of *tracks*, a list of ``(track, out)``, that --parallel-demux
+    extracts from parts of *mkvfile*."""
+    parts = opts.get('parallel_demux') or 0
+    try:
+        size = os.path.getsize(mkvfile)
+    except OSError:
+        size = 0
+    if parts < 2 or size < opts['parallel_demux_min_size']:
+        return []
+    return [(t, out) for t, out in tracks
+            if simplemkv.demux.splittable(t['codec'])]
+
+
+def extract_tracks(mkvfile, tracks, extract_cmd, **opts):
+    """Run *extract_cmd*, which extracts *tracks*, a list of ``(track,
+    out)``, from *mkvfile*, or, with --parallel-demux, extract them from parts
+    of *mkvfile* at once, splitting it once for all of them."""
+    parts = opts.get('parallel_demux') or 0
+    if len(parallel_demux_tracks(mkvfile, tracks, **opts)) < len(tracks):
+        dry_command(extract_cmd, **opts)
+        return
+    if opts['dry_run']:
+        prin(sq(extract_cmd), '# in up to %d parts at once' % parts)
+        return
+
+    # The parts are extracted in other threads, which run their commands
+    # as this stage's, but watching and removing their own outputs.
+    policy = simplemkv.executor.current_policy()
+
+    def extract(mkv, outs):
+        with simplemkv.executor.Stage(outs, policy):
+            command(mkv_extract_tracks_cmd(
+                mkv, [(t['number'], o) for (t, out), o in zip(tracks, outs)],
+                verbosely=(opts['verbosity'] > 0),
+                mkvextract=opts.get('mkvextract'),
+            ), **opts)
+    outs = [out for t, out in tracks]
+    n = simplemkv.demux.parallel_extract(
+        mkvfile, outs, parts, extract, tracks[0][0]['number'] + 1,
+        errorfunc=eprint, reader=opts.get('read_budget'),
+    )
+    vprint(1, 'extracted %s in %d parts' % (', '.join(outs), n), **opts)
+
+
+def parse_size(s):
+    """Parse a number of bytes, with an optional K, M, G or T suffix."""
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$', s, re.I)
+    if m is None:
+        raise ValueError('invalid size: ' + s)
+    power = ' KMGT'.index(m.group(2).upper() or ' ')
+    return int(float(m.group(1)) * 1024 ** power)
+
+
+# What each stage mostly uses: 'io' stages stream from *inputs* to
+# *outputs*, 'cpu' stages mostly compute.
+stage_resources = {
+    'extract-video': 'io',
+    'correct-profile': 'cpu',
+    'copy-video': 'io',
+    'extract-audio': 'io',
+    'convert-audio': 'cpu',
+    'extract-sub': 'io',
+    'mp4': 'io',
+    'add-sub': 'io',
+    'add-metadata': 'io',
+    'stream': 'io',
+}
+
+
+def stage_policy(name, **opts):
+    """The priorities to run the commands of stage *name* at: --nice and
+    --ionice, overridden by any --stage-policy for its kind of stage (see
+    *stage_resources*), then by any for the stage itself. ``None`` if
+    there are none."""
+    policy = {'nice': opts.get('nice'), 'ionice': opts.get('ionice')}
+    policies = opts.get('stage_policies') or {}
+    for key in (stage_resources.get(name, 'io'), name):
+        policy.update(policies.get(key, {}))
+    if policy['nice'] is None and policy['ionice'] is None:
+        return None
+    return simplemkv.governor.Policy(policy['nice'], policy['ionice'])
+
+
+def parse_stage_policy(spec):
+    """Parse a --stage-policy ``<stage>:<key>=<value>,...`` into the stage
+    and a dictionary of its priorities."""
+    stage, sep, settings = spec.partition(':')
+    if stage not in stage_resources and stage not in ('io', 'cpu'):
+        die('--stage-policy is for io, cpu or one of %s: %s' % (
+            ', '.join(sorted(stage_resources)), spec))
+    policy = {}
+    for setting in settings.split(','):
+        key, sep, value = setting.partition('=')
+        try:
+            if key == 'nice':
+                policy['nice'] = int(value)
+            elif key == 'ionice':
+                policy['ionice'] = simplemkv.governor.parse_ionice(value)
+            else:
+                raise ValueError(setting)
+        except (ValueError, simplemkv.governor.GovernorError):
+            die('--stage-policy takes nice=<n> and ionice=<class>[:<level>],'
+                ' e.g., convert-audio:nice=19:', spec)
+    return stage, policy
+
+
+def run_stage(name, cmd, inputs, outputs, action, measure=None, **opts):
+    """Run stage *name* of a conversion by calling *action*, unless the
+    checkpoint says a previous run already did *cmd* to produce *outputs*.
+
+    *cmd* should not vary with verbosity, so build it with *quiet_opts*. When
+    converting several files at once, *action* waits for the scheduler to
+    allow a stage reading *inputs* and writing *outputs*. When exporting a
+    build graph, the stage is only added to the graph.
+
+    How long *action* takes is added to the throughput history, as bytes of
+    *inputs* per second, or as ``measure = (key, amount)`` if given.
+    *action* must not return if the stage fails (e.g., by running *cmd*
+    with *dry_command*), or the stage would be recorded as done."""
+    graph = opts.get('graph')
+    if graph is not None:
+        graph.add(name, cmd, inputs, outputs)
+        return
+    checkpoint = opts.get('checkpoint')
+    if checkpoint is not None and checkpoint.done(name, cmd, outputs, inputs):
+        if opts['dry_run']:
+            prin('# already done:', sq(cmd))
+        else:
+            vprint(1, 'resuming: skipping stage:', name, **opts)
+        return
+    scheduler = opts.get('scheduler')
+    # What the stage writes, rather than changes in place, is half-written
+    # if the stage is interrupted.
+    written = [o for o in outputs if o not in inputs]
+    try:
+        with simplemkv.executor.Stage(written, stage_policy(name, **opts)):
+            if scheduler is None or opts['dry_run']:
+                start = time.time()
+                action()
+            else:
+                resource = stage_resources.get(name, 'io')
+                with scheduler.slot(resource, list(inputs) + list(outputs)):
+                    start = time.time()
+                    action()
+    except (KeyboardInterrupt, simplemkv.executor.Cancelled):
+        if not opts['dry_run']:
+            simplemkv.executor.remove_outputs(written)
+        raise
+    elapsed = time.time() - start
+    if checkpoint is not None and not opts['dry_run']:
+        checkpoint.complete(name, cmd, outputs, inputs)
+    model = opts.get('throughput')
+    kind = simplemkv.throughput.stage_kind(name)
+    if model is not None and kind is not None and not opts['dry_run']:
+        if measure is None:
+            amount = 0
+            for i in set(inputs):
+                try:
+                    amount += os.path.getsize(i)
+                except OSError:
+                    pass
+            measure = (kind, amount)
+        model.record(measure[0], measure[1], elapsed)
+
+
+def quiet_opts(opts):
+    quiet = opts.copy()
+    quiet['verbosity'] = 0
+    return quiet
+
+
+# The mp4 sample entries and handlers we expect for what we put in the mp4.
+mp4_codecs = {
+    'MPEG4/ISO/AVC': ('avc1', 'avc3'),
+    'MPEGH/ISO/HEVC': ('hvc1', 'hev1'),
+    'AAC': ('mp4a',),
+    'TEXT/UTF8': ('tx3g',),
+    'HDMV/PGS': ('tx3g',),
+}
+mp4_handlers = {
+    'video': ('vide',),
+    'audio': ('soun',),
+    'subtitles': ('text', 'sbtl', 'subt'),
+}
+
+
+def verify_mp4(mp4file, expected, duration=None, **opts):
+    """Check the track tables of *mp4file* against the *expected* tracks
+    (dictionaries with 'type', 'codec', 'language' and, for video, 'fps' and
+    the mkv's 'source_fps') and the source *duration* in seconds, if known.
+    Only metadata is read.
+
+    Video played at another frame rate than the mkv's (with --fps) has the
+    same frames over a duration scaled by the ratio of the rates; if the
+    mkv's rate is unknown, its duration and frames aren't checked.
+
+    Returns a list of problems, which is empty if all is well."""
+    try:
+        mp4info = simplemkv.mp4.read_tracks(mp4file)
+    except (IOError, OSError):
+        et, ev, tb = sys.exc_info()
+        return [''.join(traceback.format_exception_only(et, ev)).rstrip('\n')]
+    problems = []
+    if mp4info['mdat_truncated']:
+        problems.append('mdat is truncated')
+    tracks = mp4info['tracks']
+    if len(tracks) != len(expected):
+        problems.append('expected %d tracks, found %d'
+                        % (len(expected), len(tracks)))
+    slack = 1.0
+    if opts.get('a_delay') is not None:
+        slack += abs(float(opts['a_delay'])) / 1000.0
+    for exp in expected:
+        typ = exp['type']
+        found = [t for t in tracks if t.get('handler') in mp4_handlers[typ]]
+        if not found:
+            problems.append('no %s track' % typ)
+            continue
+        track = found[0]
+        tracks = [t for t in tracks if t is not track]
+        codecs = mp4_codecs.get(exp['codec'], ())
+        if codecs and track.get('codec') not in codecs:
+            problems.append('%s codec is %s, expected %s'
+                            % (typ, track.get('codec'), ' or '.join(codecs)))
+        lang = exp.get('language')
+        if lang not in (None, 'und') and track.get('language') != lang:
+            problems.append('%s language is %s, expected %s'
+                            % (typ, track.get('language'), lang))
+        last = track.get('last_chunk_offset')
+        if last is not None and last >= mp4info['size']:
+            problems.append('%s data is past the end of the file' % typ)
+        samples = track.get('samples')
+        if (samples is not None and
+                samples != track.get('stts_samples', samples)):
+            problems.append('%s sample tables disagree: %d sizes, %d times'
+                            % (typ, samples, track['stts_samples']))
+        if typ == 'subtitles' or not duration:
+            continue
+        fps = exp.get('fps')
+        source_fps = exp.get('source_fps')
+        if typ == 'video' and fps and track.get('fps') and \
+                abs(track['fps'] - fps) > fps * 0.01:
+            problems.append('video frame rate is %.3f, expected %.3f'
+                            % (track['fps'], fps))
+        want = duration
+        if typ == 'video' and fps:
+            if not source_fps:
+                continue
+            want = duration * source_fps / fps
+        tduration = track.get('duration')
+        if tduration is None:
+            problems.append('%s has no duration' % typ)
+        elif abs(tduration - want) > max(slack, want * 0.01):
+            problems.append('%s duration is %.3fs, expected %.3fs'
+                            % (typ, tduration, want))
+        if typ != 'video' or not fps:
+            continue
+        if samples is not None:
+            frames = duration * source_fps
+            if abs(samples - frames) > max(2.0, frames * 0.01):
+                problems.append('video has %d frames, expected about %d'
+                                % (samples, int(frames)))
+    return problems
+
+
+def probe(mkvfile, **opts):
+    """Run mkvinfo on *mkvfile* and return what *simplemkv.info.infodict*
+    makes of it."""
     mkvinfo = opts.get('mkvinfo')
     infoopts = simplemkv.info.info_locale_opts('en_US')
     infoopts['mkvinfo'] = mkvinfo
@@ -293,7 +719,303 @@ def real_main(mkvfile, **opts):
         if ev.errno == errno.ENOENT:
             die('command not found:', mkvinfo + ':', estr.rstrip('\n'))
         die('command failed:', estr.rstrip('\n') + ':', sq([mkvinfo, mkvfile]))
-    info = simplemkv.info.infodict(infostr.split('\n'))
+    return simplemkv.info.infodict(infostr.split('\n'))
+
+
+def predict_seconds(mkvfile, info, model):
+    """Predict how long converting *mkvfile* will take, from its probe *info*
+    and the throughput history *model*."""
+    try:
+        size = os.path.getsize(mkvfile)
+    except OSError:
+        return 0.0
+    tracks = info.get('tracks', [])
+    audio = [t for t in tracks if t.get('type') == 'audio']
+    extracts = 2
+    if [t for t in tracks if t.get('type') == 'subtitles']:
+        extracts += 1
+    return model.predict(size, info, audio[0] if audio else None, extracts)
+
+
+def parse_seconds(s):
+    """Parse seconds, or ``[HH:]MM:SS[.fff]``."""
+    secs = 0.0
+    for part in s.split(':'):
+        secs = secs * 60 + float(part)
+    return secs
+
+
+def parse_sample(spec):
+    """Parse a --sample ``START+DURATION`` into ``(start, duration)``."""
+    try:
+        start, duration = spec.split('+', 1)
+        start, duration = parse_seconds(start), parse_seconds(duration)
+    except ValueError:
+        die('--sample needs <start>+<duration>, e.g., 1:30:00+60:', spec)
+    if start < 0 or duration <= 0:
+        die('--sample needs a positive duration:', spec)
+    return start, duration
+
+
+def sample_path(mkvfile):
+    return os.path.splitext(mkvfile)[0] + '.sample.mkv'
+
+
+def cut_sample_cmd(mkvfile, **opts):
+    start, duration = opts['sample']
+    cmd = [opts['argv0'], '--cut-sample-only',
+           '--sample=%r+%r' % (start, duration)]
+    if opts.get('mkvinfo'):
+        cmd.append('--mkvinfo=' + opts['mkvinfo'])
+    return cmd + [mkvfile]
+
+
+def cut_sample(mkvfile, info, **opts):
+    """Cut the part of *mkvfile* that ``opts['sample']`` asks for into
+    *sample_path* (or, in a dry run, only say what would be cut).
+
+    The clusters covering it are found with the Cues, and copied into a
+    smaller mkv starting at a keyframe."""
+    start, duration = opts['sample']
+    samplefile = sample_path(mkvfile)
+    track = None
+    for t in info.get('tracks', []):
+        if t.get('type') == 'video':
+            track = t['number'] + 1
+            break
+    try:
+        first, last = simplemkv.ebml.write_sample(
+            mkvfile, None if opts['dry_run'] else samplefile, start, duration,
+            track, reader=opts.get('read_budget'),
+        )
+    except (IOError, OSError, simplemkv.ebml.EBMLError):
+        et, ev, tb = sys.exc_info()
+        die('failed to cut sample:', mkvfile + ':', str(ev))
+    if opts['dry_run']:
+        prin('# sample: bytes %d-%d of %s to %s' % (
+            first, last, mkvfile, samplefile))
+    else:
+        vprint(1, 'sample: bytes %d-%d of %s to %s' % (
+            first, last, mkvfile, samplefile), verbosity=opts['verbosity'])
+
+
+def sample_main(mkvfile, **opts):
+    """Convert only the part of *mkvfile* that ``opts['sample']`` asks for,
+    cut by *cut_sample*, as usual. When exporting a build graph, cutting it
+    is only added to the graph."""
+    samplefile = sample_path(mkvfile)
+    info = opts.get('probes', {}).get(mkvfile)
+    if info is None:
+        info = probe(mkvfile, **opts)
+    graph = opts.get('graph')
+    if graph is not None:
+        graph.add('cut-sample', cut_sample_cmd(mkvfile, **opts),
+                  [mkvfile], [samplefile])
+    else:
+        cut_sample(mkvfile, info, **opts)
+    opts = dict(opts, sample=None)
+    if opts['dry_run']:
+        # Nothing was cut, so describe the sample with the whole file.
+        opts['probes'] = dict(opts.get('probes', {}))
+        opts['probes'][samplefile] = info
+    real_main(samplefile, **opts)
+    if graph is not None:
+        graph.add_temps([samplefile])
+    elif not opts['dry_run'] and not opts['keep_temp_files']:
+        try:
+            os.remove(samplefile)
+        except OSError:
+            pass
+
+
+# The codecs of the tracks we can convert.
+videore = re.compile(r'^(V_)?(MPEG4/ISO/AVC|MPEGH/ISO/HEVC)$')
+audiore = re.compile(r'^(A_)?(DTS|AAC|E?AC3|MPEG/L2|VORBIS|FLAC)$')
+subtitlesre = re.compile(r'^(S_)?(TEXT/UTF8|HDMV/PGS)$')
+
+# What each --variant may set.
+variant_keys = (
+    'profile_level', 'a_bitrate', 'a_channels', 'a_codec', 'output',
+)
+
+
+def parse_variant(spec):
+    """Parse a --variant ``key=value,...`` into a dictionary of options."""
+    variant = {}
+    for item in spec.split(','):
+        key, sep, value = item.partition('=')
+        key = key.strip().replace('-', '_')
+        if not sep or key not in variant_keys:
+            die('--variant takes %s, e.g., profile_level=4.1,output=x.mp4: %s'
+                % (', '.join(variant_keys), spec))
+        if key == 'profile_level':
+            try:
+                float(value)
+            except ValueError:
+                die('--variant profile_level needs a level, e.g., 4.1:', value)
+        variant[key] = value
+    return variant
+
+
+def variant_options(mkvfile, **opts):
+    """The options for each output of converting *mkvfile*: *opts* with each
+    --variant's settings, or just *opts* if there are none."""
+    if not opts.get('variants'):
+        return [opts]
+    variants = []
+    for i, variant in enumerate(opts['variants']):
+        vopts = dict(opts)
+        vopts.update(variant)
+        if vopts.get('output') is None:
+            vopts['output'] = '%s.%d.mp4' % (os.path.splitext(mkvfile)[0],
+                                             i + 1)
+        variants.append(vopts)
+    return variants
+
+
+def fan_out(items, run, **opts):
+    """Call ``run(item)`` for each of *items*, in threads at once unless
+    there's only one or this is a dry run. Dies if any of them fail."""
+    if len(items) < 2 or opts['dry_run']:
+        for item in items:
+            run(item)
+        return
+    failed = simplemkv.sched.run_batch(items, run, len(items),
+                                       errorfunc=eprint)
+    if failed:
+        die('%d of %d steps failed' % (len(failed), len(items)))
+
+
+def ffmpeg_level_args(videotrack, **opts):
+    """ffmpeg arguments lowering the H.264 level of *videotrack* to
+    ``opts['profile_level']`` as it is copied, when --correct-profile-only
+    would. If mkvinfo didn't show the level, it is set regardless."""
+    if videotrack['codec'] != 'MPEG4/ISO/AVC':
+        return []
+    profile_level = opts.get('profile_level', '4.1')
+    level = videotrack.get('level')
+    if (opts.get('force_profile_level', False) or level is None or
+            level > float(profile_level)):
+        return ['-bsf:v', 'h264_metadata=level=' + str(profile_level)]
+    return []
+
+
+def ffmpeg_metadata_args(**opts):
+    metadata = []
+    for key, tag in (('title', 'title'), ('show', 'show'), ('genre', 'genre'),
+                     ('year', 'date'), ('director', 'artist'),
+                     ('season', 'season_number'), ('episode', 'episode_sort')):
+        value = opts.get(key)
+        if value is not None:
+            metadata.extend(['-metadata', tag + '=' + value])
+    return metadata
+
+
+def stream_cmd(mkvfile, out, videotrack, audiotrack, subtitlestrack=None,
+               **opts):
+    """The ffmpeg command writing *mkvfile* to *out* (a file or
+    ``pipe:<fd>``) as a fragmented mp4: video copied, audio copied if it is
+    AAC and converted otherwise, and text subtitles as mov_text."""
+    verbosity = opts.get('verbosity', 0)
+    cmd = [opts.get('ffmpeg', 'ffmpeg')]
+    if verbosity > 1:
+        cmd.extend(['-v', str(verbosity - 1)])
+    cmd.extend(['-y', '-i', mkvfile])
+    subfile = opts.get('subtitles_file')
+    if subtitlestrack is not None and subfile is not None:
+        cmd.extend(['-i', subfile])
+    cmd.extend([
+        '-map', '0:%d' % videotrack['number'],
+        '-map', '0:%d' % audiotrack['number'],
+        '-c:v', 'copy',
+    ])
+    cmd.extend(ffmpeg_level_args(videotrack, **opts))
+    a_codec = audiotrack['codec']
+    if a_codec.lower().startswith('a_'):
+        a_codec = a_codec[2:]
+    if a_codec.lower() == 'aac':
+        cmd.extend(['-c:a', 'copy'])
+    else:
+        channels = opts.get('a_channels', '2')
+        if str(channels) == '5.1':
+            channels = '6'
+        cmd.extend([
+            '-ac', str(channels), '-c:a', opts.get('a_codec', 'aac'),
+            '-b:a', str(opts.get('a_bitrate', '128')) + 'k',
+        ])
+    a_lang = opts.get('a_lang')
+    if a_lang is None:
+        a_lang = audiotrack.get('language')
+    if a_lang is not None:
+        cmd.extend(['-metadata:s:a:0', 'language=' + a_lang])
+    if subtitlestrack is not None:
+        if subfile is not None:
+            cmd.extend(['-map', '1:0'])
+        else:
+            cmd.extend(['-map', '0:%d' % subtitlestrack['number']])
+        cmd.extend(['-c:s', 'mov_text'])
+        s_lang = subtitlestrack.get('language')
+        if s_lang is None or s_lang == 'und':
+            s_lang = opts.get('s_lang')
+        if s_lang is not None:
+            cmd.extend(['-metadata:s:s:0', 'language=' + s_lang])
+        s_default = opts.get('s_default', False)
+        cmd.extend(['-disposition:s:0', 'default' if s_default else '0'])
+    cmd.extend(ffmpeg_metadata_args(**opts))
+    # An empty moov up front, then a fragment (moof and mdat) from each
+    # keyframe, so that a reader can play what it has as it arrives.
+    return cmd + [
+        '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-f', 'mp4', out,
+    ]
+
+
+def stream_main(mkvfile, videotrack, audiotrack, subtitlestrack=None, **opts):
+    """Write *mkvfile* as a fragmented mp4 to ``opts['stream']`` (a FIFO,
+    a file, or ``-`` for stdout) in one ffmpeg pass straight from the mkv,
+    with no temporary files, so that whatever reads it can start at once.
+
+    Nothing is checkpointed or verified, since the output can't be read
+    back."""
+    target = opts['stream']
+    if opts.get('a_delay') is not None:
+        wprint('--audio-delay-ms is not applied with --stream')
+    if subtitlestrack is not None and subtitlestrack['codec'] != 'TEXT/UTF8':
+        wprint('--stream leaves out %s subtitles, which can only be text:'
+               % subtitlestrack['codec'], mkvfile)
+        subtitlestrack = None
+    spopts = {}
+    if target != '-':
+        out = target
+    elif opts['dry_run'] or opts.get('stream_fd') is None:
+        out = 'pipe:1'
+    else:
+        # The child's own stdout is read by the executor, so it gets a copy
+        # of ours under another number.
+        fd = opts['stream_fd']
+        out = 'pipe:%d' % fd
+        if sys.version_info[0] < 3:
+            spopts['close_fds'] = False
+        else:
+            spopts['pass_fds'] = (fd,)
+    # The stage is never checkpointed, so its command may vary with
+    # verbosity.
+    cmd = stream_cmd(mkvfile, out, videotrack, audiotrack, subtitlestrack,
+                     **opts)
+    # Whatever reads the stream may stop reading for a while (e.g., when
+    # paused), which stalls ffmpeg without anything being wrong.
+    runopts = dict(opts, checkpoint=None, spopts=spopts, stall_timeout=None)
+    run_stage('stream', cmd, [mkvfile], [],
+              lambda: dry_command(cmd, **runopts), **runopts)
+
+
+def real_main(mkvfile, **opts):
+    if opts.get('sample') is not None:
+        sample_main(mkvfile, **opts)
+        return
+    info = opts.get('probes', {}).get(mkvfile)
+    if info is None:
+        info = probe(mkvfile, **opts)
     try:
         tracks = info['tracks']
     except Exception:
@@ -324,9 +1046,6 @@ def real_main(mkvfile, **opts):
             if idx < len(types):
                 return types[idx]
             return
-    videore = re.compile(r'^(V_)?(MPEG4/ISO/AVC|MPEGH/ISO/HEVC)$')
-    audiore = re.compile(r'^(A_)?(DTS|AAC|E?AC3|MPEG/L2|VORBIS|FLAC)$')
-    subtitlesre = re.compile(r'^(S_)?(TEXT/UTF8|HDMV/PGS)$')
     videotrack = get_track('video', 0, videore, die)
     audiotrack = get_track('audio', 0, audiore, die)
     # audiotrack2 = get_track('audio', 1, audiore, nullprint)
@@ -338,8 +1057,22 @@ def real_main(mkvfile, **opts):
         if s_lang is not None:
             subtitlestrack['language'] = s_lang
     # subtitlestrack2 = get_track('subtitles', 1, subtitlesre, nullprint)
+    if opts.get('stream') is not None:
+        stream_main(mkvfile, videotrack, audiotrack, subtitlestrack, **opts)
+        return
+    statefile = simplemkv.checkpoint.state_path(mkvfile)
+    if opts.get('resume', True) and opts.get('graph') is None:
+        opts['checkpoint'] = simplemkv.checkpoint.Checkpoint(statefile,
+                                                             mkvfile)
+    else:
+        opts['checkpoint'] = None
+    variants = variant_options(mkvfile, **opts)
+    multi = len(variants) > 1
     tempfiles = []
+    outputs = []
     succeeded = False
+    verified = True
+    cancelled = False
     try:
         # Extract video
         if videotrack['codec'] in ('MPEG4/ISO/AVC', 'MPEG4/ISO/AVC'):
@@ -349,17 +1082,6 @@ def real_main(mkvfile, **opts):
         else:
             raise RuntimeError('Unknown extension for codec: ' + videotrack['codec'])
         rawvideo = mkvfile + rawvideoext
-        exit_if(opts['stop_v_ex'])
-        extract_cmd = mkv_extract_track_cmd(
-            mkvfile, out=rawvideo, track=videotrack['number'],
-            verbosely=(opts['verbosity'] > 0),
-            mkvextract=opts.get('mkvextract'),
-        )
-        tempfiles.append(rawvideo)
-        dry_command(extract_cmd, **opts)
-        exit_if(opts['stop_correct'])
-        if rawvideoext == '.h264':
-            dry_correct_rawh264_profile(rawvideo, **opts)
         a_codec = audiotrack['codec']
         if a_codec.lower().startswith('a_'):
             a_codec = a_codec[2:]
@@ -367,24 +1089,110 @@ def real_main(mkvfile, **opts):
             a_codec = 'mp2'
         clean_a_codec = re.sub(r'[\/:]', '-', a_codec.lower())
         rawaudio = mkvfile + '.' + clean_a_codec
-        exit_if(opts['stop_a_ex'])
-        # Extract audio
-        extract_cmd = mkv_extract_track_cmd(
-            mkvfile, out=rawaudio, track=audiotrack['number'],
+        exit_if(opts['stop_v_ex'])
+        # With --parallel-demux, split the file once for both tracks if both
+        # are split. An exported build graph extracts each track in its own
+        # step, since it doesn't split anything.
+        videotracks = [(videotrack, rawvideo)]
+        both = videotracks + [(audiotrack, rawaudio)]
+        if (opts.get('graph') is None and
+                len(parallel_demux_tracks(mkvfile, both, **opts)) == 2):
+            videotracks = both
+        extract_cmd = mkv_extract_tracks_cmd(
+            mkvfile, [(t['number'], out) for t, out in videotracks],
             verbosely=(opts['verbosity'] > 0),
             mkvextract=opts.get('mkvextract'),
         )
-        tempfiles.append(rawaudio)
-        dry_command(extract_cmd, **opts)
+        tempfiles.extend(out for t, out in videotracks)
+        run_stage('extract-video',
+                  mkv_extract_tracks_cmd(
+                      mkvfile, [(t['number'], out) for t, out in videotracks],
+                      mkvextract=opts.get('mkvextract')),
+                  [mkvfile], [out for t, out in videotracks],
+                  lambda: extract_tracks(mkvfile, videotracks, extract_cmd,
+                                         **opts), **opts)
+        exit_if(opts['stop_correct'])
+        # The highest level any output wants is patched in place, and lower
+        # ones into copies of that.
+        top = max(variants, key=lambda v: float(v['profile_level']))
+        if rawvideoext == '.h264':
+            run_stage('correct-profile',
+                      correct_rawh264_profile_cmd(rawvideo, **top),
+                      [rawvideo], [rawvideo],
+                      lambda: dry_correct_rawh264_profile(rawvideo, **top),
+                      **opts)
+        exit_if(opts['stop_a_ex'])
+        # Extract audio, unless it was with the video
+        if len(videotracks) == 1:
+            extract_cmd = mkv_extract_track_cmd(
+                mkvfile, out=rawaudio, track=audiotrack['number'],
+                verbosely=(opts['verbosity'] > 0),
+                mkvextract=opts.get('mkvextract'),
+            )
+            tempfiles.append(rawaudio)
+            run_stage('extract-audio',
+                      mkv_extract_track_cmd(mkvfile, rawaudio,
+                                            audiotrack['number'],
+                                            mkvextract=opts.get('mkvextract')),
+                      [mkvfile], [rawaudio],
+                      lambda: extract_tracks(mkvfile, [(audiotrack, rawaudio)],
+                                             extract_cmd, **opts), **opts)
         exit_if(opts['stop_a_conv'])
-        # Convert audio, if necessary
-        if str(a_codec).lower() != 'aac':
-            aacaudio = rawaudio + '.aac'
-            audio_cmd = ffmpeg_convert_audio_cmd(rawaudio, aacaudio, **opts)
-            tempfiles.append(aacaudio)
-            dry_system(audio_cmd, **opts)
-        else:
-            aacaudio = rawaudio
+        # Work out what video and audio each output needs, so that each level
+        # copy and each audio conversion is done once, however many outputs
+        # use it.
+        rawvideos, aacaudios, prepare = [], [], []
+        for v in variants:
+            video = rawvideo
+            if (rawvideoext == '.h264' and
+                    float(v['profile_level']) != float(top['profile_level'])):
+                video = '%s.L%s%s' % (mkvfile, v['profile_level'], rawvideoext)
+                if video not in [u[1] for u in prepare]:
+                    prepare.append(('video', video, v))
+            rawvideos.append(video)
+            if str(a_codec).lower() != 'aac':
+                if multi:
+                    aacaudio = '%s.%sk-%sch.aac' % (
+                        rawaudio, v['a_bitrate'], v['a_channels'])
+                    if v['a_codec'] != 'aac':
+                        aacaudio = aacaudio[:-4] + '.' + v['a_codec'] + '.aac'
+                else:
+                    aacaudio = rawaudio + '.aac'
+                if aacaudio not in [u[1] for u in prepare]:
+                    prepare.append(('audio', aacaudio, v))
+            else:
+                aacaudio = rawaudio
+            aacaudios.append(aacaudio)
+
+        def prepare_one(unit):
+            kind, path, vopts = unit
+            vopts = dict(vopts)
+            if multi and opts['checkpoint'] is not None:
+                vopts['checkpoint'] = opts['checkpoint'].branch(path)
+            tempfiles.append(path)
+            if kind == 'video':
+                run_stage('copy-video', copy_cmd(rawvideo, path),
+                          [rawvideo], [path],
+                          lambda: dry_copy(rawvideo, path, **vopts), **vopts)
+                run_stage('correct-profile',
+                          correct_rawh264_profile_cmd(path, **vopts),
+                          [path], [path],
+                          lambda: dry_correct_rawh264_profile(path, **vopts),
+                          **vopts)
+                return
+            # Convert audio
+            audio_cmd = ffmpeg_convert_audio_cmd(rawaudio, path, **vopts)
+            measure = None
+            if info.get('duration'):
+                measure = (simplemkv.throughput.audio_key(
+                    a_codec, audiotrack.get('channels')), info['duration'])
+            run_stage('convert-audio',
+                      ffmpeg_convert_audio_cmd(rawaudio, path,
+                                               **quiet_opts(vopts)),
+                      [rawaudio], [path],
+                      lambda: dry_command(audio_cmd, **vopts), measure,
+                      **vopts)
+        fan_out(prepare, prepare_one, **opts)
         # Optional subtitle track
         exit_if(opts['stop_s_ex'])
         if subtitlestrack is not None:
@@ -402,146 +1210,247 @@ def real_main(mkvfile, **opts):
                     verbosely=(opts['verbosity'] > 0),
                     mkvextract=opts.get('mkvextract'),
                 )
-                dry_command(extract_cmd, **opts)
+                run_stage('extract-sub',
+                          mkv_extract_track_cmd(
+                              mkvfile, rawsub, subtitlestrack['number'],
+                              mkvextract=opts.get('mkvextract'),
+                          ),
+                          [mkvfile], [rawsub],
+                          lambda: dry_command(extract_cmd, **opts), **opts)
         else:
             rawsub = None
-        hasmetadata = any(o in opts for o in ('title', 'show', 'genre', 'year', 'director', 'season', 'episode'))
-        if opts['output'] is None:
-            if rawsub is None:
-                if hasmetadata:
+        s_lang = None
+        muxsub = None
+        if rawsub is not None:
+            s_lang = subtitlestrack.get('language')
+            if s_lang is None or s_lang == 'und':
+                s_lang = opts.get('s_lang')
+            # Text subtitles go into the first mux, so they cost no extra
+            # pass over the audio and video. Others need ffmpeg afterwards.
+            if subtitlestrack['codec'] == 'TEXT/UTF8':
+                muxsub, rawsub = rawsub, None
+        exit_if(opts['stop_mp4'])
+
+        def mux(opts, rawvideo, aacaudio):
+            """Make the output *opts* asks for from *rawvideo* and
+            *aacaudio*. Returns the mp4 and the tracks expected in it, or
+            ``None`` if told to stop before adding subtitles."""
+            hasmetadata = any(opts.get(o) is not None for o in (
+                'title', 'show', 'genre', 'year', 'director', 'season',
+                'episode'))
+            if opts['output'] is None:
+                if rawsub is None:
+                    if hasmetadata:
+                        noexoutput = os.path.splitext(mkvfile)[0]
+                        nosuboutput = noexoutput + '.nometa.mp4'
+                        suboutput = noexoutput + '.mp4'
+                        tempfiles.append(nosuboutput)
+                    else:
+                        nosuboutput = os.path.splitext(mkvfile)[0] + '.mp4'
+                        suboutput = None
+                else:
                     noexoutput = os.path.splitext(mkvfile)[0]
-                    nosuboutput = noexoutput + '.nometa.mp4'
+                    nosuboutput = noexoutput + '.nosub.mp4'
                     suboutput = noexoutput + '.mp4'
                     tempfiles.append(nosuboutput)
-                else:
-                    nosuboutput = os.path.splitext(mkvfile)[0] + '.mp4'
-                    suboutput = None
             else:
-                noexoutput = os.path.splitext(mkvfile)[0]
-                nosuboutput = noexoutput + '.nosub.mp4'
-                suboutput = noexoutput + '.mp4'
-                tempfiles.append(nosuboutput)
-        else:
-            if rawsub is None:
-                if hasmetadata:
-                    nosuboutput = opts['output'] + '.nometa.mp4'
+                if rawsub is None:
+                    if hasmetadata:
+                        nosuboutput = opts['output'] + '.nometa.mp4'
+                        suboutput = opts['output']
+                        tempfiles.append(nosuboutput)
+                    else:
+                        nosuboutput = opts['output']
+                        suboutput = None
+                else:
+                    nosuboutput = opts['output'] + '.nosub.mp4'
                     suboutput = opts['output']
                     tempfiles.append(nosuboutput)
-                else:
-                    nosuboutput = opts['output']
-                    suboutput = None
+            # Create mp4 container
+            if opts.get('a_lang') is None:
+                opts['a_lang'] = audiotrack.get('language')
+            if opts['fps'] is None:
+                opts['fps'] = videotrack['fps']
+            expected = []
+            expected.append({
+                'type': 'video', 'codec': videotrack['codec'],
+                'fps': opts['fps'],
+                'source_fps': videotrack.get('fps'),
+            })
+            expected.append({
+                'type': 'audio', 'codec': 'AAC', 'language': opts['a_lang'],
+            })
+            if rawsub is not None or muxsub is not None:
+                expected.append({
+                    'type': 'subtitles', 'codec': subtitlestrack['codec'],
+                    'language': s_lang,
+                })
+            mp4add_cmd = mp4_add_cmd(
+                nosuboutput, rawvideo, aacaudio, muxsub, s_lang,
+                **opts
+            )
+            muxinputs = [rawvideo, aacaudio]
+            if muxsub is not None:
+                muxinputs.append(muxsub)
+            run_stage('mp4', mp4add_cmd, muxinputs, [nosuboutput],
+                      lambda: dry_command(mp4add_cmd, **opts), **opts)
+            if rawsub is not None:
+                if opts['stop_s_add']:
+                    return None
+                metadata = []
+                if s_lang is not None:
+                    metadata.extend(['-metadata:s:s:0', 'language=' + s_lang])
+                a_lang = audiotrack.get('language')
+                if a_lang is None or a_lang == 'und':
+                    a_lang = opts.get('a_lang')
+                if a_lang is not None:
+                    metadata.extend(['-metadata:s:a:0', 'language=' + a_lang])
+                title = opts.get('title')
+                if title is not None:
+                    metadata.extend(['-metadata', 'title=' + title])
+                show = opts.get('show')
+                if show is not None:
+                    metadata.extend(['-metadata', 'show=' + show])
+                genre = opts.get('genre')
+                if genre is not None:
+                    metadata.extend(['-metadata', 'genre=' + genre])
+                year = opts.get('year')
+                if year is not None:
+                    metadata.extend(['-metadata', 'date=' + year])
+                director = opts.get('director')
+                if director is not None:
+                    metadata.extend(['-metadata', 'artist=' + director])
+                season = opts.get('season')
+                if season is not None:
+                    metadata.extend(['-metadata', 'season_number=' + season])
+                episode = opts.get('episode')
+                if episode is not None:
+                    metadata.extend(['-metadata', 'episode_sort=' + episode])
+                s_default = opts.get('s_default', False)
+                disposition = ['-disposition:s:0',
+                               'default' if s_default else '0']
+                faststart = ffmpeg_faststart_args(**opts)
+                sub_cmd = [opts.get('ffmpeg', 'ffmpeg'),
+                    '-y', '-i', nosuboutput, '-i', rawsub,
+                    '-c:v', 'copy', '-c:a', 'copy',
+                    '-c:s', 'mov_text'] + metadata + disposition + \
+                    faststart + [suboutput]
+
+                def sub_reserve():
+                    return faststart_reserve(nosuboutput, info, True,
+                                             len(sq(metadata)))
+                run_stage('add-sub', sub_cmd, [nosuboutput, rawsub],
+                          [suboutput],
+                          lambda: remux_command(sub_cmd, sub_reserve, **opts),
+                          **opts)
+            elif hasmetadata:
+                metadata = []
+                title = opts.get('title')
+                if title is not None:
+                    metadata.extend(['-metadata', 'title=' + title])
+                show = opts.get('show')
+                if show is not None:
+                    metadata.extend(['-metadata', 'show=' + show])
+                genre = opts.get('genre')
+                if genre is not None:
+                    metadata.extend(['-metadata', 'genre=' + genre])
+                year = opts.get('year')
+                if year is not None:
+                    metadata.extend(['-metadata', 'date=' + year])
+                director = opts.get('director')
+                if director is not None:
+                    metadata.extend(['-metadata', 'artist=' + director])
+                season = opts.get('season')
+                if season is not None:
+                    metadata.extend(['-metadata', 'season_number=' + season])
+                episode = opts.get('episode')
+                if episode is not None:
+                    metadata.extend(['-metadata', 'episode_sort=' + episode])
+                faststart = ffmpeg_faststart_args(**opts)
+                meta_cmd = [opts.get('ffmpeg', 'ffmpeg'),
+                    '-y', '-i', nosuboutput,
+                    '-map', '0', '-map_metadata', '0',
+                    '-codec', 'copy'] + metadata + faststart + [suboutput]
+
+                def meta_reserve():
+                    # Any subtitles are already in what MP4Box wrote.
+                    return faststart_reserve(nosuboutput, info, False,
+                                             len(sq(metadata)))
+                run_stage('add-metadata', meta_cmd, [nosuboutput],
+                          [suboutput],
+                          lambda: remux_command(meta_cmd, meta_reserve,
+                                                **opts),
+                          **opts)
+            # TODO: add subtitles with:
+            # ffmpeg -i v.mp4 -i s.srt -c:v copy -c:a copy \
+            #   -c:s mov_text -metadata:s:s:0 language=eng \
+            #   -disposition:s:0 default o.mp4
+            # The disposition default stuff turns on subs by default.
+            # Hard sub with: ffmpeg -i v.mp4 -vf subtitles=s.srt o.mp4
+            # Rename with:
+            # filebot.sh --action test -rename *.mp4 \
+            #   --db TVmaze --q 'series if not auto-detected' \
+            #   -no-xattr -non-strict \
+            #   --format "TV Shows/{n.colon('_')}/Season {s}/{s00e00} - {t}"
+            # filebot.sh --action test -rename *.mp4 \
+            #   -no-xattr -non-strict \
+            # or --format "Movies/{n.colon('_')}/{n.colon('_')} ({y} - {director})"
+            # optionally add --db TVmaze --q 'series name'
+            # or --db TheMovieDB
+            # and --action move to actually rename
+            if suboutput is not None:
+                mp4file = suboutput
             else:
-                nosuboutput = opts['output'] + '.nosub.mp4'
-                suboutput = opts['output']
-                tempfiles.append(nosuboutput)
-        exit_if(opts['stop_mp4'])
-        # Create mp4 container
-        opts.setdefault('a_lang', audiotrack.get('language'))
-        if opts['fps'] is None:
-            opts['fps'] = videotrack['fps']
-        mp4add_cmd = mp4_add_cmd(
-            nosuboutput, rawvideo, aacaudio,
-            **opts
-        )
-        dry_command(mp4add_cmd, **opts)
-        if rawsub is not None:
-            exit_if(opts['stop_s_add'])
-            metadata = []
-            s_lang = subtitlestrack.get('language')
-            if s_lang is None or s_lang == 'und':
-                s_lang = opts.get('s_lang')
-            if s_lang is not None:
-                metadata.extend(['-metadata:s:s:0', 'language=' + s_lang])
-            a_lang = audiotrack.get('language')
-            if a_lang is None or a_lang == 'und':
-                a_lang = opts.get('a_lang')
-            if a_lang is not None:
-                metadata.extend(['-metadata:s:a:0', 'language=' + a_lang])
-            title = opts.get('title')
-            if title is not None:
-                metadata.extend(['-metadata', 'title=' + title])
-            show = opts.get('show')
-            if show is not None:
-                metadata.extend(['-metadata', 'show=' + show])
-            genre = opts.get('genre')
-            if genre is not None:
-                metadata.extend(['-metadata', 'genre=' + genre])
-            year = opts.get('year')
-            if year is not None:
-                metadata.extend(['-metadata', 'date=' + year])
-            director = opts.get('director')
-            if director is not None:
-                metadata.extend(['-metadata', 'artist=' + director])
-            season = opts.get('season')
-            if season is not None:
-                metadata.extend(['-metadata', 'season_number=' + season])
-            episode = opts.get('episode')
-            if episode is not None:
-                metadata.extend(['-metadata', 'episode_sort=' + episode])
-            s_default = opts.get('s_default', False)
-            disposition = ['-disposition:s:0', 'default' if s_default else '0']
-            sub_cmd = [opts.get('ffmpeg', 'ffmpeg'),
-                '-y', '-i', nosuboutput, '-i', rawsub,
-                '-c:v', 'copy', '-c:a', 'copy',
-                '-c:s', 'mov_text'] + metadata + disposition + [suboutput]
-            dry_system(sub_cmd, **opts)
-        elif hasmetadata:
-            metadata = []
-            title = opts.get('title')
-            if title is not None:
-                metadata.extend(['-metadata', 'title=' + title])
-            show = opts.get('show')
-            if show is not None:
-                metadata.extend(['-metadata', 'show=' + show])
-            genre = opts.get('genre')
-            if genre is not None:
-                metadata.extend(['-metadata', 'genre=' + genre])
-            year = opts.get('year')
-            if year is not None:
-                metadata.extend(['-metadata', 'date=' + year])
-            director = opts.get('director')
-            if director is not None:
-                metadata.extend(['-metadata', 'artist=' + director])
-            season = opts.get('season')
-            if season is not None:
-                metadata.extend(['-metadata', 'season_number=' + season])
-            episode = opts.get('episode')
-            if episode is not None:
-                metadata.extend(['-metadata', 'episode_sort=' + episode])
-            meta_cmd = [opts.get('ffmpeg', 'ffmpeg'),
-                '-y', '-i', nosuboutput,
-                '-map_metadata', '0',
-                '-codec', 'copy'] + metadata + [suboutput]
-            dry_system(meta_cmd, **opts)
-        # TODO: add subtitles with:
-        # ffmpeg -i v.mp4 -i s.srt -c:v copy -c:a copy \
-        #   -c:s mov_text -metadata:s:s:0 language=eng \
-        #   -disposition:s:0 default o.mp4
-        # The disposition default stuff turns on subs by default.
-        # Hard sub with: ffmpeg -i v.mp4 -vf subtitles=s.srt o.mp4
-        # Rename with:
-        # filebot.sh --action test -rename *.mp4 \
-        #   --db TVmaze --q 'series if not auto-detected' \
-        #   -no-xattr -non-strict \
-        #   --format "TV Shows/{n.colon('_')}/Season {s}/{s00e00} - {t}"
-        # filebot.sh --action test -rename *.mp4 \
-        #   -no-xattr -non-strict \
-        # or --format "Movies/{n.colon('_')}/{n.colon('_')} ({y} - {director})"
-        # optionally add --db TVmaze --q 'series name'
-        # or --db TheMovieDB
-        # and --action move to actually rename
+                mp4file = nosuboutput
+            if opts.get('graph') is not None:
+                opts['graph'].add_default(mp4file)
+            return mp4file, expected
+
+        def mux_one(i):
+            vopts = dict(variants[i])
+            if multi and opts['checkpoint'] is not None:
+                vopts['checkpoint'] = opts['checkpoint'].branch(
+                    vopts['output'])
+            results[i] = mux(vopts, rawvideos[i], aacaudios[i])
+        results = [None] * len(variants)
+        fan_out(list(range(len(variants))), mux_one, **opts)
+        exit_if(None in results)
+        outputs.extend(results)
         succeeded = True
+    except (KeyboardInterrupt, simplemkv.executor.Cancelled):
+        cancelled = True
+        raise
     finally:
-        if not succeeded:
+        if succeeded and opts['verify'] and not opts['dry_run']:
+            for mp4file, expected in outputs:
+                problems = verify_mp4(mp4file, expected, info.get('duration'),
+                                      **opts)
+                for problem in problems:
+                    eprint('verify:', mp4file + ':', problem)
+                if problems:
+                    succeeded = verified = False
+            if not verified and opts['checkpoint'] is not None:
+                opts['checkpoint'].remove()
+        if (cancelled and opts['checkpoint'] is None and
+                not opts['dry_run'] and not opts['keep_temp_files']):
+            eprint('removing temp files since we were cancelled.')
+            simplemkv.executor.remove_outputs(tempfiles)
+        elif not succeeded:
             eprint('keeping temp files since we failed.')
+        elif opts.get('graph') is not None:
+            opts['graph'].add_temps(tempfiles)
         elif opts['dry_run']:
             prin(sq(['rm', '-f'] + tempfiles))
-        elif not opts['keep_temp_files']:
-            for f in tempfiles:
-                try:
-                    os.remove(f)
-                except OSError:
-                    pass
+        else:
+            if opts['checkpoint'] is not None:
+                opts['checkpoint'].remove()
+            if not opts['keep_temp_files']:
+                for f in tempfiles:
+                    try:
+                        os.remove(f)
+                    except OSError:
+                        pass
+    exit_if(not verified, 1)
 
 
 def usage(**kwargs):
@@ -610,6 +1519,8 @@ def usage(**kwargs):
     p('  Only correct the mp4 profile.')
     p(' --print-profile-only:')
     p('  Only print the mp4 profile.')
+    p(' --cut-sample-only:')
+    p('  Only cut the --sample of <mkvfile> into <file>.sample.mkv.')
     p(' --profile-level=<profile-level>:')
     p('  Any rewrite of H.264 profile will use this level. The default is "4.1".')
     p(' --force-profile-level, --no-force-profile-level:')
@@ -630,11 +1541,69 @@ def usage(**kwargs):
     p('  Exit before adding subtitles to the mp4.')
     p(' --no-summary, --summary:')
     p('  Don\'t provide a summary of commands, or do.')
+    p(' --faststart, --no-faststart:')
+    p('  Write the mp4 index (moov) before the media data, or not.')
+    p(' --resume, --no-resume:')
+    p('  Skip stages an interrupted conversion of <mkvfile> completed, or not.')
+    p(' --queue-dir=<queue-dir>:')
+    p('  Use the job queue in <queue-dir>, with --submit or --worker.')
+    p(' --submit:')
+    p('  Add a job converting each <mkvfile> to the queue.')
+    p(' --worker:')
+    p('  Convert queued files until no jobs are pending or running.')
+    p(' --lease-seconds=<seconds>:')
+    p('  Give other workers the jobs of a worker silent for this long.')
+    p(' -j <jobs>|--jobs=<jobs>:')
+    p('  Convert up to <jobs> of the given <mkvfile>s at once.')
+    p(' --io-per-device=<count>:')
+    p('  Run up to <count> extract or mux steps at once on any one device.')
+    p(' --export-make=<makefile>:')
+    p('  Don\'t run any commands, but write them as a Makefile.')
+    p(' --export-ninja=<ninjafile>:')
+    p('  Don\'t run any commands, but write them as a ninja build file.')
+    p(' --verify, --no-verify:')
+    p('  Check the tracks of the mp4 against those of <mkvfile>, or not.')
+    p(' --throughput-file=<file>:')
+    p('  Keep the history of how fast conversions ran in <file>.')
+    p(' --sample=<start>+<duration>:')
+    p('  Convert only <duration> from <start> (seconds or [HH:]MM:SS), to <file>.sample.mp4.')
+    p(' --parallel-demux=<parts>:')
+    p('  Extract video and audio from up to <parts> parts of large files at once.')
+    p(' --parallel-demux-min-size=<size>:')
+    p('  Only use --parallel-demux for files of at least <size>, e.g., 4G. The default is 1G.')
+    p(' --stall-timeout=<seconds>:')
+    p('  Kill a step that shows no progress for this long. The default is 600; 0 never does.')
+    p(' --stage-timeout=<seconds>:')
+    p('  Kill a step that runs for longer than this. The default is never.')
+    p(' --variant=<key>=<value>,...:')
+    p('  Also make an output with these of profile_level, a_bitrate, a_channels,')
+    p('  a_codec and output. May be given more than once.')
+    p(' --audit=<report>:')
+    p('  Don\'t convert, but report what converting each <mkvfile>, or each .mkv')
+    p('  in each directory given, would need, as CSV, or JSON if <report> ends in')
+    p('  .json. - writes it to stdout.')
+    p(' --probe-cache=<file>:')
+    p('  Keep what --audit found out about each file in <file>.')
+    p(' --profile-python=<dir>:')
+    p('  Profile each conversion with cProfile, writing the statistics to <dir>.')
+    p(' --trace-memory=<dir>:')
+    p('  Trace what allocates memory during each conversion, writing it to <dir>.')
+    p(' --nice=<niceness>:')
+    p('  Run at this niceness (e.g., 10), and the commands we run too.')
+    p(' --ionice=<class>[:<level>]:')
+    p('  Run at this I/O priority (idle, best-effort or realtime, level 0-7).')
+    p(' --stage-policy=<stage>:nice=<niceness>,ionice=<class>[:<level>]:')
+    p('  Run the commands of <stage> (a stage name, io or cpu) at these priorities.')
+    p(' --read-limit=<size>:')
+    p('  Read at most about <size> a second (e.g., 50M) when mkvtomp4 itself copies.')
+    p(' --stream=<target>:')
+    p('  Write a fragmented mp4 to <target> (a FIFO or file, or - for stdout) as it')
+    p('  is made, straight from <mkvfile>, with no temporary files.')
 
 
 def parseopts(argv=None):
     opts = default_options(argv[0])
-    sopts = 'hvo:n'
+    sopts = 'hvo:nj:'
     lopts = [
         'help', 'usage', 'version', 'verbose',
         'mp4box=', 'ffmpeg=', 'mkvinfo=', 'mkvextract=',
@@ -647,6 +1616,7 @@ def parseopts(argv=None):
         'season=', 'episode=',
         'output=', 'keep-temp-files', 'dry-run',
         'correct-profile-only', 'profile-level=', 'print-profile-only',
+        'cut-sample-only',
         'force-profile-level', 'no-force-profile-level',
         'fps=',
         'stop-before-extract-video', 'stop-before-correct-profile',
@@ -655,6 +1625,17 @@ def parseopts(argv=None):
         'stop-before-mp4',
         'stop-before-add-sub',
         'no-summary',
+        'faststart', 'no-faststart',
+        'resume', 'no-resume',
+        'queue-dir=', 'submit', 'worker', 'lease-seconds=',
+        'jobs=', 'io-per-device=',
+        'export-make=', 'export-ninja=',
+        'verify', 'no-verify',
+        'throughput-file=', 'sample=',
+        'parallel-demux=', 'parallel-demux-min-size=',
+        'stall-timeout=', 'stage-timeout=', 'variant=',
+        'audit=', 'probe-cache=', 'profile-python=', 'trace-memory=',
+        'nice=', 'ionice=', 'stage-policy=', 'read-limit=', 'stream=',
     ]
     try:
         options, arguments = getopt.gnu_getopt(argv[1:], sopts, lopts)
@@ -729,6 +1710,8 @@ def parseopts(argv=None):
             opts['correct_prof_only'] = True
         elif opt == '--print-profile-only':
             opts['print_prof_only'] = True
+        elif opt == '--cut-sample-only':
+            opts['cut_sample_only'] = True
         elif opt == '--profile-level':
             opts['profile_level'] = optarg
         elif opt == '--force-profile-level':
@@ -753,26 +1736,488 @@ def parseopts(argv=None):
             opts['stop_s_add'] = True
         elif opt == '--no-summary':
             opts['summary'] = False
+        elif opt == '--faststart':
+            opts['faststart'] = True
+        elif opt == '--no-faststart':
+            opts['faststart'] = False
+        elif opt == '--resume':
+            opts['resume'] = True
+        elif opt == '--no-resume':
+            opts['resume'] = False
+        elif opt == '--queue-dir':
+            opts['queue_dir'] = optarg
+        elif opt == '--submit':
+            opts['queue_submit'] = True
+        elif opt == '--worker':
+            opts['queue_worker'] = True
+        elif opt == '--lease-seconds':
+            opts['lease_seconds'] = float(optarg)
+        elif opt in ('-j', '--jobs'):
+            opts['jobs'] = int(optarg)
+        elif opt == '--io-per-device':
+            opts['io_per_device'] = int(optarg)
+        elif opt == '--export-make':
+            opts['export_make'] = optarg
+        elif opt == '--export-ninja':
+            opts['export_ninja'] = optarg
+        elif opt == '--verify':
+            opts['verify'] = True
+        elif opt == '--no-verify':
+            opts['verify'] = False
+        elif opt == '--throughput-file':
+            opts['throughput_file'] = optarg
+        elif opt == '--sample':
+            opts['sample'] = parse_sample(optarg)
+        elif opt == '--parallel-demux':
+            opts['parallel_demux'] = int(optarg)
+        elif opt == '--parallel-demux-min-size':
+            try:
+                opts['parallel_demux_min_size'] = parse_size(optarg)
+            except ValueError:
+                die('--parallel-demux-min-size needs a size, e.g., 4G:',
+                    optarg)
+        elif opt == '--stall-timeout':
+            opts['stall_timeout'] = float(optarg)
+        elif opt == '--stage-timeout':
+            opts['stage_timeout'] = float(optarg)
+        elif opt == '--variant':
+            opts['variants'].append(parse_variant(optarg))
+        elif opt == '--audit':
+            opts['audit'] = optarg
+        elif opt == '--probe-cache':
+            opts['probe_cache'] = optarg
+        elif opt == '--profile-python':
+            opts['profile_python'] = optarg
+        elif opt == '--trace-memory':
+            if simplemkv.profiling.tracemalloc is None:
+                die('--trace-memory needs Python 3.4 or later')
+            opts['trace_memory'] = optarg
+        elif opt == '--nice':
+            try:
+                opts['nice'] = int(optarg)
+            except ValueError:
+                die('--nice needs a niceness, e.g., 10:', optarg)
+        elif opt == '--ionice':
+            try:
+                opts['ionice'] = simplemkv.governor.parse_ionice(optarg)
+            except simplemkv.governor.GovernorError:
+                et, ev, tb = sys.exc_info()
+                die('--ionice:', str(ev))
+        elif opt == '--stage-policy':
+            stage, policy = parse_stage_policy(optarg)
+            opts['stage_policies'].setdefault(stage, {}).update(policy)
+        elif opt == '--read-limit':
+            try:
+                opts['read_limit'] = parse_size(optarg)
+            except ValueError:
+                die('--read-limit needs a size, e.g., 50M:', optarg)
+        elif opt == '--stream':
+            opts['stream'] = optarg
+    if opts['variants'] and opts['output'] is not None:
+        die('--output can\'t be used with --variant; give each an output=')
+    if opts['stream'] is not None:
+        if opts['output'] is not None or opts['variants']:
+            die('--stream can\'t be used with --output or --variant')
+        if (opts['queue_dir'] is not None or opts['export_make'] is not None or
+                opts['export_ninja'] is not None):
+            die('--stream can\'t be used with --queue-dir, --export-make'
+                ' or --export-ninja')
     return opts, arguments
 
 
+def queue_main(mkvfiles, **opts):
+    queuedir = opts['queue_dir']
+    if opts['queue_submit']:
+        if not mkvfiles:
+            die(simple_usage)
+        if opts['output'] is not None and len(mkvfiles) > 1:
+            die('--output can only be used when submitting one file')
+        jobopts = {}
+        for k, v in opts.items():
+            if k not in queue_only_keys:
+                jobopts[k] = v
+        for jid in simplemkv.jobqueue.submit(queuedir, mkvfiles, jobopts,
+                                             paths=path_keys):
+            prin('submitted:', jid)
+    elif opts['queue_worker']:
+        if mkvfiles:
+            die(simple_usage)
+
+        def run(mkvfile, **jobopts):
+            runopts = default_options(opts['argv0'])
+            runopts.update(jobopts)
+            runopts['verbosity'] = opts['verbosity']
+            runopts['throughput'] = opts.get('throughput')
+            for k in governor_keys:
+                runopts[k] = opts.get(k)
+            for k in tool_keys:
+                if opts.get(k) is not None:
+                    runopts[k] = opts[k]
+            with profiled(simplemkv.jobqueue.job_id(mkvfile), **opts):
+                real_main(mkvfile, **runopts)
+        worker = simplemkv.jobqueue.Worker(
+            queuedir, run, lease_seconds=opts['lease_seconds'], printer=prin,
+        )
+        exit_if(worker.loop() > 0, 1)
+    else:
+        die('--queue-dir needs --submit or --worker')
+
+
+def profiled(name, **opts):
+    """A context manager profiling the job *name* as --profile-python and
+    --trace-memory ask, if they do."""
+    return simplemkv.profiling.Profiler(
+        name, opts.get('profile_python'), opts.get('trace_memory'),
+        errorfunc=wprint,
+    )
+
+
+class BatchProgress(object):
+    """Runs conversions for *batch_main*, printing how much of the batch is
+    done and how long the rest is predicted to take.
+
+    The *predicted* seconds of each conversion are scaled by how long those
+    that succeeded took compared with their predictions, and those running
+    are counted from when they started."""
+
+    def __init__(self, predicted, parallel, **opts):
+        self.predicted = predicted
+        self.parallel = parallel
+        self.opts = opts
+        self.remaining = dict(predicted)
+        self.started = {}
+        self.done_predicted = 0.0
+        self.done_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def seconds_left(self, now=None):
+        if now is None:
+            now = time.time()
+        scale = 1.0
+        if self.done_predicted > 0:
+            scale = self.done_seconds / self.done_predicted
+        total = 0.0
+        for mkvfile, seconds in self.remaining.items():
+            elapsed = now - self.started.get(mkvfile, now)
+            total += max(seconds * scale - elapsed, 0)
+        return total / max(min(self.parallel, len(self.remaining)), 1)
+
+    def __call__(self, mkvfile):
+        self._lock.acquire()
+        try:
+            start = self.started[mkvfile] = time.time()
+        finally:
+            self._lock.release()
+        succeeded = False
+        try:
+            with profiled(simplemkv.jobqueue.job_id(mkvfile), **self.opts):
+                real_main(mkvfile, **self.opts)
+            succeeded = True
+        finally:
+            self._lock.acquire()
+            try:
+                now = time.time()
+                self.started.pop(mkvfile, None)
+                predicted = self.remaining.pop(mkvfile, None)
+                if succeeded and predicted:
+                    self.done_predicted += predicted
+                    self.done_seconds += now - start
+                left = len(self.remaining)
+                prin('progress: %d/%d done, about %s left' % (
+                    len(self.predicted) - left, len(self.predicted),
+                    simplemkv.throughput.format_seconds(
+                        self.seconds_left(now))))
+            finally:
+                self._lock.release()
+
+
+def probe_all(mkvfiles, threads, **opts):
+    """Probe each of *mkvfiles* using *threads* threads. Returns a dictionary
+    of probes, without those that failed."""
+    probes = {}
+
+    def run(mkvfile):
+        probes[mkvfile] = probe(mkvfile, **opts)
+    simplemkv.sched.run_batch(mkvfiles, run, threads)
+    return probes
+
+
+def batch_main(mkvfiles, **opts):
+    if opts['output'] is not None:
+        die('--output can only be used when converting one file')
+    if any('output' in v for v in opts['variants']):
+        die('a --variant output= can only be used when converting one file')
+    if opts['stream'] is not None:
+        die('--stream can only be used when converting one file')
+    # A file given twice would be converted twice at once.
+    seen, unique = set(), []
+    for mkvfile in mkvfiles:
+        key = os.path.realpath(mkvfile)
+        if key not in seen:
+            seen.add(key)
+            unique.append(mkvfile)
+    mkvfiles = unique
+    if not opts['dry_run']:
+        # Start the longest conversions first, so that no long one is left
+        # running on its own at the end.
+        opts['probes'] = probe_all(mkvfiles, max(opts['jobs'], 4), **opts)
+        predicted = {}
+        for mkvfile in mkvfiles:
+            info = opts['probes'].get(mkvfile, {})
+            predicted[mkvfile] = predict_seconds(mkvfile, info,
+                                                 opts['throughput'])
+        mkvfiles = sorted(mkvfiles, key=lambda m: -predicted[m])
+        parallel = max(min(opts['jobs'], len(mkvfiles)), 1)
+        prin('progress: 0/%d done, about %s left' % (
+            len(mkvfiles), simplemkv.throughput.format_seconds(
+                sum(predicted.values()) / parallel)))
+    if opts['summary'] and not opts['dry_run']:
+        summaryopts = opts.copy()
+        summaryopts['keep_temp_files'], summaryopts['dry_run'] = True, True
+        simplemkv.sched.run_batch(mkvfiles,
+                                  Kwargs(real_main, **summaryopts), 1)
+    jobs = opts['jobs']
+    if opts['dry_run']:
+        jobs = 1
+    elif jobs > 1:
+        opts['scheduler'] = simplemkv.sched.StageScheduler(
+            io_per_device=opts['io_per_device'],
+        )
+    if opts['dry_run']:
+        run = Kwargs(real_main, **opts)
+    else:
+        run = BatchProgress(predicted, jobs, **opts)
+    failed = simplemkv.sched.run_batch(mkvfiles, run, jobs, errorfunc=eprint)
+    for mkvfile in failed:
+        eprint('failed to convert:', mkvfile)
+    exit_if(failed, 1)
+
+
+def find_track(tracks, typ, codec_re, number=None):
+    """The track of *tracks* real_main would convert, or ``None``."""
+    if number is not None:
+        if int(number) < 0 or int(number) >= len(tracks):
+            return None
+        track = tracks[int(number)]
+        if (track.get('type') != typ or
+                not codec_re.search(track.get('codec', ''))):
+            return None
+        return track
+    for track in tracks:
+        if (track.get('type') == typ and
+                codec_re.search(track.get('codec', ''))):
+            return track
+    return None
+
+
+def audit_row(mkvfile, info, model, **opts):
+    """Describe what converting *mkvfile*, which mkvinfo described with
+    *info*, would need, for *simplemkv.audit.write_report*."""
+    try:
+        size = os.path.getsize(mkvfile)
+    except OSError:
+        size = None
+    tracks = info.get('tracks', [])
+    videotrack = find_track(tracks, 'video', videore, opts['video_track'])
+    audiotrack = find_track(tracks, 'audio', audiore, opts['audio_track'])
+    subtitlestrack = find_track(tracks, 'subtitles', subtitlesre,
+                                opts['subtitles_track'])
+    row = dict((k, None) for k in simplemkv.audit.fields)
+    row.update({'path': mkvfile, 'size': size,
+                'duration': info.get('duration')})
+    problems = []
+    if videotrack is None:
+        problems.append('no H.264 or HEVC video track')
+    else:
+        row['video_codec'] = videotrack['codec']
+        row['video_profile'] = videotrack.get('profile')
+        row['video_level'] = videotrack.get('level')
+        row['hevc'] = videotrack['codec'] == 'MPEGH/ISO/HEVC'
+        # The lowest level any output wants is the one most likely patched.
+        levels = [float(v.get('profile_level', opts['profile_level']))
+                  for v in opts['variants']] or [float(opts['profile_level'])]
+        if row['hevc']:
+            row['level_patch'] = False
+        elif opts['force_profile_level']:
+            row['level_patch'] = True
+        elif row['video_level'] is not None:
+            row['level_patch'] = row['video_level'] > min(levels)
+    if audiotrack is None:
+        problems.append('no DTS, AAC, AC3, E-AC3, MP2, Vorbis or FLAC audio'
+                        ' track')
+    else:
+        row['audio_codec'] = audiotrack['codec']
+        row['audio_channels'] = audiotrack.get('channels')
+        row['audio_transcode'] = audiotrack['codec'].lower() != 'aac'
+    row['subtitles'] = 'none'
+    if subtitlestrack is not None:
+        if subtitlestrack['codec'] == 'TEXT/UTF8':
+            row['subtitles'] = 'text'
+        else:
+            row['subtitles'] = 'pgs'
+    row['usable'] = not problems
+    row['problem'] = '; '.join(problems) or None
+    if row['usable'] and size is not None:
+        # Text subtitles are muxed with the video and audio, and others are
+        # added in a second pass.
+        extracts = 2 + (subtitlestrack is not None)
+        remuxes = int(row['subtitles'] == 'pgs')
+        secs = model.estimate(size, info, audiotrack, extracts, remuxes)
+        row['extract_seconds'] = secs['extract']
+        row['convert_audio_seconds'] = secs['convert-audio']
+        row['mux_seconds'] = secs['mux']
+        row['total_seconds'] = sum(secs.values())
+    return row
+
+
+def audit_main(paths, **opts):
+    """Probe each mkv in *paths* (files, or directories to search), and
+    write a report of what converting each would need to ``opts['audit']``,
+    without converting anything."""
+    if not paths:
+        die(simple_usage)
+    mkvfiles = simplemkv.audit.find_mkvs(paths)
+    cache = simplemkv.audit.ProbeCache(opts['probe_cache'])
+    model = opts.get('throughput')
+    if model is None:
+        model = simplemkv.throughput.ThroughputModel(opts['throughput_file'])
+    rows = {}
+
+    def run(mkvfile):
+        info = cache.get(mkvfile)
+        if info is None:
+            try:
+                info = probe(mkvfile, **opts)
+            except SystemExit:
+                et, ev, tb = sys.exc_info()
+                row = dict((k, None) for k in simplemkv.audit.fields)
+                row.update({'path': mkvfile, 'usable': False,
+                            'problem': 'mkvinfo failed'})
+                if not isinstance(ev.code, int):
+                    row['problem'] += ': ' + str(ev.code).strip()
+                rows[mkvfile] = row
+                return
+            cache.put(mkvfile, info)
+        rows[mkvfile] = audit_row(mkvfile, info, model, **opts)
+        vprint(1, 'audit:', mkvfile, verbosity=opts['verbosity'])
+    # Probing mostly waits for mkvinfo to read headers, so use plenty.
+    threads = max(opts['jobs'], simplemkv.sched.cpu_count() * 2)
+    try:
+        failed = simplemkv.sched.run_batch(mkvfiles, run, threads,
+                                           errorfunc=eprint)
+    finally:
+        cache.save()
+    rows = [rows[m] for m in mkvfiles if m in rows]
+    summary = simplemkv.audit.summarize(rows, opts['jobs'])
+    simplemkv.audit.write_report(opts['audit'], rows, summary)
+    fobj = sys.stdout
+    if opts['audit'] == '-':
+        fobj = sys.stderr
+    fmt = simplemkv.throughput.format_seconds
+    prin('audit: %(files)d files: %(usable)d convertible, %(unusable)d not'
+         % summary, fobj=fobj)
+    prin('audit: audio conversion: %(audio_transcode)d,'
+         ' level patch: %(level_patch)d, HEVC: %(hevc)d' % summary, fobj=fobj)
+    prin('audit: text subtitles: %(text_subtitles)d,'
+         ' PGS subtitles: %(pgs_subtitles)d' % summary, fobj=fobj)
+    prin('audit: about %s to convert, %s with --jobs=%d' % (
+        fmt(summary['total_seconds']), fmt(summary['wall_seconds']),
+        opts['jobs']), fobj=fobj)
+    exit_if(failed, 1)
+
+
+def export_main(mkvfiles, **opts):
+    if opts['output'] is not None and len(mkvfiles) > 1:
+        die('--output can only be used when converting one file')
+    if any('output' in v for v in opts['variants']) and len(mkvfiles) > 1:
+        die('a --variant output= can only be used when converting one file')
+    graph = simplemkv.graph.BuildGraph(keep_temp_files=opts['keep_temp_files'])
+    opts['graph'], opts['dry_run'] = graph, True
+    for mkvfile in mkvfiles:
+        real_main(mkvfile, **opts)
+    if opts['export_make'] is not None:
+        path, write = opts['export_make'], graph.write_make
+    else:
+        path, write = opts['export_ninja'], graph.write_ninja
+    if path == '-':
+        write(sys.stdout)
+        return
+    f = open(path, 'w')
+    try:
+        write(f)
+    finally:
+        f.close()
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv
     opts, args = parseopts(argv)
+    policy = simplemkv.governor.Policy(opts['nice'], opts['ionice'])
+    if not policy.empty() and not opts['dry_run']:
+        # Before any threads start, so that they all inherit it.
+        try:
+            policy.apply()
+        except (OSError, simplemkv.governor.GovernorError):
+            et, ev, tb = sys.exc_info()
+            wprint('can\'t lower priority:', str(ev))
+    if opts['read_limit']:
+        opts['read_budget'] = simplemkv.governor.Budget(opts['read_limit'])
+    if opts['stream'] == '-' and not opts['dry_run']:
+        # Stdout is the mp4's alone, so everything we print goes to stderr.
+        sys.stdout.flush()
+        opts['stream_fd'] = os.dup(sys.stdout.fileno())
+        sys.stdout = sys.stderr
+    if not opts['dry_run']:
+        opts['throughput'] = simplemkv.throughput.ThroughputModel(
+            opts['throughput_file'],
+        )
+    try:
+        dispatch(args, **opts)
+    except KeyboardInterrupt:
+        # Conversions in other threads don't see the interrupt, so kill
+        # whatever they are running from here.
+        simplemkv.executor.cancel_all()
+        eprint('interrupted.')
+        sys.exit(130)
+
+
+def dispatch(args, **opts):
+    if opts['audit'] is not None:
+        audit_main(args, **opts)
+        return
+    if opts['queue_dir'] is not None:
+        queue_main(args, **opts)
+        return
+    if opts['export_make'] is not None or opts['export_ninja'] is not None:
+        if not args:
+            die(simple_usage)
+        export_main(args, **opts)
+        return
+    if len(args) > 1 and not (opts['print_prof_only'] or
+                              opts['correct_prof_only'] or
+                              opts['cut_sample_only']):
+        batch_main(args, **opts)
+        return
     if len(args) != 1:
         die(simple_usage)
-    if opts['print_prof_only']:
-        profile = read_rawh264_profile(args[0], **opts)
-        if profile is None:
-            die('Failed to read h264 profile from', args[0])
-        prin(profile)
-    elif opts['correct_prof_only']:
-        dry_correct_rawh264_profile(args[0], **opts)
-    else:
-        if opts['summary'] and not opts['dry_run']:
-            keep, dry_run = opts['keep_temp_files'], opts['dry_run']
-            opts['keep_temp_files'], opts['dry_run'] = True, True
+    if opts['cut_sample_only']:
+        if opts['sample'] is None:
+            die('--cut-sample-only needs --sample')
+        cut_sample(args[0], probe(args[0], **opts), **opts)
+        return
+    with profiled(simplemkv.jobqueue.job_id(args[0]), **opts):
+        if opts['print_prof_only']:
+            profile = read_rawh264_profile(args[0], **opts)
+            if profile is None:
+                die('Failed to read h264 profile from', args[0])
+            prin(profile)
+        elif opts['correct_prof_only']:
+            dry_correct_rawh264_profile(args[0], **opts)
+        else:
+            if opts['summary'] and not opts['dry_run']:
+                keep, dry_run = opts['keep_temp_files'], opts['dry_run']
+                opts['keep_temp_files'], opts['dry_run'] = True, True
+                real_main(args[0], **opts)
+                opts['keep_temp_files'], opts['dry_run'] = keep, dry_run
             real_main(args[0], **opts)
-            opts['keep_temp_files'], opts['dry_run'] = keep, dry_run
-        real_main(args[0], **opts)
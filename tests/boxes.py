@@ -0,0 +1,71 @@
+"""Build small mp4 files, box by box, for tests."""
+
+import struct
+
+
+def box(typ, payload):
+    return struct.pack('>I4s', 8 + len(payload), typ) + payload
+
+
+def full_box(typ, payload, version=0):
+    return box(typ, struct.pack('>I', version << 24) + payload)
+
+
+def packed_language(lang):
+    return ((ord(lang[0]) - 0x60) << 10 | (ord(lang[1]) - 0x60) << 5 |
+            (ord(lang[2]) - 0x60))
+
+
+def trak(handler, codec, timescale, delta, samples, lang='und', offsets=(0,),
+         co64=False, mdhd_version=0):
+    """A ``trak`` of *samples* samples of *delta* ticks each."""
+    if mdhd_version == 1:
+        mdhd = full_box(b'mdhd', struct.pack(
+            '>QQIQHH', 0, 0, timescale, delta * samples,
+            packed_language(lang), 0), version=1)
+    else:
+        mdhd = full_box(b'mdhd', struct.pack(
+            '>IIIIHH', 0, 0, timescale, delta * samples,
+            packed_language(lang), 0))
+    hdlr = full_box(b'hdlr', struct.pack('>I4s12x', 0, handler) + b'\0')
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + box(codec, b'\0' * 8))
+    stts = full_box(b'stts', struct.pack('>III', 1, samples, delta))
+    stsz = full_box(b'stsz', struct.pack('>II', 1, samples))
+    if co64:
+        chunks = full_box(b'co64', struct.pack(
+            '>I%dQ' % len(offsets), len(offsets), *offsets))
+    else:
+        chunks = full_box(b'stco', struct.pack(
+            '>I%dI' % len(offsets), len(offsets), *offsets))
+    stbl = box(b'stbl', stsd + stts + stsz + chunks)
+    return box(b'trak', box(b'mdia', mdhd + hdlr + box(b'minf', stbl)))
+
+
+def mp4(traks, mdat=b'\0' * 64, moov_first=False, truncate=0):
+    """An mp4 with *traks* in its moov, and *mdat* as its media data, short
+    by *truncate* bytes."""
+    ftyp = box(b'ftyp', b'isom\0\0\0\0')
+    moov = box(b'moov', b''.join(traks))
+    if moov_first:
+        data = ftyp + moov + box(b'mdat', mdat)
+    else:
+        data = ftyp + box(b'mdat', mdat) + moov
+    if truncate:
+        data = data[:-truncate]
+    return data
+
+
+def av_traks(duration, fps=24.0, lang='eng', subtitles=False, offset=0):
+    """Video at *fps* and 48kHz AAC audio of *duration* seconds, and text
+    subtitles if *subtitles*."""
+    timescale = int(round(fps * 1000))
+    traks = [
+        trak(b'vide', b'avc1', timescale, 1000,
+             int(round(duration * fps)), 'und', (offset,)),
+        trak(b'soun', b'mp4a', 48000, 1024,
+             int(round(duration * 48000 / 1024)), lang, (offset,)),
+    ]
+    if subtitles:
+        traks.append(trak(b'sbtl', b'tx3g', 1000, 1000, int(duration), lang,
+                          (offset,)))
+    return traks
@@ -0,0 +1,50 @@
+"""A probe of an mkv, and options to convert it with, for tests that only
+build commands."""
+
+import simplemkv.info
+import simplemkv.tomp4
+
+# What mkvinfo says of an mkv with H.264 video, AC-3 audio and text
+# subtitles.
+MKVINFO = """\
++ EBML head
+|+ EBML version: 1
++ Segment: size 1234567
+|+ Segment information
+| + Timestamp scale: 1000000
+| + Duration: 00:01:40.000000000
+|+ Segment tracks
+| + Track
+|  + Track number: 1 (track ID for mkvmerge & mkvextract: 0)
+|  + Track type: video
+|  + Codec ID: V_MPEG4/ISO/AVC
+|  + Default duration: 00:00:00.041708333\
+ (23.976 frames/fields per second for a video track)
+|  + Language: und
+|  + Video track
+|   + Pixel width: 1920
+|  + Codec's private data: size 48 (H.264 profile: High @L5.1)
+| + Track
+|  + Track number: 2 (track ID for mkvmerge & mkvextract: 1)
+|  + Track type: audio
+|  + Codec ID: A_AC3
+|  + Language: eng
+|  + Audio track
+|   + Sampling frequency: 48000
+|   + Channels: 6
+| + Track
+|  + Track number: 3 (track ID for mkvmerge & mkvextract: 2)
+|  + Track type: subtitles
+|  + Codec ID: S_TEXT/UTF8
+|  + Language: eng
+|+ Cluster
+"""
+
+
+def options(*argv):
+    """Parse *argv* as mkvtomp4's options and files, as if each file had been
+    probed and found to be as MKVINFO says. Returns ``(opts, files)``."""
+    opts, files = simplemkv.tomp4.parseopts(['mkvtomp4'] + list(argv))
+    info = simplemkv.info.infodict(MKVINFO.split('\n'))
+    opts['probes'] = dict((f, info) for f in files)
+    return opts, files
@@ -0,0 +1,112 @@
+"""Build small mkv files, element by element, for tests, and extract their
+tracks as mkvextract would for a splittable codec."""
+
+import struct
+
+import simplemkv.ebml as ebml
+
+SIMPLEBLOCK = 0xA3
+
+
+def element_id(eid):
+    n = (eid.bit_length() + 7) // 8
+    return struct.pack('>Q', eid)[8 - n:]
+
+
+def element(eid, payload):
+    """An element with an 8-byte size, as mkvmerge writes large ones."""
+    size = struct.pack('>Q', len(payload) | 1 << 56)
+    return element_id(eid) + size + payload
+
+
+def uint(eid, value, width=4):
+    return element(eid, struct.pack('>Q', value)[8 - width:])
+
+
+def simple_block(track, data):
+    return element(SIMPLEBLOCK, struct.pack('>BhB', 0x80 | track, 0, 0x80) +
+                   data)
+
+
+def cluster(time, frames):
+    """A Cluster at *time* with a SimpleBlock of each ``(track, data)``."""
+    return element(ebml.CLUSTER, uint(ebml.TIMESTAMP, time) +
+                   b''.join(simple_block(t, d) for t, d in frames))
+
+
+def mkv(clusters, cues=True, duration=None, tail=b''):
+    """An mkv of *clusters* (built with *cluster*), with Cues for track 1 at
+    each of them if *cues*, and *tail* (e.g., Tags) after them."""
+    header = element(ebml.EBML, uint(0x4282, 0x6d6174726f736b61, 8))
+    info = uint(ebml.TIMESTAMPSCALE, 1000000)
+    if duration is not None:
+        info += element(ebml.DURATION, struct.pack('>d', duration))
+    top = element(ebml.INFO, info) + element(ebml.TRACKS, b'tracks')
+    if cues:
+        # The Cues' size doesn't depend on the offsets, so lay out with
+        # zeros first.
+        size = len(_cues([(0, 0)] * len(clusters)))
+        pos = len(top) + size
+        points = []
+        for c in clusters:
+            points.append((_time(c), pos))
+            pos += len(c)
+        top += _cues(points)
+    segment = top + b''.join(clusters) + tail
+    return header + element(ebml.SEGMENT, segment)
+
+
+def _time(c):
+    f = _Reader(c)
+    ebml.read_element_header(f)
+    hdr = ebml.read_element_header(f)
+    return ebml.read_uint(f.read(hdr[1]))
+
+
+def _cues(points):
+    return element(ebml.CUES, b''.join(
+        element(ebml.CUEPOINT, uint(ebml.CUETIME, t) + element(
+            ebml.CUETRACKPOSITIONS, uint(ebml.CUETRACK, 1, 1) +
+            uint(ebml.CUECLUSTERPOSITION, pos, 8)))
+        for t, pos in points))
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.data, self.pos = data, 0
+
+    def read(self, n):
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+
+def frames(path, track):
+    """The data of each block of *track* in the mkv *path*."""
+    f = open(path, 'rb')
+    try:
+        layout = ebml.read_layout(f)
+        out = []
+        pos = layout.first_cluster
+        while pos is not None and pos < layout.segment_end:
+            f.seek(pos)
+            eid, size, hdrsize = ebml.read_element_header(f)
+            if eid == ebml.CLUSTER:
+                for cid, o, h, payload in ebml.children(f.read(size)):
+                    if (cid == SIMPLEBLOCK and
+                            bytearray(payload[0:1])[0] & 0x7f == track):
+                        out.append(payload[4:])
+            pos += hdrsize + size
+        return out
+    finally:
+        f.close()
+
+
+def extract(path, track, out, header=b'HDR'):
+    """Write *header* and then the frames of *track* of *path* to *out*."""
+    f = open(out, 'wb')
+    try:
+        f.write(header + b''.join(frames(path, track)))
+    finally:
+        f.close()
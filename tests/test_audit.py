@@ -0,0 +1,128 @@
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import simplemkv.audit
+import simplemkv.info
+import simplemkv.tomp4
+from tests import fixtures
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class TestAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lib = os.path.join(self.dir, 'lib')
+        os.makedirs(os.path.join(self.lib, 'sub'))
+        for name in ('a.mkv', 'bad.mkv', 'notes.txt',
+                     os.path.join('sub', 'b.mkv')):
+            f = open(os.path.join(self.lib, name), 'wb')
+            try:
+                f.write(b'x' * 1000000)
+            finally:
+                f.close()
+        self.probe = simplemkv.tomp4.probe
+        simplemkv.tomp4.probe = self.fake_probe
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.probed = []
+
+    def tearDown(self):
+        simplemkv.tomp4.probe = self.probe
+        sys.stdout = self.stdout
+        shutil.rmtree(self.dir)
+
+    def fake_probe(self, mkvfile, **opts):
+        self.probed.append(os.path.basename(mkvfile))
+        if mkvfile.endswith('bad.mkv'):
+            raise SystemExit('not an mkv')
+        return simplemkv.info.infodict(fixtures.MKVINFO.split('\n'))
+
+    def audit(self, report, *argv):
+        report = os.path.join(self.dir, report)
+        opts, files = fixtures.options(
+            '--audit=' + report,
+            '--probe-cache=' + os.path.join(self.dir, 'probes.json'),
+            '--throughput-file=' + os.path.join(self.dir, 'rates.json'),
+            *(argv + (self.lib,)))
+        simplemkv.tomp4.audit_main(files, **opts)
+        return report
+
+    def read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_report(self):
+        report = json.loads(self.read(self.audit('report.json', '-j', '2')))
+        a, bad, b = report['files']
+        self.assertEqual([r['path'] for r in report['files']],
+                         [os.path.join(self.lib, 'a.mkv'),
+                          os.path.join(self.lib, 'bad.mkv'),
+                          os.path.join(self.lib, 'sub', 'b.mkv')])
+        self.assertEqual(
+            dict((k, a[k]) for k in (
+                'size', 'duration', 'video_codec', 'video_level', 'hevc',
+                'level_patch', 'audio_codec', 'audio_channels',
+                'audio_transcode', 'subtitles', 'usable', 'problem')),
+            {'size': 1000000, 'duration': 100.0,
+             'video_codec': 'MPEG4/ISO/AVC', 'video_level': 5.1,
+             'hevc': False, 'level_patch': True, 'audio_codec': 'AC3',
+             'audio_channels': 6, 'audio_transcode': True,
+             'subtitles': 'text', 'usable': True, 'problem': None})
+        self.assertAlmostEqual(
+            a['total_seconds'], a['extract_seconds'] +
+            a['convert_audio_seconds'] + a['mux_seconds'])
+        self.assertGreater(a['convert_audio_seconds'], 0)
+        self.assertEqual((bad['usable'], bad['problem']),
+                         (False, 'mkvinfo failed: not an mkv'))
+        summary = report['summary']
+        self.assertEqual(
+            dict((k, summary[k]) for k in (
+                'files', 'usable', 'unusable', 'audio_transcode',
+                'level_patch', 'hevc', 'text_subtitles', 'pgs_subtitles',
+                'bytes', 'jobs')),
+            {'files': 3, 'usable': 2, 'unusable': 1, 'audio_transcode': 2,
+             'level_patch': 2, 'hevc': 0, 'text_subtitles': 2,
+             'pgs_subtitles': 0, 'bytes': 2000000, 'jobs': 2})
+        self.assertAlmostEqual(summary['total_seconds'],
+                               a['total_seconds'] + b['total_seconds'])
+        self.assertAlmostEqual(summary['wall_seconds'],
+                               summary['total_seconds'] / 2)
+        self.assertIn('audit: 3 files: 2 convertible, 1 not\n',
+                      sys.stdout.getvalue())
+
+    def test_cached(self):
+        first = self.read(self.audit('first.json'))
+        self.assertEqual(sorted(self.probed), ['a.mkv', 'b.mkv', 'bad.mkv'])
+        # Only the file mkvinfo failed on is probed again.
+        self.probed = []
+        self.assertEqual(self.read(self.audit('second.json')), first)
+        self.assertEqual(self.probed, ['bad.mkv'])
+
+    def test_csv(self):
+        f = open(self.audit('report.csv'))
+        try:
+            rows = list(csv.reader(f))
+        finally:
+            f.close()
+        self.assertEqual(tuple(rows[0]), simplemkv.audit.fields)
+        a = dict(zip(rows[0], rows[1]))
+        self.assertEqual((a['size'], a['duration'], a['level_patch'],
+                          a['problem']), ('1000000', '100.000', 'yes', ''))
+        self.assertEqual(len(rows), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
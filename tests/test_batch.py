@@ -0,0 +1,54 @@
+import sys
+import unittest
+
+import simplemkv.tomp4
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class TestBatchProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.real_main = simplemkv.tomp4.real_main
+        simplemkv.tomp4.real_main = self.fake_main
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.converted = []
+
+    def tearDown(self):
+        simplemkv.tomp4.real_main = self.real_main
+        sys.stdout = self.stdout
+
+    def fake_main(self, mkvfile, **opts):
+        self.converted.append(mkvfile)
+
+    def progress(self, predicted, parallel=1):
+        return simplemkv.tomp4.BatchProgress(predicted, parallel)
+
+    def test_same_file_twice(self):
+        run = self.progress({'a.mkv': 10.0, 'b.mkv': 20.0})
+        run('a.mkv')
+        run('a.mkv')
+        self.assertEqual(self.converted, ['a.mkv', 'a.mkv'])
+        self.assertEqual(list(run.remaining), ['b.mkv'])
+
+    def test_running_jobs(self):
+        run = self.progress({'a.mkv': 100.0, 'b.mkv': 100.0}, parallel=2)
+        run.started['a.mkv'] = 1000.0
+        # a.mkv has run for 40s of its 100; b.mkv hasn't started.
+        self.assertAlmostEqual(run.seconds_left(1040.0), (60.0 + 100.0) / 2)
+        # Nor is a job that has overrun predicted to take less than no time.
+        self.assertAlmostEqual(run.seconds_left(1200.0), 100.0 / 2)
+
+    def test_scaled_by_finished_jobs(self):
+        run = self.progress({'a.mkv': 100.0})
+        # Those that finished took twice as long as predicted.
+        run.done_predicted, run.done_seconds = 50.0, 100.0
+        self.assertAlmostEqual(run.seconds_left(0.0), 200.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
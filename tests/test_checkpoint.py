@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mkv = self.write('a.mkv', b'mkv')
+        self.state = simplemkv.checkpoint.state_path(self.mkv)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return path
+
+    def checkpoint(self):
+        return simplemkv.checkpoint.Checkpoint(self.state, self.mkv)
+
+    def run_stages(self):
+        """Complete an extract stage and an encode stage that reads what it
+        extracted, and return their outputs."""
+        raw = self.write('a.h264', b'video')
+        mp4 = self.write('a.mp4', b'mp4')
+        c = self.checkpoint()
+        c.complete('extract', ['x', self.mkv], [raw], [self.mkv])
+        c.complete('encode', ['e', raw], [mp4], [raw])
+        return raw, mp4
+
+    def test_skips_finished_stages(self):
+        raw, mp4 = self.run_stages()
+        c = self.checkpoint()
+        self.assertTrue(c.done('extract', ['x', self.mkv], [raw], [self.mkv]))
+        self.assertTrue(c.done('encode', ['e', raw], [mp4], [raw]))
+
+    def test_different_command(self):
+        raw, mp4 = self.run_stages()
+        c = self.checkpoint()
+        self.assertFalse(c.done('extract', ['x', '-v', self.mkv], [raw]))
+        # Nor is anything after it done, though it's unchanged.
+        self.assertFalse(c.done('encode', ['e', raw], [mp4], [raw]))
+
+    def test_changed_output(self):
+        raw, mp4 = self.run_stages()
+        self.write('a.h264', b'other')
+        c = self.checkpoint()
+        self.assertFalse(c.done('extract', ['x', self.mkv], [raw], [self.mkv]))
+        self.assertFalse(c.done('encode', ['e', raw], [mp4], [raw]))
+
+    def test_changed_input(self):
+        raw = self.write('a.h264', b'video')
+        srt = self.write('a.srt', b'subtitles')
+        mp4 = self.write('a.mp4', b'mp4')
+        c = self.checkpoint()
+        c.complete('extract', ['x', self.mkv], [raw], [self.mkv])
+        c.complete('add-sub', ['s', raw, srt], [mp4], [raw, srt])
+        # The subtitles weren't made by any stage, but they changed since.
+        self.write('a.srt', b'edited')
+        c = self.checkpoint()
+        self.assertTrue(c.done('extract', ['x', self.mkv], [raw], [self.mkv]))
+        self.assertFalse(c.done('add-sub', ['s', raw, srt], [mp4],
+                                [raw, srt]))
+
+    def test_changed_source(self):
+        raw, mp4 = self.run_stages()
+        self.write('a.mkv', b'new mkv')
+        c = self.checkpoint()
+        self.assertFalse(c.done('extract', ['x', self.mkv], [raw], [self.mkv]))
+
+    def test_branches(self):
+        out1 = self.write('1.mp4', b'1')
+        out2 = self.write('2.mp4', b'2')
+        c = self.checkpoint()
+        c.branch('1').complete('mux', ['m', '1'], [out1])
+        c.branch('2').complete('mux', ['m', '2'], [out2])
+        self.write('1.mp4', b'changed')
+        c = self.checkpoint()
+        self.assertFalse(c.branch('1').done('mux', ['m', '1'], [out1]))
+        self.assertTrue(c.branch('2').done('mux', ['m', '2'], [out2]))
+
+    def test_corrupt(self):
+        raw, mp4 = self.run_stages()
+        f = open(self.state)
+        try:
+            text = f.read()
+        finally:
+            f.close()
+        for data in (text[:len(text) // 2], '', '[]', '{"stages": 1}',
+                     'not json'):
+            self.write(self.state, data.encode('ascii'))
+            c = self.checkpoint()
+            self.assertFalse(c.done('extract', ['x', self.mkv], [raw],
+                                    [self.mkv]), data)
+            # And the next stage to complete starts the file afresh.
+            c.complete('extract', ['x', self.mkv], [raw], [self.mkv])
+            f = open(self.state)
+            try:
+                state = json.load(f)
+            finally:
+                f.close()
+            self.assertEqual([s['name'] for s in state['stages']],
+                             ['extract'])
+
+    def test_corrupt_but_same_source(self):
+        raw, mp4 = self.run_stages()
+        source = simplemkv.checkpoint.fingerprint(self.mkv)
+        self.write(self.state, json.dumps({'source': source}).encode('ascii'))
+        c = self.checkpoint()
+        self.assertFalse(c.done('extract', ['x', self.mkv], [raw], [self.mkv]))
+        c.complete('extract', ['x', self.mkv], [raw], [self.mkv])
+
+    def test_remove(self):
+        self.run_stages()
+        c = self.checkpoint()
+        c.remove()
+        self.assertFalse(os.path.exists(self.state))
+        c.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.demux
+import simplemkv.ebml
+import simplemkv.executor
+import simplemkv.governor
+import simplemkv.tomp4
+from tests import mkv
+
+
+class FakeLayout(object):
+    first_cluster = 100
+    segment_end = 1000
+
+
+class TestRanges(unittest.TestCase):
+
+    starts = [100, 200, 300, 400, 500, 600, 700, 800, 900]
+
+    def test_split(self):
+        self.assertEqual(
+            simplemkv.demux.split_ranges(self.starts, FakeLayout(), 3),
+            [(100, 400), (400, 700), (700, 1000)])
+
+    def test_too_few_cues(self):
+        self.assertEqual(
+            simplemkv.demux.split_ranges([100, 900], FakeLayout(), 4),
+            [(100, 900), (900, 1000)])
+        self.assertEqual(simplemkv.demux.split_ranges([], FakeLayout(), 4), [])
+
+    def test_seams(self):
+        ranges = [(100, 400), (400, 700), (700, 1000)]
+        self.assertEqual(
+            simplemkv.demux.seam_ranges(self.starts, ranges, 1000),
+            [(300, 400, 500), (600, 700, 800)])
+        self.assertEqual(
+            simplemkv.demux.seam_ranges([100, 900], [(100, 900), (900, 1000)],
+                                        1000),
+            [(100, 900, 1000)])
+
+
+class DemuxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mkv = os.path.join(self.dir, 't.mkv')
+        f = open(self.mkv, 'wb')
+        try:
+            f.write(mkv.mkv([
+                mkv.cluster(1000 * i, [(1, b'v%d' % i), (2, b'a%d' % i)])
+                for i in range(12)
+            ]))
+        finally:
+            f.close()
+        self.outs = [os.path.join(self.dir, 't.video'),
+                     os.path.join(self.dir, 't.audio')]
+        self.calls = []
+        self.errors = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def extract(self, path, outs):
+        self.calls.append(path)
+        for track, out in zip((1, 2), outs):
+            mkv.extract(path, track, out)
+
+    def parallel(self, extract, parts=3):
+        return simplemkv.demux.parallel_extract(
+            self.mkv, self.outs, parts, extract, 1,
+            errorfunc=lambda *args: self.errors.append(args))
+
+    def read(self, path):
+        f = open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+
+class TestParallelExtract(DemuxTestCase):
+
+    def test_same_as_whole_file(self):
+        self.assertEqual(self.parallel(self.extract), 3)
+        self.assertEqual(self.read(self.outs[0]),
+                         b'HDR' + b''.join(b'v%d' % i for i in range(12)))
+        self.assertEqual(self.read(self.outs[1]),
+                         b'HDR' + b''.join(b'a%d' % i for i in range(12)))
+        self.assertEqual(self.errors, [])
+        # Each range is copied once for both tracks.
+        parts = [c for c in self.calls if '.part' in c]
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['t.audio', 't.mkv', 't.video'])
+
+    def test_one_part(self):
+        self.assertEqual(self.parallel(self.extract, parts=1), 1)
+        self.assertEqual(self.calls, [self.mkv])
+
+    def test_context_dependent(self):
+        # An extractor that writes something before the first frame of a
+        # stream, but not before the frames of the rest of it, can't be
+        # joined, though every piece starts with the header.
+        def extract(path, outs):
+            self.calls.append(path)
+            for track, out in zip((1, 2), outs):
+                frames = mkv.frames(path, track)
+                f = open(out, 'wb')
+                try:
+                    f.write(b'HDR' + b''.join(
+                        (b'SEI' if i == 0 else b'') + frame
+                        for i, frame in enumerate(frames)))
+                finally:
+                    f.close()
+        self.assertEqual(self.parallel(extract), 1)
+        self.assertEqual(self.calls[-1], self.mkv)
+        self.assertTrue(self.errors)
+        self.assertEqual(self.read(self.outs[0])[:8], b'HDRSEIv0')
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['t.audio', 't.mkv', 't.video'])
+
+    def test_failed_part(self):
+        def extract(path, outs):
+            if path.endswith('.part1.mkv'):
+                raise SystemExit(1)
+            self.extract(path, outs)
+        self.assertEqual(self.parallel(extract), 1)
+        self.assertEqual(self.calls[-1], self.mkv)
+        self.assertEqual(self.read(self.outs[1]),
+                         b'HDR' + b''.join(b'a%d' % i for i in range(12)))
+
+
+class TestExtractTracks(DemuxTestCase):
+
+    def setUp(self):
+        DemuxTestCase.setUp(self)
+        self.command = simplemkv.tomp4.command
+        simplemkv.tomp4.command = self.fake_command
+
+    def tearDown(self):
+        simplemkv.tomp4.command = self.command
+        DemuxTestCase.tearDown(self)
+
+    def fake_command(self, cmd, **opts):
+        # mkvextract tracks <mkv> <track>:<out>...
+        self.calls.append((simplemkv.executor.current_outputs(),
+                           simplemkv.executor.current_policy()))
+        for spec in cmd[3:]:
+            track, out = spec.split(':', 1)
+            mkv.extract(cmd[2], int(track) + 1, out)
+
+    def test_parts_run_as_the_stage(self):
+        tracks = [({'number': 0, 'codec': 'V_MPEG4/ISO/AVC'}, self.outs[0]),
+                  ({'number': 1, 'codec': 'A_AAC'}, self.outs[1])]
+        opts = dict(parallel_demux=3, parallel_demux_min_size=0,
+                    dry_run=False, verbosity=0)
+        policy = simplemkv.governor.Policy(nice=5)
+        with simplemkv.executor.Stage(self.outs, policy):
+            simplemkv.tomp4.extract_tracks(self.mkv, tracks, None, **opts)
+        self.assertEqual(self.read(self.outs[0]),
+                         b'HDR' + b''.join(b'v%d' % i for i in range(12)))
+        parts = [(outputs, p) for outputs, p in self.calls
+                 if outputs[0].endswith('.part1')]
+        self.assertEqual(parts,
+                         [([o + '.part1' for o in self.outs], policy)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.ebml as ebml
+from tests import mkv
+
+
+def clusters(n=6, tracks=(1, 2)):
+    """*n* one-second clusters, each with a frame of each of *tracks*."""
+    return [mkv.cluster(1000 * i, [(t, b'%d:%d' % (t, i)) for t in tracks])
+            for i in range(n)]
+
+
+class EbmlTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data, name='t.mkv'):
+        path = os.path.join(self.dir, name)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return path
+
+    def read(self, path):
+        f = open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def layout(self, path):
+        f = open(path, 'rb')
+        try:
+            layout = ebml.read_layout(f)
+            return layout, ebml.cue_points(f, layout)
+        finally:
+            f.close()
+
+    def copy(self, path, first, last, **kwargs):
+        out = os.path.join(self.dir, 'out.mkv')
+        layout = self.layout(path)[0]
+        src = open(path, 'rb')
+        try:
+            dst = open(out, 'wb')
+            try:
+                ebml.write_range(src, dst, layout, first, last, **kwargs)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        return out
+
+
+class TestLayout(EbmlTestCase):
+
+    def test_layout(self):
+        path = self.write(mkv.mkv(clusters(), duration=6000.0))
+        layout, points = self.layout(path)
+        self.assertEqual(layout.timescale, 1000000)
+        self.assertEqual(layout.duration, 6000.0)
+        self.assertEqual(layout.segment_end, os.path.getsize(path))
+        self.assertEqual([t for t, pos in points],
+                         [0, 1000, 2000, 3000, 4000, 5000])
+        self.assertEqual(points[0][1], layout.first_cluster)
+        self.assertAlmostEqual(layout.seconds(2000), 2.0)
+
+    def test_scan_without_cues(self):
+        data = mkv.mkv(clusters(), cues=False)
+        with_cues = self.layout(self.write(mkv.mkv(clusters())))[1]
+        layout, points = self.layout(self.write(data, 'nocues.mkv'))
+        self.assertIsNone(layout.cues)
+        self.assertEqual([t for t, pos in points], [t for t, pos in with_cues])
+
+    def test_not_ebml(self):
+        path = self.write(b'not an mkv at all')
+        self.assertRaises(ebml.EBMLError, self.layout, path)
+
+    def test_cluster_range(self):
+        layout, points = self.layout(self.write(mkv.mkv(clusters())))
+        pos = [p for t, p in points]
+        self.assertEqual(ebml.cluster_range(points, layout, 1500, 3000),
+                         (pos[1], pos[3], 1000))
+        self.assertEqual(ebml.cluster_range(points, layout, 4500),
+                         (pos[4], layout.segment_end, 4000))
+
+
+class TestWriteRange(EbmlTestCase):
+
+    def test_copy(self):
+        path = self.write(mkv.mkv(clusters(), tail=mkv.element(
+            0x1254C367, b'tags')))
+        layout, points = self.layout(path)
+        out = self.copy(path, points[2][1], layout.segment_end)
+        self.assertEqual(mkv.frames(out, 1), [b'1:2', b'1:3', b'1:4', b'1:5'])
+        self.assertEqual(mkv.frames(out, 2), [b'2:2', b'2:3', b'2:4', b'2:5'])
+        # The Tags after the clusters are left out.
+        self.assertNotIn(b'tags', self.read(out))
+
+    def test_no_clusters(self):
+        path = self.write(mkv.mkv(clusters()))
+        out = self.copy(path, 0, 0)
+        layout, points = self.layout(out)
+        self.assertIsNone(layout.first_cluster)
+        self.assertEqual(mkv.frames(out, 1), [])
+
+    def test_shift(self):
+        path = self.write(mkv.mkv(clusters(), duration=6000.0))
+        layout, points = self.layout(path)
+        out = self.copy(path, points[3][1], points[5][1], shift=3000,
+                        duration=2000.0)
+        layout, points = self.layout(out)
+        self.assertEqual([t for t, pos in points], [0, 1000])
+        self.assertEqual(layout.duration, 2000.0)
+        self.assertEqual(mkv.frames(out, 1), [b'1:3', b'1:4'])
+
+
+class TestWriteSample(EbmlTestCase):
+
+    def test_sample(self):
+        path = self.write(mkv.mkv(clusters(), duration=6000.0))
+        out = os.path.join(self.dir, 'sample.mkv')
+        layout, points = self.layout(path)
+        self.assertEqual(ebml.write_sample(path, out, 1.5, 2, track=1),
+                         (points[1][1], points[4][1]))
+        self.assertEqual(mkv.frames(out, 1), [b'1:1', b'1:2', b'1:3'])
+        self.assertEqual(self.layout(out)[0].duration, 3000.0)
+
+    def test_dry_run(self):
+        path = self.write(mkv.mkv(clusters()))
+        out = os.path.join(self.dir, 'sample.mkv')
+        ebml.write_sample(path, None, 1, 1)
+        self.assertFalse(os.path.exists(out))
+
+
+if __name__ == '__main__':
+    unittest.main()
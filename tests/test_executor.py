@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import simplemkv.executor as executor
+
+
+@unittest.skipUnless(os.name == 'posix', 'needs sh, sleep and yes')
+class TestRun(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.out = os.path.join(self.dir, 'out')
+        f = open(self.out, 'w')
+        f.close()
+        self.kill_grace_seconds = executor.kill_grace_seconds
+        executor.kill_grace_seconds = 1.0
+
+    def tearDown(self):
+        executor.kill_grace_seconds = self.kill_grace_seconds
+        # Let the tests after a cancellation run commands again.
+        executor._cancelled.clear()
+        shutil.rmtree(self.dir)
+
+    def run_stage(self, cmd, **kwargs):
+        with executor.Stage([self.out]):
+            return executor.run(cmd, **kwargs)
+
+    def alive(self, pid):
+        """Whether *pid* is still running, as opposed to gone or a zombie
+        no one has reaped yet."""
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        try:
+            f = open('/proc/%d/stat' % pid)
+        except (IOError, OSError):
+            return True
+        try:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        finally:
+            f.close()
+
+    def test_run(self):
+        self.assertEqual(
+            self.run_stage(['sh', '-c', 'echo out; echo err >&2; exit 3'],
+                           stall_timeout=5, timeout=5),
+            (3, b'out\n', b'err\n'))
+        self.assertTrue(os.path.exists(self.out))
+
+    def test_stalled(self):
+        start = time.time()
+        self.assertRaises(executor.Stalled, self.run_stage, ['sleep', '30'],
+                          stall_timeout=0.3)
+        self.assertLess(time.time() - start, 5)
+        self.assertFalse(os.path.exists(self.out))
+
+    def test_progress(self):
+        # Neither output on stdout nor a growing output file is a stall.
+        script = 'for i in 1 2 3 4 5; do echo x%s; sleep 0.15; done'
+        rc, out, err = self.run_stage(['sh', '-c', script % ''],
+                                      stall_timeout=0.6)
+        self.assertEqual(out, b'x\n' * 5)
+        script = script % (' >>' + self.out)
+        rc, out, err = self.run_stage(['sh', '-c', script], stall_timeout=0.6)
+        self.assertEqual((rc, out), (0, b''))
+
+    def test_timed_out(self):
+        # yes never stalls, but runs for ever.
+        start = time.time()
+        self.assertRaises(executor.TimedOut, self.run_stage, ['yes'],
+                          stall_timeout=0.3, timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+        self.assertFalse(os.path.exists(self.out))
+
+    def test_process_group_killed(self):
+        # What the command started goes with it.
+        pidfile = os.path.join(self.dir, 'pid')
+        script = 'sleep 30 & echo $! >%s; wait' % pidfile
+        self.assertRaises(executor.TimedOut, self.run_stage,
+                          ['sh', '-c', script], timeout=0.5)
+        f = open(pidfile)
+        try:
+            pid = int(f.read())
+        finally:
+            f.close()
+        deadline = time.time() + 5
+        while self.alive(pid) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(self.alive(pid))
+
+    def test_cancelled(self):
+        raised = []
+
+        def run():
+            try:
+                self.run_stage(['sleep', '30'])
+            except executor.Cancelled:
+                raised.append(True)
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        deadline = time.time() + 5
+        while not executor._running and time.time() < deadline:
+            time.sleep(0.01)
+        executor.cancel_all()
+        t.join(5)
+        self.assertEqual(raised, [True])
+        self.assertFalse(os.path.exists(self.out))
+        # And nothing more runs.
+        self.assertRaises(executor.Cancelled, executor.run, ['true'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import subprocess as sp
+import sys
+import unittest
+
+import simplemkv.governor as governor
+
+
+class TestParseIonice(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(governor.parse_ionice('idle'), (3, 0))
+        self.assertEqual(governor.parse_ionice('be:7'), (2, 7))
+        self.assertEqual(governor.parse_ionice('best-effort'), (2, 4))
+
+    def test_bad(self):
+        for spec in ('fast', 'be:8', 'be:x'):
+            self.assertRaises(governor.GovernorError,
+                              governor.parse_ionice, spec)
+
+
+class TestPolicy(unittest.TestCase):
+
+    def test_syscall_found_in_parent(self):
+        self.assertIsNone(governor.Policy(nice=5).syscall)
+        policy = governor.Policy(ioprio=(3, 0))
+        self.assertEqual(policy.syscall, governor._ioprio_syscall())
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs Linux')
+    def test_preexec(self):
+        policy = governor.Policy(nice=5, ioprio=(3, 0))
+        if policy.syscall is None:
+            self.skipTest('no ioprio_set here')
+        # The niceness is field 19 of /proc/<pid>/stat, and the I/O class is
+        # what ioprio_get (the system call after ioprio_set, on every
+        # architecture we know) says.
+        out = sp.Popen(
+            [sys.executable, '-c',
+             'import ctypes; '
+             'stat = open("/proc/self/stat").read(); '
+             'print(stat.split(") ")[1].split()[16]); '
+             'print(ctypes.CDLL(None).syscall(%d, 1, 0) >> 13)'
+             % (policy.syscall[1] + 1)],
+            stdout=sp.PIPE, preexec_fn=policy.preexec,
+        ).communicate()[0]
+        self.assertEqual(out.split(), [b'5', b'3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.graph
+import simplemkv.tomp4
+from tests import fixtures
+
+
+class GraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def export(self, *argv):
+        """Export converting a.mkv with *argv*, and return the Makefile."""
+        path = os.path.join(self.dir, 'Makefile')
+        opts, files = fixtures.options('--export-make=' + path, *(
+            argv + ('a.mkv',)))
+        simplemkv.tomp4.export_main(files, **opts)
+        return self.read(path)
+
+
+class TestExport(GraphTestCase):
+
+    def test_parallel_demux(self):
+        # A build graph doesn't split the file, so each track is extracted
+        # by its own rule rather than both by one.
+        makefile = self.export('--parallel-demux=4',
+                               '--parallel-demux-min-size=0')
+        self.assertIn('\na.mkv.h264: a.mkv\n'
+                      '\tmkvextract tracks a.mkv 0:a.mkv.h264\n', makefile)
+        self.assertIn('\na.mkv.ac3: a.mkv\n'
+                      '\tmkvextract tracks a.mkv 1:a.mkv.ac3\n', makefile)
+
+
+def conversion():
+    """A graph with a stage of two outputs, one that changes a file in
+    place, and file names that need quoting."""
+    graph = simplemkv.graph.BuildGraph()
+    graph.add('extract-video', ['mkvextract', 'tracks', 'a b.mkv',
+                                '0:a b.h264', '1:a b.ac3'],
+              ['a b.mkv'], ['a b.h264', 'a b.ac3'])
+    graph.add('correct-profile', ['mkvtomp4', '--correct-profile-only',
+                                  'a b.h264'],
+              ['a b.h264'], ['a b.h264'])
+    graph.add('mp4', ['MP4Box', '-add', 'a b.h264', '-add', 'a b.ac3',
+                      '-new', '$x.mp4'],
+              ['a b.h264', 'a b.ac3'], ['$x.mp4'])
+    graph.add_default('$x.mp4')
+    graph.add_temps(['a b.h264', 'a b.ac3'])
+    return graph
+
+
+MAKEFILE = r"""# Generated by mkvtomp4 --export-make. Run with make -j<jobs>.
+
+all: $$x.mp4
+.PHONY: all
+
+a\ b.h264 a\ b.ac3 &: a\ b.mkv
+\tmkvextract tracks 'a b.mkv' '0:a b.h264' '1:a b.ac3'
+
+a\ b.h264.correct-profile.stamp: a\ b.h264
+\tmkvtomp4 --correct-profile-only 'a b.h264' \
+&& touch 'a b.h264.correct-profile.stamp'
+
+$$x.mp4: a\ b.h264.correct-profile.stamp a\ b.ac3
+\tMP4Box -add 'a b.h264' -add 'a b.ac3' -new '$$x.mp4'
+
+.INTERMEDIATE: a\ b.h264.correct-profile.stamp a\ b.h264 a\ b.ac3
+
+clean-temp:
+\trm -f 'a b.h264.correct-profile.stamp' 'a b.h264' 'a b.ac3'
+.PHONY: clean-temp
+"""
+
+NINJA = r"""# Generated by mkvtomp4 --export-ninja. Run with ninja -j<jobs>,
+# then ninja clean-temp to remove temporary files.
+
+rule run
+  command = $cmd
+  description = $desc
+
+build a$ b.h264 a$ b.ac3: run a$ b.mkv
+  cmd = mkvextract tracks 'a b.mkv' '0:a b.h264' '1:a b.ac3'
+  desc = extract-video a b.ac3
+
+build a$ b.h264.correct-profile.stamp: run a$ b.h264
+  cmd = mkvtomp4 --correct-profile-only 'a b.h264' \
+&& touch 'a b.h264.correct-profile.stamp'
+  desc = correct-profile a b.h264.correct-profile.stamp
+
+build $$x.mp4: run a$ b.h264.correct-profile.stamp a$ b.ac3
+  cmd = MP4Box -add 'a b.h264' -add 'a b.ac3' -new '$$x.mp4'
+  desc = mp4 $$x.mp4
+
+build all: phony $$x.mp4
+default all
+
+build clean-temp: run
+  cmd = rm -f 'a b.h264.correct-profile.stamp' 'a b.h264' 'a b.ac3'
+  desc = clean-temp
+"""
+
+
+def golden(text):
+    """*text* with its tabs, and its lines joined where they are split to
+    fit here."""
+    return text.replace('\\t', '\t').replace(' \\\n', ' ')
+
+
+class TestWrite(GraphTestCase):
+
+    def write(self, graph, how):
+        path = os.path.join(self.dir, 'out')
+        f = open(path, 'w')
+        try:
+            getattr(graph, how)(f)
+        finally:
+            f.close()
+        return self.read(path)
+
+    def test_make(self):
+        self.assertEqual(self.write(conversion(), 'write_make'),
+                         golden(MAKEFILE))
+
+    def test_ninja(self):
+        self.assertEqual(self.write(conversion(), 'write_ninja'),
+                         golden(NINJA))
+
+    def test_keep_temp_files(self):
+        graph = conversion()
+        graph.keep_temp_files = True
+        self.assertIn('\n.SECONDARY: a\\ b.h264.correct-profile.stamp ',
+                      self.write(graph, 'write_make'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.jobqueue as jobqueue
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.converted = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def ls(self, subdir):
+        return sorted(os.listdir(os.path.join(self.dir, subdir)))
+
+    def worker(self, name, run=None):
+        return jobqueue.Worker(self.dir, run or self.convert,
+                               lease_seconds=60, poll_seconds=0, name=name)
+
+    def convert(self, mkvfile, **opts):
+        self.converted.append((mkvfile, opts))
+
+    def expire(self, claimed):
+        """Make the lease on *claimed* look untouched for longer than the
+        workers' *lease_seconds*."""
+        lease = claimed[:-len('.json')] + '.lease'
+        then = os.stat(lease).st_mtime - 600
+        os.utime(lease, (then, then))
+
+    def test_submit(self):
+        ids = jobqueue.submit(self.dir, ['a.mkv', 'b.mkv'],
+                              {'output': 'out.mp4', 'jobs': 2}, ('output',))
+        self.assertEqual(self.ls('pending'), sorted(i + '.json' for i in ids))
+        job = jobqueue.read_json(os.path.join(self.dir, 'pending',
+                                              ids[0] + '.json'))
+        self.assertEqual(job['mkvfile'], os.path.abspath('a.mkv'))
+        self.assertEqual(job['opts'], {'output': os.path.abspath('out.mp4'),
+                                       'jobs': 2})
+
+    def test_claim(self):
+        jid, = jobqueue.submit(self.dir, ['a.mkv'], {})
+        a, b = self.worker('a'), self.worker('b')
+        self.assertEqual(a.claim(),
+                         (jid, os.path.join(self.dir, 'running',
+                                            jid + '@a.json')))
+        self.assertEqual(self.ls('pending'), [])
+        self.assertEqual(self.ls('running'), [jid + '@a.json',
+                                              jid + '@a.lease'])
+        # Nothing is left for another worker.
+        self.assertIsNone(b.claim())
+
+    def test_fresh_lease_kept(self):
+        jobqueue.submit(self.dir, ['a.mkv'], {})
+        self.worker('a').claim()
+        self.worker('b').reclaim_expired()
+        self.assertEqual(self.ls('pending'), [])
+
+    def test_expired_lease_requeued(self):
+        jid, = jobqueue.submit(self.dir, ['a.mkv'], {})
+        self.expire(self.worker('a').claim()[1])
+        b = self.worker('b')
+        b.reclaim_expired()
+        self.assertEqual(self.ls('pending'), [jid + '.json'])
+        self.assertEqual(self.ls('running'), [])
+        self.assertEqual(b.claim()[0], jid)
+
+    def test_lost_job(self):
+        # A worker that is alive, but whose lease expired anyway (e.g., its
+        # machine was suspended), finds another worker has taken its job
+        # when it finishes: both converted it.
+        jid, = jobqueue.submit(self.dir, ['a.mkv'], {})
+        b = self.worker('b')
+
+        def stalled(mkvfile, **opts):
+            self.expire(claimed)
+            b.reclaim_expired()
+            b.run_job(*b.claim())
+        a = self.worker('a', stalled)
+        claimed = a.claim()[1]
+        self.assertEqual(a.run_job(jid, claimed), 'lost')
+        self.assertEqual(len(self.converted), 1)
+        self.assertEqual(self.ls('done'), [jid + '.json'])
+        self.assertEqual(self.ls('running'), [])
+        report = jobqueue.read_json(os.path.join(self.dir, 'reports',
+                                                 jid + '.json'))
+        self.assertEqual((report['worker'], report['status']), ('a', 'lost'))
+
+    def test_loop(self):
+        def run(mkvfile, **opts):
+            if mkvfile.endswith('bad.mkv'):
+                raise SystemExit(1)
+            self.convert(mkvfile, **opts)
+        ok, bad = jobqueue.submit(self.dir, ['ok.mkv', 'bad.mkv'], {'x': 1})
+        self.assertEqual(self.worker('a', run).loop(), 1)
+        self.assertEqual(self.converted, [(os.path.abspath('ok.mkv'),
+                                           {'x': 1})])
+        self.assertEqual(self.ls('done'), [ok + '.json'])
+        self.assertEqual(self.ls('failed'), [bad + '.json'])
+        report = jobqueue.read_json(os.path.join(self.dir, 'reports',
+                                                 bad + '.json'))
+        self.assertEqual(report['error'], 'exit status: 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
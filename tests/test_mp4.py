@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.mp4
+from tests import boxes
+
+
+class Mp4TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data, name='t.mp4'):
+        path = os.path.join(self.dir, name)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return path
+
+
+class TestBoxes(Mp4TestCase):
+
+    def test_top_level_boxes(self):
+        path = self.write(boxes.mp4(boxes.av_traks(10)))
+        types = [b[0] for b in simplemkv.mp4.top_level_boxes(path)]
+        self.assertEqual(types, ['ftyp', 'mdat', 'moov'])
+
+    def test_large_box(self):
+        # A 64-bit size, as used for mdat over 4GiB.
+        big = b'\0\0\0\1mdat' + b'\0\0\0\0\0\0\0\x18' + b'\0' * 8
+        path = self.write(big + boxes.box(b'moov', b''))
+        self.assertEqual(
+            simplemkv.mp4.top_level_boxes(path),
+            [('mdat', 0, 24, 16), ('moov', 24, 8, 8)])
+
+    def test_box_to_end_of_file(self):
+        path = self.write(b'\0\0\0\0mdat' + b'\0' * 10)
+        self.assertEqual(simplemkv.mp4.top_level_boxes(path),
+                         [('mdat', 0, 18, 8)])
+
+    def test_moov_size(self):
+        traks = boxes.av_traks(10)
+        path = self.write(boxes.mp4(traks))
+        self.assertEqual(simplemkv.mp4.moov_size(path),
+                         8 + sum(len(t) for t in traks))
+        path = self.write(boxes.box(b'ftyp', b'isom'), 'nomoov.mp4')
+        self.assertIsNone(simplemkv.mp4.moov_size(path))
+
+    def test_is_faststart(self):
+        traks = boxes.av_traks(10)
+        self.assertFalse(simplemkv.mp4.is_faststart(
+            self.write(boxes.mp4(traks), 'a.mp4')))
+        self.assertTrue(simplemkv.mp4.is_faststart(
+            self.write(boxes.mp4(traks, moov_first=True), 'b.mp4')))
+
+
+class TestReadTracks(Mp4TestCase):
+
+    def test_tracks(self):
+        info = simplemkv.mp4.read_tracks(self.write(boxes.mp4(
+            boxes.av_traks(10, fps=24.0, subtitles=True, offset=16))))
+        self.assertFalse(info['mdat_truncated'])
+        video, audio, subtitles = info['tracks']
+        self.assertEqual(video['handler'], 'vide')
+        self.assertEqual(video['codec'], 'avc1')
+        self.assertEqual(video['language'], 'und')
+        self.assertEqual(video['samples'], 240)
+        self.assertEqual(video['stts_samples'], 240)
+        self.assertAlmostEqual(video['duration'], 10.0)
+        self.assertAlmostEqual(video['fps'], 24.0)
+        self.assertEqual(video['last_chunk_offset'], 16)
+        self.assertEqual(audio['handler'], 'soun')
+        self.assertEqual(audio['codec'], 'mp4a')
+        self.assertEqual(audio['language'], 'eng')
+        self.assertAlmostEqual(audio['duration'], 10.0, places=1)
+        self.assertEqual(subtitles['handler'], 'sbtl')
+        self.assertEqual(subtitles['codec'], 'tx3g')
+
+    def test_co64_and_mdhd_version_1(self):
+        trak = boxes.trak(b'vide', b'hvc1', 25000, 1000, 250, 'fra',
+                          offsets=(16, 1 << 33), co64=True, mdhd_version=1)
+        info = simplemkv.mp4.read_tracks(self.write(boxes.mp4([trak])))
+        track = info['tracks'][0]
+        self.assertEqual(track['codec'], 'hvc1')
+        self.assertEqual(track['language'], 'fra')
+        self.assertAlmostEqual(track['duration'], 10.0)
+        self.assertEqual(track['last_chunk_offset'], 1 << 33)
+
+    def test_truncated_mdat(self):
+        data = boxes.mp4(boxes.av_traks(10), moov_first=True, truncate=10)
+        info = simplemkv.mp4.read_tracks(self.write(data))
+        self.assertTrue(info['mdat_truncated'])
+        self.assertEqual(len(info['tracks']), 2)
+
+    def test_no_moov(self):
+        info = simplemkv.mp4.read_tracks(self.write(
+            boxes.box(b'ftyp', b'isom') + boxes.box(b'mdat', b'\0' * 8)))
+        self.assertEqual(info['tracks'], [])
+
+
+class TestMoovReserve(unittest.TestCase):
+
+    def test_reserve(self):
+        base = simplemkv.mp4.moov_reserve(100000)
+        self.assertGreater(base, 100000)
+        self.assertEqual(simplemkv.mp4.moov_reserve(100000, 3600), base)
+        self.assertGreater(
+            simplemkv.mp4.moov_reserve(100000, 3600, subtitles=True),
+            base + 3600 * simplemkv.mp4.subtitle_second_bytes)
+        self.assertGreater(simplemkv.mp4.moov_reserve(100000, extra=100),
+                           base + 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
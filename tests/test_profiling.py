@@ -0,0 +1,63 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.profiling
+
+tracemalloc = simplemkv.profiling.tracemalloc
+
+
+@unittest.skipIf(tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'),
+                 'needs tracemalloc.reset_peak (Python 3.9)')
+class TestTraceMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracemalloc.stop()
+        shutil.rmtree(self.dir)
+
+    def peak(self, name):
+        """The peak written for job *name*, and what it's the peak of."""
+        f = open(os.path.join(self.dir, name + '.top.txt'))
+        try:
+            line = f.readline()
+        finally:
+            f.close()
+        m = re.search(r'(\d+) at the peak (.*)', line)
+        return int(m.group(1)), m.group(2)
+
+    def test_peak_per_job(self):
+        with simplemkv.profiling.Profiler('big', trace_dir=self.dir):
+            data = b'x' * (8 << 20)
+            del data
+        with simplemkv.profiling.Profiler('small', trace_dir=self.dir):
+            pass
+        self.assertGreater(self.peak('big')[0], 8 << 20)
+        self.assertLess(self.peak('small')[0], 8 << 20)
+        self.assertEqual(self.peak('small')[1], 'during small')
+
+    def test_overlapping_jobs(self):
+        # The second job to start doesn't lose the first its peak.
+        first = simplemkv.profiling.Profiler('first', trace_dir=self.dir)
+        second = simplemkv.profiling.Profiler('second', trace_dir=self.dir)
+        with first:
+            data = b'x' * (8 << 20)
+            del data
+            with second:
+                pass
+        peak, since = self.peak('first')
+        self.assertGreater(peak, 8 << 20)
+        self.assertEqual(since, 'since first started, with other jobs running')
+        self.assertEqual(self.peak('second')[1], since)
+        with simplemkv.profiling.Profiler('alone', trace_dir=self.dir):
+            pass
+        self.assertEqual(self.peak('alone')[1], 'during alone')
+        self.assertLess(self.peak('alone')[0], 8 << 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.mp4
+import simplemkv.tomp4
+from tests import boxes
+
+
+class TestRemuxCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input = self.write('in.mp4', boxes.mp4(boxes.av_traks(100)))
+        self.output = os.path.join(self.dir, 'out.mp4')
+        self.cmd = ['ffmpeg', '-y', '-i', self.input, '-codec', 'copy',
+                    '-movflags', '+faststart', self.output]
+        self.calls = []
+        self.results = []
+        self.run_command = simplemkv.tomp4.run_command
+        simplemkv.tomp4.run_command = self.fake_run_command
+        self.opts = simplemkv.tomp4.default_options('mkvtomp4')
+
+    def tearDown(self):
+        simplemkv.tomp4.run_command = self.run_command
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return path
+
+    def fake_run_command(self, cmd, **opts):
+        # Write moov first, unless told to fail or to write it last.
+        self.calls.append(cmd)
+        returncode, cherr, moov_first = self.results.pop(0)
+        self.write('out.mp4', boxes.mp4(boxes.av_traks(100),
+                                        moov_first=moov_first))
+        return returncode, '', cherr
+
+    def remux(self):
+        simplemkv.tomp4.remux_command(
+            self.cmd, lambda: simplemkv.tomp4.faststart_reserve(
+                self.input, {'duration': 100.0}, extra=10),
+            **self.opts)
+
+    def test_reserved(self):
+        self.results = [(0, '', True)]
+        self.remux()
+        reserve = simplemkv.mp4.moov_reserve(
+            simplemkv.mp4.moov_size(self.input), extra=10)
+        self.assertEqual(self.calls, [
+            ['ffmpeg', '-y', '-i', self.input, '-codec', 'copy',
+             '-moov_size', str(reserve), self.output],
+        ])
+
+    def test_too_small(self):
+        self.results = [(1, 'reserved_moov_size is too small', False),
+                        (0, '', True)]
+        self.remux()
+        self.assertEqual(self.calls[1], self.cmd)
+
+    def test_moov_not_first(self):
+        self.results = [(0, '', False), (0, '', True)]
+        self.remux()
+        self.assertEqual(self.calls[1], self.cmd)
+
+    def test_no_moov_to_go_by(self):
+        os.remove(self.input)
+        self.results = [(0, '', True)]
+        self.remux()
+        self.assertEqual(self.calls, [self.cmd])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import simplemkv.sched
+import simplemkv.tomp4
+
+
+class TestStageScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.threads = []
+        self.releases = []
+
+    def tearDown(self):
+        for release in self.releases:
+            release.set()
+        for t in self.threads:
+            t.join(5)
+
+    def start(self, scheduler, resource, devices):
+        """Acquire a slot in another thread. Returns an event set once it
+        has the slot, and one that releases it when set."""
+        acquired, release = threading.Event(), threading.Event()
+
+        def hold():
+            scheduler.acquire(resource, devices)
+            acquired.set()
+            release.wait(5)
+            scheduler.release(resource, devices)
+        t = threading.Thread(target=hold)
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+        self.releases.append(release)
+        return acquired, release
+
+    def assertWaits(self, acquired):
+        self.assertFalse(acquired.wait(0.2))
+
+    def assertGets(self, acquired):
+        self.assertTrue(acquired.wait(5))
+
+    def test_io_per_device(self):
+        scheduler = simplemkv.sched.StageScheduler(io_per_device=2)
+        first = self.start(scheduler, 'io', [1])
+        second = self.start(scheduler, 'io', [1])
+        self.assertGets(first[0])
+        self.assertGets(second[0])
+        third = self.start(scheduler, 'io', [1])
+        self.assertWaits(third[0])
+        # Other devices are not held up.
+        self.assertGets(self.start(scheduler, 'io', [2])[0])
+        first[1].set()
+        self.assertGets(third[0])
+        second[1].set()
+        third[1].set()
+
+    def test_all_devices_at_once(self):
+        # A stage using two devices waits for both, holding neither in the
+        # meantime.
+        scheduler = simplemkv.sched.StageScheduler(io_per_device=1)
+        busy = self.start(scheduler, 'io', [2])
+        self.assertGets(busy[0])
+        both = self.start(scheduler, 'io', [1, 2])
+        self.assertWaits(both[0])
+        one = self.start(scheduler, 'io', [1])
+        self.assertGets(one[0])
+        one[1].set()
+        busy[1].set()
+        self.assertGets(both[0])
+        both[1].set()
+
+    def test_cpu_slots(self):
+        scheduler = simplemkv.sched.StageScheduler(cpu_slots=1)
+        first = self.start(scheduler, 'cpu', [])
+        self.assertGets(first[0])
+        second = self.start(scheduler, 'cpu', [])
+        self.assertWaits(second[0])
+        # CPU slots don't hold up io stages.
+        self.assertGets(self.start(scheduler, 'io', [1])[0])
+        first[1].set()
+        self.assertGets(second[0])
+        second[1].set()
+
+    def test_slot_devices(self):
+        d = tempfile.mkdtemp()
+        try:
+            scheduler = simplemkv.sched.StageScheduler()
+            paths = [os.path.join(d, 'a.mkv'), os.path.join(d, 'x', 'a.h264')]
+            slot = scheduler.slot('io', paths)
+            self.assertEqual(slot.devices, [os.stat(d).st_dev])
+            self.assertEqual(scheduler.slot('cpu', paths).devices, [])
+            with slot:
+                self.assertEqual(scheduler._io_busy, {os.stat(d).st_dev: 1})
+            self.assertEqual(scheduler._io_busy, {os.stat(d).st_dev: 0})
+        finally:
+            shutil.rmtree(d)
+
+    def test_stage_resources(self):
+        resources = simplemkv.tomp4.stage_resources
+        self.assertEqual(resources['correct-profile'], 'cpu')
+        self.assertEqual(resources['convert-audio'], 'cpu')
+        self.assertEqual(resources['extract-video'], 'io')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import sys
+import unittest
+
+import simplemkv.tomp4
+from tests import fixtures
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+FRAG = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.command = simplemkv.tomp4.command
+        simplemkv.tomp4.command = self.fake_command
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.commands = []
+
+    def tearDown(self):
+        simplemkv.tomp4.command = self.command
+        sys.stdout = self.stdout
+
+    def fake_command(self, cmd, **opts):
+        self.commands.append((cmd, opts.get('spopts')))
+
+    def convert(self, *argv):
+        opts, files = fixtures.options(*(argv + ('a.mkv',)))
+        simplemkv.tomp4.real_main(files[0], **opts)
+        return opts
+
+    def test_dry_run(self):
+        self.convert('--stream=out.mp4', '--dry-run')
+        lines = sys.stdout.getvalue().splitlines()
+        # One ffmpeg pass, straight from the mkv: nothing is extracted.
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('ffmpeg -y -i a.mkv -map 0:0 '
+                                            '-map 0:1 -c:v copy '))
+        self.assertTrue(lines[0].endswith(' ' + ' '.join(FRAG) +
+                                          ' -f mp4 out.mp4'))
+        self.assertIn(' -c:a aac ', lines[0])
+        self.assertIn(' -map 0:2 -c:s mov_text ', lines[0])
+        self.assertEqual(self.commands, [])
+
+    def test_dry_run_stdout(self):
+        self.convert('--stream=-', '--dry-run')
+        self.assertTrue(sys.stdout.getvalue().endswith(' -f mp4 pipe:1\n'))
+
+    def test_stdout(self):
+        # The mp4 goes to a copy of stdout, passed on to ffmpeg under its
+        # own number, since ffmpeg's stdout is read by the executor.
+        opts, files = fixtures.options('--stream=-', 'a.mkv')
+        opts['stream_fd'] = 7
+        simplemkv.tomp4.real_main(files[0], **opts)
+        (cmd, spopts), = self.commands
+        self.assertEqual(cmd[-len(FRAG) - 3:], FRAG + ['-f', 'mp4', 'pipe:7'])
+        if sys.version_info[0] < 3:
+            self.assertEqual(spopts, {'close_fds': False})
+        else:
+            self.assertEqual(spopts, {'pass_fds': (7,)})
+        self.assertEqual(sys.stdout.getvalue(), '')
+
+    def test_file(self):
+        opts, files = fixtures.options('--stream=out.mp4', 'a.mkv')
+        simplemkv.tomp4.real_main(files[0], **opts)
+        (cmd, spopts), = self.commands
+        self.assertEqual(cmd[-1], 'out.mp4')
+        self.assertEqual(spopts, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
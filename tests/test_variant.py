@@ -0,0 +1,34 @@
+import sys
+import unittest
+
+import simplemkv.tomp4
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class TestParseVariant(unittest.TestCase):
+
+    def parse(self, spec):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            return simplemkv.tomp4.parse_variant(spec)
+        finally:
+            sys.stderr = stderr
+
+    def test_parse(self):
+        self.assertEqual(self.parse('profile-level=3.1, output=x.mp4'),
+                         {'profile_level': '3.1', 'output': 'x.mp4'})
+
+    def test_bad_key(self):
+        self.assertRaises(SystemExit, self.parse, 'level=3.1')
+
+    def test_bad_profile_level(self):
+        self.assertRaises(SystemExit, self.parse, 'profile_level=x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simplemkv.tomp4
+from tests import boxes
+
+
+def expected(fps=24.0, source_fps=24.0):
+    return [
+        {'type': 'video', 'codec': 'MPEG4/ISO/AVC', 'fps': fps,
+         'source_fps': source_fps},
+        {'type': 'audio', 'codec': 'AAC', 'language': 'eng'},
+    ]
+
+
+class TestVerifyMp4(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, traks, **kwargs):
+        path = os.path.join(self.dir, 't.mp4')
+        f = open(path, 'wb')
+        try:
+            f.write(boxes.mp4(traks, **kwargs))
+        finally:
+            f.close()
+        return path
+
+    def verify(self, path, exp, duration):
+        return simplemkv.tomp4.verify_mp4(path, exp, duration)
+
+    def test_good(self):
+        path = self.write(boxes.av_traks(100))
+        self.assertEqual(self.verify(path, expected(), 100.0), [])
+
+    def test_short(self):
+        path = self.write(boxes.av_traks(50))
+        problems = self.verify(path, expected(), 100.0)
+        self.assertTrue([p for p in problems if 'video duration' in p])
+        self.assertTrue([p for p in problems if 'audio duration' in p])
+
+    def test_missing_track(self):
+        path = self.write(boxes.av_traks(100)[:1])
+        problems = self.verify(path, expected(), 100.0)
+        self.assertIn('no audio track', problems)
+
+    def test_truncated(self):
+        path = self.write(boxes.av_traks(100), moov_first=True, truncate=10)
+        self.assertIn('mdat is truncated',
+                      self.verify(path, expected(), 100.0))
+
+    def test_forced_fps(self):
+        # 100s of 24fps video played at 25fps lasts 96s; the audio doesn't
+        # change.
+        video, audio = boxes.av_traks(100, fps=24.0)
+        video = boxes.trak(b'vide', b'avc1', 25000, 1000, 2400)
+        path = self.write([video, audio])
+        self.assertEqual(
+            self.verify(path, expected(fps=25.0, source_fps=24.0), 100.0), [])
+
+    def test_forced_fps_wrong_frames(self):
+        video, audio = boxes.av_traks(100, fps=24.0)
+        video = boxes.trak(b'vide', b'avc1', 25000, 1000, 2000)
+        path = self.write([video, audio])
+        problems = self.verify(path, expected(fps=25.0, source_fps=24.0),
+                               100.0)
+        self.assertTrue([p for p in problems if 'frames' in p])
+
+    def test_forced_fps_unknown_source(self):
+        video, audio = boxes.av_traks(100, fps=24.0)
+        video = boxes.trak(b'vide', b'avc1', 25000, 1000, 2400)
+        path = self.write([video, audio])
+        self.assertEqual(
+            self.verify(path, expected(fps=25.0, source_fps=None), 100.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()